@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+ETJCA Activity Log - Registro attività partizionato per mese (PostgreSQL, migrazione 0009)
+Partizioni dei mesi futuri create in anticipo, mesi vecchi esportati in CSV compressi e staccati
+dalla tabella, timeline del singolo prospect letta solo dalle partizioni del periodo richiesto
+Uso: python activity_log.py [--partizioni | --archivia | --ripristina file.csv.gz]
+"""
+
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import logging
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Partizioni pronte in anticipo: gli inserimenti non finiscono mai nella partizione di default
+MESI_AVANTI = int(os.getenv('ATTIVITA_MESI_AVANTI', 3))
+# Mesi tenuti nel database; 0 = nessuna archiviazione (su Railway serve un volume persistente)
+ARCHIVIO_MESI = int(os.getenv('ATTIVITA_ARCHIVIO_MESI', 0))
+ARCHIVIO_DIR = os.getenv('ATTIVITA_ARCHIVIO_DIR', 'archivio_attivita')
+# Periodo della timeline se la richiesta non indica ?dal=
+TIMELINE_MESI = int(os.getenv('ATTIVITA_TIMELINE_MESI', 12))
+TIMELINE_MAX_LIMIT = 200
+
+COLUMNS = ('id', 'id_prospect', 'tipo', 'data', 'oggetto', 'descrizione', 'esito')
+PARTITION = re.compile(r'attivita_(\d{4})_(\d{2})$')
+
+def month_start(day: date, offset: int = 0) -> datetime:
+    """Primo giorno del mese di day spostato di offset mesi (confine delle partizioni)"""
+    month = day.year * 12 + day.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f'attivita_{month.year:04d}_{month.month:02d}'
+
+class ActivityLog:
+    """Manutenzione delle partizioni di attivita e timeline per prospect"""
+    
+    def __init__(self, db_manager, directory: Optional[str] = None):
+        self.db_manager = db_manager
+        self.directory = directory or ARCHIVIO_DIR
+    
+    @property
+    def partitioned(self) -> bool:
+        # Il backend è scelto alla prima connessione; su SQLite attivita è una tabella unica
+        if not self.db_manager.connected:
+            raise Exception("Database non connesso")
+        return self.db_manager.dialect != 'sqlite'
+    
+    def ensure_partitions(self, mesi_avanti: int = MESI_AVANTI) -> int:
+        """Crea le partizioni mancanti dal mese corrente a mesi_avanti; restituisce quante ne ha create"""
+        if not self.partitioned:
+            return 0
+        oggi = date.today()
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT etjca_partizioni_attivita(%s, %s)',
+                           (month_start(oggi).date(), month_start(oggi, mesi_avanti).date()))
+            create = cursor.fetchone()[0]
+        if create:
+            logging.info(f"🗂️ Partizioni attività create: {create}")
+        return create
+    
+    def partitions(self) -> List[Dict]:
+        """Partizioni mensili con righe stimate e dimensione su disco"""
+        if not self.partitioned:
+            return []
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.relname, c.reltuples::bigint, pg_total_relation_size(c.oid)
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'attivita'::regclass
+                ORDER BY c.relname
+            ''')
+            return [
+                {'nome': nome, 'righe_stimate': max(righe, 0), 'byte': byte}
+                for nome, righe, byte in cursor.fetchall()
+            ]
+    
+    def archive(self, mesi: int = ARCHIVIO_MESI, progress: Optional[Callable[[int], None]] = None) -> List[Dict]:
+        """Esporta in ARCHIVIO_DIR/attivita_AAAA_MM.csv.gz i mesi più vecchi di mesi e li toglie dal database;
+        progress(mesi_elaborati) dopo ogni mese"""
+        if mesi <= 0:
+            raise ValueError("Numero di mesi da mantenere non valido")
+        limite = month_start(date.today(), -mesi)
+        os.makedirs(self.directory, exist_ok=True)
+        if self.partitioned:
+            mesi_vecchi = [
+                datetime(int(match.group(1)), int(match.group(2)), 1)
+                for match in (PARTITION.match(p['nome']) for p in self.partitions())
+                if match
+            ]
+            archive_month = self._archive_partition
+        else:
+            mesi_vecchi = self._sqlite_months(limite)
+            archive_month = self._archive_rows
+        
+        archiviati = []
+        for n, mese in enumerate(sorted(m for m in mesi_vecchi if m < limite), 1):
+            path = os.path.join(self.directory, f'{partition_name(mese)}.csv.gz')
+            righe = archive_month(mese, path)
+            if progress:
+                progress(n)
+            if righe is None:
+                continue
+            archiviati.append({'mese': mese.strftime('%Y-%m'), 'righe': righe, 'file': path})
+            logging.info(f"📦 Attività {mese:%Y-%m} archiviate: {righe} righe in {path}")
+        return archiviati
+    
+    def _archive_partition(self, mese: datetime, path: str) -> int:
+        """COPY della partizione nel file, poi DETACH e DROP nella stessa transazione"""
+        nome = partition_name(mese)
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            # Nessuna scrittura sul mese tra l'esportazione e il distacco
+            cursor.execute(f'LOCK TABLE {nome} IN SHARE MODE')
+            cursor.execute(f'SELECT COUNT(*) FROM {nome}')
+            righe = cursor.fetchone()[0]
+            # File temporaneo e rinomina: un file completo oppure nessuno
+            with gzip.open(path + '.tmp', 'wt', encoding='utf-8', newline='') as handle:
+                cursor.copy_expert(
+                    f"COPY (SELECT {', '.join(COLUMNS)} FROM {nome} ORDER BY data, id) "
+                    f"TO STDOUT WITH (FORMAT csv, HEADER true)",
+                    handle
+                )
+            os.replace(path + '.tmp', path)
+            cursor.execute(f'ALTER TABLE attivita DETACH PARTITION {nome}')
+            cursor.execute(f'DROP TABLE {nome}')
+        return righe
+    
+    def _sqlite_months(self, limite: datetime) -> List[datetime]:
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MIN(data) FROM attivita WHERE data < %s', (limite,))
+            primo = cursor.fetchone()[0]
+        if primo is None:
+            return []
+        mesi, mese = [], month_start(primo)
+        while mese < limite:
+            mesi.append(mese)
+            mese = month_start(mese, 1)
+        return mesi
+    
+    def _archive_rows(self, mese: datetime, path: str) -> Optional[int]:
+        """SQLite: righe del mese nel file e DELETE nella stessa transazione"""
+        fine = month_start(mese, 1)
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {', '.join(COLUMNS)} FROM attivita
+                WHERE data >= %s AND data < %s ORDER BY data, id
+            ''', (mese, fine))
+            righe = 0
+            with gzip.open(path + '.tmp', 'wt', encoding='utf-8', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(COLUMNS)
+                for row in cursor:
+                    writer.writerow(['' if value is None else value for value in row])
+                    righe += 1
+            if not righe:
+                # Mese senza attività: nessun file
+                os.remove(path + '.tmp')
+                return None
+            os.replace(path + '.tmp', path)
+            cursor.execute('DELETE FROM attivita WHERE data >= %s AND data < %s', (mese, fine))
+        self.db_manager.invalidate_stats()
+        return righe
+    
+    def restore(self, path: str) -> int:
+        """Reinserisce un mese archiviato (stesso id); su PostgreSQL ricrea la sua partizione"""
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as handle:
+            header = next(csv.reader([handle.readline()]), None)
+            if tuple(header or ()) != COLUMNS:
+                raise ValueError(f"File di archivio non valido: {path}")
+            with self.db_manager.connection() as conn:
+                cursor = conn.cursor()
+                cursor.copy_expert(f"COPY attivita ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", handle)
+                righe = cursor.rowcount
+                if self.partitioned:
+                    # Le righe sono entrate nella partizione di default: spostate in quella del mese
+                    cursor.execute('''
+                        SELECT etjca_partizioni_attivita(MIN(data)::date, MAX(data)::date)
+                        FROM attivita_default
+                    ''')
+        self.db_manager.invalidate_stats()
+        logging.info(f"♻️ Attività ripristinate da {path}: {righe} righe")
+        return righe
+    
+    def timeline(self, prospect_id: int, dal: Optional[datetime] = None, al: Optional[datetime] = None,
+                 limit: int = 50, after: Optional[Tuple[datetime, int]] = None) -> List[Dict]:
+        """Attività del prospect dalla più recente, paginate su (data, id); il periodo
+        [dal, al) limita le partizioni lette (ultimi TIMELINE_MESI mesi se dal manca)"""
+        limit = max(1, min(int(limit), TIMELINE_MAX_LIMIT))
+        if dal is None:
+            dal = month_start(date.today(), -TIMELINE_MESI)
+        conditions, params = ['id_prospect = %s', 'data >= %s'], [prospect_id, dal]
+        if al is not None:
+            conditions.append('data < %s')
+            params.append(al)
+        if after is not None:
+            # data <= anche da sola: il confronto tra tuple non esclude le partizioni più recenti
+            conditions.append('data <= %s AND (data, id) < (%s, %s)')
+            params.extend([after[0], after[0], after[1]])
+        
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {', '.join(COLUMNS)} FROM attivita
+                WHERE {' AND '.join(conditions)}
+                ORDER BY data DESC, id DESC
+                LIMIT %s
+            ''', params + [limit])
+            rows = cursor.fetchall()
+        return [
+            dict(zip(COLUMNS, row), data=row[3].isoformat() if row[3] else None)
+            for row in rows
+        ]
+    
+    def run_job(self, job: Dict, queue) -> Dict:
+        """Handler job 'manutenzione_attivita': partizioni future e, se configurata, archiviazione"""
+        risultato = {'partizioni_create': self.ensure_partitions()}
+        mesi = int(job['payload'].get('archivio_mesi', ARCHIVIO_MESI))
+        if mesi > 0:
+            # Avanzamento per mese: l'esportazione di un mese grande non fa scadere il job
+            risultato['archiviati'] = self.archive(
+                mesi, progress=lambda n: queue.set_progress(job['id'], job['worker'], n, 0)
+            )
+        logging.info(f"🗂️ Manutenzione attività: {risultato}")
+        return risultato
+
+def main(argv: List[str]) -> int:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Import qui: il modulo principale applica le migrazioni all'avvio
+    from etjca_cloud_agent import db_manager
+    
+    if not db_manager.connected:
+        print("Database non connesso")
+        return 1
+    log = ActivityLog(db_manager)
+    if argv[:1] == ['--archivia']:
+        result = log.archive(int(argv[1]) if len(argv) > 1 else ARCHIVIO_MESI)
+    elif argv[:1] == ['--ripristina'] and len(argv) > 1:
+        result = {'righe': log.restore(argv[1])}
+    else:
+        log.ensure_partitions()
+        result = log.partitions()
+    print(json.dumps(result, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+ETJCA Bulk Import - Importazione massiva prospect
+Lettura in streaming di CSV, XLSX e NDJSON, validazione a blocchi,
+COPY in tabella di staging e upsert set-based nella tabella prospect
+"""
+
+import io
+import csv
+import json
+import logging
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dedup import DuplicateIndex, same_key
+
+# Colonne importabili nell'ordine della tabella di staging
+IMPORT_COLUMNS = [
+    'ragione_sociale', 'settore', 'fatturato', 'dipendenti', 'indirizzo', 'provincia',
+    'telefono', 'email', 'sito_web', 'nome_hr', 'cognome_hr', 'email_hr',
+    'linkedin_hr', 'fonte', 'stato', 'priorita', 'note'
+]
+
+# Lunghezze massime come da schema della tabella prospect
+MAX_LENGTHS = {
+    'ragione_sociale': 255, 'settore': 100, 'provincia': 50, 'telefono': 50,
+    'email': 255, 'sito_web': 255, 'nome_hr': 100, 'cognome_hr': 100,
+    'email_hr': 255, 'linkedin_hr': 255, 'fonte': 50, 'stato': 50, 'priorita': 20
+}
+
+# Intestazioni alternative frequenti negli elenchi Camera di Commercio
+HEADER_ALIASES = {
+    'denominazione': 'ragione_sociale',
+    'azienda': 'ragione_sociale',
+    'ragione sociale': 'ragione_sociale',
+    'attivita': 'settore',
+    'settore attivita': 'settore',
+    'addetti': 'dipendenti',
+    'numero dipendenti': 'dipendenti',
+    'sede': 'indirizzo',
+    'pec': 'email',
+    'sito': 'sito_web',
+    'sito web': 'sito_web',
+}
+
+PRIORITA_VALIDE = {'bassa', 'media', 'alta', 'urgente'}
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+STAGING_DDL = '''
+    CREATE TEMP TABLE IF NOT EXISTS prospect_staging (
+        riga INTEGER,
+        ragione_sociale TEXT,
+        settore TEXT,
+        fatturato BIGINT,
+        dipendenti INTEGER,
+        indirizzo TEXT,
+        provincia TEXT,
+        telefono TEXT,
+        email TEXT,
+        sito_web TEXT,
+        nome_hr TEXT,
+        cognome_hr TEXT,
+        email_hr TEXT,
+        linkedin_hr TEXT,
+        fonte TEXT,
+        stato TEXT,
+        priorita TEXT,
+        note TEXT
+    ) ON COMMIT DELETE ROWS
+'''
+
+# Ultima riga del file per ogni chiave azienda (ragione sociale + provincia)
+# ROW_NUMBER invece di DISTINCT ON: stessa query su PostgreSQL e SQLite
+STAGING_DEDUP = '''
+    SELECT * FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY lower(ragione_sociale), COALESCE(provincia, '') ORDER BY riga DESC
+        ) AS ultima
+        FROM prospect_staging
+    ) righe
+    WHERE ultima = 1
+'''
+
+UPSERT_UPDATE = f'''
+    UPDATE prospect p SET
+        settore = COALESCE(s.settore, p.settore),
+        fatturato = COALESCE(s.fatturato, p.fatturato),
+        dipendenti = COALESCE(s.dipendenti, p.dipendenti),
+        indirizzo = COALESCE(s.indirizzo, p.indirizzo),
+        telefono = COALESCE(s.telefono, p.telefono),
+        email = COALESCE(s.email, p.email),
+        sito_web = COALESCE(s.sito_web, p.sito_web),
+        nome_hr = COALESCE(s.nome_hr, p.nome_hr),
+        cognome_hr = COALESCE(s.cognome_hr, p.cognome_hr),
+        email_hr = COALESCE(s.email_hr, p.email_hr),
+        linkedin_hr = COALESCE(s.linkedin_hr, p.linkedin_hr),
+        priorita = COALESCE(s.priorita, p.priorita),
+        note = COALESCE(s.note, p.note)
+    FROM ({STAGING_DEDUP}) s
+    WHERE lower(p.ragione_sociale) = lower(s.ragione_sociale)
+      AND COALESCE(p.provincia, '') = COALESCE(s.provincia, '')
+'''
+
+UPSERT_INSERT = f'''
+    INSERT INTO prospect (
+        ragione_sociale, settore, fatturato, dipendenti, indirizzo, provincia,
+        telefono, email, sito_web, nome_hr, cognome_hr, email_hr,
+        linkedin_hr, fonte, stato, priorita, note
+    )
+    SELECT s.ragione_sociale, COALESCE(s.settore, ''), s.fatturato, s.dipendenti,
+           COALESCE(s.indirizzo, ''), COALESCE(s.provincia, ''), COALESCE(s.telefono, ''),
+           COALESCE(s.email, ''), COALESCE(s.sito_web, ''), COALESCE(s.nome_hr, ''),
+           COALESCE(s.cognome_hr, ''), COALESCE(s.email_hr, ''), COALESCE(s.linkedin_hr, ''),
+           COALESCE(s.fonte, 'import_bulk'), COALESCE(s.stato, 'nuovo'),
+           COALESCE(s.priorita, 'media'), COALESCE(s.note, '')
+    FROM ({STAGING_DEDUP}) s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM prospect p
+        WHERE lower(p.ragione_sociale) = lower(s.ragione_sociale)
+          AND COALESCE(p.provincia, '') = COALESCE(s.provincia, '')
+    )
+'''
+
+def normalize_header(header) -> str:
+    """Normalizza un'intestazione di colonna"""
+    name = str(header or '').strip().lower().replace('-', ' ').replace('_', ' ')
+    name = re.sub(r'\s+', ' ', name)
+    if name in HEADER_ALIASES:
+        return HEADER_ALIASES[name]
+    return name.replace(' ', '_')
+
+def _check_headers(headers: List[str]):
+    if 'ragione_sociale' not in headers:
+        raise ValueError("Colonna 'ragione_sociale' mancante nel file")
+
+def iter_csv_rows(stream, encoding: str = 'utf-8-sig') -> Iterator[Tuple[int, Optional[Dict]]]:
+    """Legge un CSV in streaming (separatore ',' o ';' rilevato dall'intestazione)"""
+    text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    header_line = text.readline()
+    delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+    headers = [normalize_header(h) for h in next(csv.reader([header_line], delimiter=delimiter), [])]
+    _check_headers(headers)
+    
+    for riga, values in enumerate(csv.reader(text, delimiter=delimiter), start=2):
+        if not any(v.strip() for v in values):
+            continue
+        yield riga, dict(zip(headers, values))
+
+def iter_xlsx_rows(stream) -> Iterator[Tuple[int, Optional[Dict]]]:
+    """Legge il primo foglio di un XLSX in modalità read-only"""
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [normalize_header(h) for h in next(rows, ())]
+        _check_headers(headers)
+        
+        for riga, values in enumerate(rows, start=2):
+            if not any(v not in (None, '') for v in values):
+                continue
+            yield riga, dict(zip(headers, values))
+    finally:
+        workbook.close()
+
+def iter_ndjson_rows(stream, encoding: str = 'utf-8') -> Iterator[Tuple[int, Optional[Dict]]]:
+    """Legge un file NDJSON (un oggetto JSON per riga)"""
+    for riga, line in enumerate(io.TextIOWrapper(stream, encoding=encoding), start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield riga, None
+            continue
+        if not isinstance(data, dict):
+            yield riga, None
+            continue
+        yield riga, {normalize_header(k): v for k, v in data.items()}
+
+READERS = {
+    'csv': iter_csv_rows,
+    'xlsx': iter_xlsx_rows,
+    'ndjson': iter_ndjson_rows,
+}
+
+def detect_format(filename: str = '', content_type: str = '') -> Optional[str]:
+    """Determina il formato da estensione o content type"""
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith('.xlsx') or 'spreadsheetml' in content_type:
+        return 'xlsx'
+    if filename.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    if filename.endswith(('.csv', '.txt')) or 'csv' in content_type:
+        return 'csv'
+    return None
+
+def read_rows(stream, formato: str) -> Iterator[Tuple[int, Optional[Dict]]]:
+    """Iteratore (numero riga, dati) per il formato richiesto"""
+    if formato not in READERS:
+        raise ValueError(f"Formato non supportato: {formato}")
+    return READERS[formato](stream)
+
+def _parse_number(value) -> Optional[int]:
+    """Converte numeri anche in formato italiano (1.250.000,50 €)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().replace('€', '').replace(' ', '')
+    if not text:
+        return None
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    elif text.count('.') > 1 or re.match(r'^\d{1,3}\.\d{3}$', text):
+        text = text.replace('.', '')
+    return int(float(text))
+
+def validate_row(row: Optional[Dict]) -> Tuple[Optional[tuple], Optional[str]]:
+    """Valida una riga e restituisce (valori per staging, errore)"""
+    if row is None:
+        return None, 'Riga non leggibile'
+    
+    values = {}
+    for column in IMPORT_COLUMNS:
+        value = row.get(column)
+        if column in ('fatturato', 'dipendenti'):
+            try:
+                values[column] = _parse_number(value)
+            except (TypeError, ValueError):
+                return None, f"Valore non numerico per {column}: {value}"
+            if values[column] is not None and values[column] < 0:
+                return None, f"Valore negativo per {column}"
+            continue
+        
+        text = str(value).strip() if value is not None else ''
+        max_length = MAX_LENGTHS.get(column)
+        if max_length and len(text) > max_length:
+            return None, f"{column} supera {max_length} caratteri"
+        values[column] = text or None
+    
+    if not values['ragione_sociale']:
+        return None, 'Ragione sociale obbligatoria'
+    for column in ('email', 'email_hr'):
+        if values[column] and not EMAIL_RE.match(values[column]):
+            return None, f"Indirizzo {column} non valido: {values[column]}"
+    if values['priorita']:
+        values['priorita'] = values['priorita'].lower()
+        if values['priorita'] not in PRIORITA_VALIDE:
+            return None, f"Priorità non valida: {values['priorita']}"
+    
+    return tuple(values[c] for c in IMPORT_COLUMNS), None
+
+class BulkImporter:
+    """Importazione a blocchi: validazione, COPY in staging e upsert"""
+    
+    def __init__(self, db_manager, chunk_size: int = 5000, max_errors: int = 1000, duplicates=None):
+        self.db_manager = db_manager
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        # DuplicateDetector: righe simili ad aziende esistenti (con altra chiave) scartate
+        self.duplicates = duplicates
+    
+    def run(self, rows: Iterator[Tuple[int, Optional[Dict]]]) -> Dict:
+        """Importa tutte le righe e restituisce il report"""
+        report = {
+            'righe_lette': 0,
+            'inserite': 0,
+            'aggiornate': 0,
+            'scartate': 0,
+            'duplicati': 0,
+            'errori': []
+        }
+        # Duplicati interni al file con nome diverso (quelli identici li gestisce lo staging)
+        file_index = DuplicateIndex(self.duplicates.index.threshold) if self.duplicates else None
+        
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(STAGING_DDL)
+            conn.commit()
+            
+            chunk = []
+            for riga, row in rows:
+                report['righe_lette'] += 1
+                values, error = validate_row(row)
+                if error:
+                    report['scartate'] += 1
+                    if len(report['errori']) < self.max_errors:
+                        report['errori'].append({'riga': riga, 'errore': error})
+                    continue
+                
+                chunk.append((riga,) + values)
+                if len(chunk) >= self.chunk_size:
+                    self._load_chunk(conn, cursor, self._skip_duplicates(chunk, file_index, report), report)
+                    chunk = []
+            
+            if chunk:
+                self._load_chunk(conn, cursor, self._skip_duplicates(chunk, file_index, report), report)
+        
+        self.db_manager.invalidate_stats()
+        report['errori_troncati'] = report['scartate'] + report['duplicati'] > len(report['errori'])
+        logging.info(
+            f"Import completato: {report['inserite']} inseriti, {report['aggiornate']} aggiornati, "
+            f"{report['scartate']} scartati, {report['duplicati']} possibili duplicati"
+        )
+        return report
+    
+    def _skip_duplicates(self, chunk: List[tuple], file_index: Optional[DuplicateIndex], report: Dict) -> List[tuple]:
+        """Toglie dal blocco le righe simili ad aziende esistenti o a righe precedenti del file"""
+        if not self.duplicates or not chunk:
+            return chunk
+        
+        rows = [dict(zip(IMPORT_COLUMNS, values[1:])) for values in chunk]
+        kept = []
+        for values, row, candidati in zip(chunk, rows, self.duplicates.find_many(rows)):
+            if not any(same_key(c, row) for c in candidati):
+                simili = candidati
+            else:
+                # Stessa ragione sociale e provincia di un prospect esistente: è un aggiornamento
+                simili = []
+            if not simili and not candidati:
+                simili = [
+                    file_index.info(key) for key, _, _ in
+                    file_index.match(row['ragione_sociale'], row['sito_web'], (row['email'], row['email_hr']))
+                    if not same_key(file_index.info(key), row)
+                ]
+            if simili:
+                report['duplicati'] += 1
+                if len(report['errori']) < self.max_errors:
+                    origine = f"#{simili[0]['id']}" if simili[0].get('id') else f"riga {simili[0]['riga']}"
+                    report['errori'].append({
+                        'riga': values[0],
+                        'errore': f"Possibile duplicato di {origine} {simili[0]['ragione_sociale']}"
+                    })
+                continue
+            
+            file_index.add(values[0], row['ragione_sociale'], row['sito_web'], (row['email'], row['email_hr']), {
+                'riga': values[0], 'ragione_sociale': row['ragione_sociale'], 'provincia': row['provincia'] or ''
+            })
+            kept.append(values)
+        return kept
+    
+    def _load_chunk(self, conn, cursor, chunk: List[tuple], report: Dict):
+        """COPY del blocco in staging e upsert in una singola transazione"""
+        if not chunk:
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        
+        # Serializza gli import concorrenti per evitare doppi inserimenti
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('prospect_bulk_import'))")
+        cursor.copy_expert(
+            f"COPY prospect_staging (riga, {', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+        cursor.execute(UPSERT_UPDATE)
+        report['aggiornate'] += cursor.rowcount
+        cursor.execute(UPSERT_INSERT)
+        report['inserite'] += cursor.rowcount
+        conn.commit()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+ETJCA Dedup - Riconoscimento aziende duplicate
+Nome normalizzato (senza forma societaria e località), indice di trigrammi in memoria
+con filtro a prefisso, dominio di sito ed email; cluster dei duplicati esistenti e unione
+"""
+
+import os
+import re
+import math
+import time
+import logging
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+SOGLIA = 0.6
+
+# Secondi tra due letture dei prospect modificati; i nuovi id vengono letti a ogni controllo
+REFRESH_INTERVAL = float(os.getenv('DEDUP_REFRESH_INTERVAL', 30))
+# aggiornato_il è l'ora di inizio della transazione: le modifiche ancora in corso alla lettura
+# precedente hanno un'ora più vecchia, coperta dal margine (secondi)
+SOVRAPPOSIZIONE = int(os.getenv('DEDUP_SOVRAPPOSIZIONE', 600))
+
+# Forme societarie dopo la rimozione della punteggiatura ("S.p.A." -> "s p a")
+LEGAL_FORMS = re.compile(r'''\b(
+    s\s?p\s?a | s\s?r\s?l(\s?s)? | s\s?n\s?c | s\s?a\s?s | s\s?a\s?p\s?a | s\s?c\s?a?\s?r\s?l |
+    soc(ieta)?\s+coop(erativa)?(\s+a\s+r\s?l)? | coop | societa | unipersonale | in\s+liquidazione
+)\b''', re.VERBOSE)
+
+# Domini di posta non aziendali: non identificano l'azienda
+GENERIC_DOMAINS = {
+    'gmail.com', 'libero.it', 'hotmail.com', 'hotmail.it', 'outlook.com', 'outlook.it', 'live.it',
+    'yahoo.com', 'yahoo.it', 'virgilio.it', 'tiscali.it', 'alice.it', 'tin.it', 'fastwebnet.it',
+    'icloud.com', 'email.it', 'pec.it', 'legalmail.it', 'arubapec.it', 'postecert.it', 'pec.net',
+}
+
+# Campi completati dai duplicati se vuoti nel prospect principale
+MERGE_FIELDS = [
+    'settore', 'indirizzo', 'provincia', 'telefono', 'email', 'sito_web',
+    'nome_hr', 'cognome_hr', 'email_hr', 'linkedin_hr'
+]
+
+class DuplicateProspectError(Exception):
+    """Inserimento bloccato: il prospect somiglia ad aziende già presenti"""
+    
+    def __init__(self, candidati: List[Dict]):
+        self.candidati = candidati
+        nomi = ', '.join(f"#{c['id']} {c['ragione_sociale']}" for c in candidati[:3])
+        super().__init__(f"Possibile duplicato di {nomi}")
+
+def normalize_name(name: Optional[str]) -> str:
+    """'ACME S.p.A. - Udine' -> 'acme'"""
+    text = unicodedata.normalize('NFKD', name or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    # La parte dopo " - " è di solito la sede
+    text = re.split(r'\s[-–]\s', text)[0]
+    text = re.sub(r'[^a-z0-9]+', ' ', text.replace('&', ' e ')).strip()
+    stripped = ' '.join(LEGAL_FORMS.sub(' ', text).split())
+    return stripped or text
+
+def site_domain(url: Optional[str]) -> Optional[str]:
+    domain = re.sub(r'^[a-z]+://', '', (url or '').strip().lower()).split('/')[0].split(':')[0]
+    domain = domain[4:] if domain.startswith('www.') else domain
+    return domain if '.' in domain else None
+
+def email_domain(email: Optional[str]) -> Optional[str]:
+    _, _, domain = (email or '').strip().lower().rpartition('@')
+    return domain if '.' in domain and domain not in GENERIC_DOMAINS else None
+
+def domains_of(sito_web: Optional[str], emails: Iterable[Optional[str]]) -> Set[str]:
+    return {d for d in [site_domain(sito_web)] + [email_domain(e) for e in emails] if d}
+
+def numbers(text: str) -> frozenset:
+    return frozenset(word for word in text.split() if any(c.isdigit() for c in word))
+
+def trigrams(text: str) -> frozenset:
+    """Trigrammi per parola con padding, come pg_trgm"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+class DuplicateIndex:
+    """Indice invertito trigramma -> aziende, con ricerca per similarità di Jaccard"""
+    
+    def __init__(self, threshold: float = SOGLIA):
+        self.threshold = threshold
+        self.entries: Dict[Hashable, Tuple[str, frozenset, Set[str], Dict]] = {}
+        self.postings: Dict[str, Set[Hashable]] = defaultdict(set)
+        self.numbers: Dict[str, Set[Hashable]] = defaultdict(set)
+        self.domains: Dict[str, Set[Hashable]] = defaultdict(set)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def add(self, key: Hashable, ragione_sociale: str, sito_web: Optional[str] = None,
+            emails: Iterable[Optional[str]] = (), info: Optional[Dict] = None):
+        if key in self.entries:
+            self.remove(key)
+        name = normalize_name(ragione_sociale)
+        grams = trigrams(name)
+        domains = domains_of(sito_web, emails)
+        self.entries[key] = (name, grams, domains, info or {})
+        for gram in grams:
+            self.postings[gram].add(key)
+        for number in numbers(name):
+            self.numbers[number].add(key)
+        for domain in domains:
+            self.domains[domain].add(key)
+    
+    def remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for gram in entry[1]:
+            self.postings[gram].discard(key)
+        for number in numbers(entry[0]):
+            self.numbers[number].discard(key)
+        for domain in entry[2]:
+            self.domains[domain].discard(key)
+    
+    def match(self, ragione_sociale: str, sito_web: Optional[str] = None,
+              emails: Iterable[Optional[str]] = (), limit: int = 5) -> List[Tuple[Hashable, float, str]]:
+        """Candidati (chiave, punteggio, motivo) in ordine di somiglianza"""
+        name = normalize_name(ragione_sociale)
+        return self._match(name, trigrams(name), domains_of(sito_web, emails), limit)
+    
+    def match_entry(self, key: Hashable, limit: int = 50) -> List[Tuple[Hashable, float, str]]:
+        """Candidati simili a un elemento già indicizzato (esclude l'elemento stesso)"""
+        name, grams, domains, _ = self.entries[key]
+        return [match for match in self._match(name, grams, domains, limit + 1) if match[0] != key][:limit]
+    
+    def _match(self, name: str, grams: frozenset, domains: Set[str], limit: int) -> List[Tuple[Hashable, float, str]]:
+        best: Dict[Hashable, Tuple[float, str]] = {}
+        for domain in domains:
+            for key in self.domains.get(domain, ()):
+                best[key] = (1.0, 'dominio')
+        
+        query_numbers = numbers(name)
+        if grams and query_numbers:
+            # Numeri nel nome ("Fonderia 2000", "Logistica 3"): distinguono aziende diverse,
+            # i candidati devono condividerli
+            candidates = set()
+            for number in query_numbers:
+                candidates.update(self.numbers.get(number, ()))
+            candidates = {key for key in candidates if numbers(self.entries[key][0]) == query_numbers}
+        elif grams:
+            # Jaccard >= t implica almeno ceil(t*|Q|) trigrammi in comune: basta
+            # scorrere le liste dei |Q| - ceil(t*|Q|) + 1 trigrammi più rari
+            ordered = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))
+            prefix = ordered[:len(grams) - math.ceil(self.threshold * len(grams)) + 1]
+            candidates = set()
+            for gram in prefix:
+                candidates.update(self.postings.get(gram, ()))
+        else:
+            candidates = set()
+        
+        if candidates:
+            low, high = self.threshold * len(grams), len(grams) / self.threshold
+            for key in candidates:
+                other_name, other_grams, _, _ = self.entries[key]
+                if not low <= len(other_grams) <= high:
+                    continue
+                common = len(grams & other_grams)
+                score = 1.0 if other_name == name else common / (len(grams) + len(other_grams) - common)
+                if score >= self.threshold and score > best.get(key, (0, ''))[0]:
+                    best[key] = (round(score, 3), 'nome')
+        
+        ranked = sorted(best.items(), key=lambda item: -item[1][0])[:limit]
+        return [(key, score, motivo) for key, (score, motivo) in ranked]
+    
+    def info(self, key: Hashable) -> Dict:
+        return self.entries[key][3]
+
+def same_key(a: Dict, b: Dict) -> bool:
+    """Stessa chiave dell'upsert (ragione sociale + provincia): aggiornamento, non duplicato"""
+    return ((a.get('ragione_sociale') or '').lower() == (b.get('ragione_sociale') or '').lower()
+            and (a.get('provincia') or '') == (b.get('provincia') or ''))
+
+class DuplicateDetector:
+    """Indice dei prospect esistenti, aggiornato in modo incrementale per id e aggiornato_il.
+    Ogni processo (worker gunicorn, scheduler) tiene la propria copia completa in memoria"""
+    
+    def __init__(self, db_manager, threshold: Optional[float] = None, refresh_interval: float = REFRESH_INTERVAL):
+        self.db_manager = db_manager
+        self.index = DuplicateIndex(threshold or float(os.getenv('DEDUP_SOGLIA', SOGLIA)))
+        self.refresh_interval = refresh_interval
+        self.last_id = 0
+        # Punto di ripresa delle modifiche (ora del database meno SOVRAPPOSIZIONE)
+        self.since = None
+        self._next_scan = 0.0
+        self._lock = threading.RLock()
+    
+    def refresh(self):
+        """Carica nell'indice i prospect inseriti dopo l'ultimo aggiornamento e, al massimo ogni
+        refresh_interval secondi, reindicizza quelli modificati da upsert, unioni e modifiche"""
+        with self._lock:
+            scan = self.since is None or time.monotonic() >= self._next_scan
+            with self.db_manager.connection() as conn:
+                cursor = conn.cursor()
+                if scan:
+                    cursor.execute('SELECT CURRENT_TIMESTAMP - make_interval(secs => %s)', (SOVRAPPOSIZIONE,))
+                    since = cursor.fetchone()[0]
+                if scan and self.since is not None:
+                    cursor.execute('''
+                        SELECT id, ragione_sociale, provincia, sito_web, email, email_hr
+                        FROM prospect WHERE id > %s OR aggiornato_il > %s ORDER BY id
+                    ''', (self.last_id, self.since))
+                else:
+                    cursor.execute('''
+                        SELECT id, ragione_sociale, provincia, sito_web, email, email_hr
+                        FROM prospect WHERE id > %s ORDER BY id
+                    ''', (self.last_id,))
+                rows = cursor.fetchall()
+            for prospect_id, ragione_sociale, provincia, sito_web, email, email_hr in rows:
+                self._add(prospect_id, ragione_sociale, provincia, sito_web, (email, email_hr))
+            if scan:
+                self.since = since
+                self._next_scan = time.monotonic() + self.refresh_interval
+            if rows:
+                self.last_id = max(self.last_id, rows[-1][0])
+                if len(rows) > 1000:
+                    logging.info(f"🔎 Indice duplicati: {len(self.index)} aziende")
+    
+    def _add(self, prospect_id: int, ragione_sociale: str, provincia: Optional[str],
+             sito_web: Optional[str], emails: Iterable[Optional[str]]):
+        self.index.add(prospect_id, ragione_sociale, sito_web, emails, {
+            'id': prospect_id, 'ragione_sociale': ragione_sociale, 'provincia': provincia or ''
+        })
+    
+    def add(self, prospect_id: int, ragione_sociale: str, provincia: str = '',
+            sito_web: str = '', email: str = '', email_hr: str = ''):
+        with self._lock:
+            self._add(prospect_id, ragione_sociale, provincia, sito_web, (email, email_hr))
+    
+    def find(self, ragione_sociale: str, sito_web: str = '', email: str = '', email_hr: str = '') -> List[Dict]:
+        """Prospect esistenti simili, verificati sul database"""
+        return self.find_many([{
+            'ragione_sociale': ragione_sociale, 'sito_web': sito_web, 'email': email, 'email_hr': email_hr
+        }])[0]
+    
+    def find_many(self, rows: List[Dict]) -> List[List[Dict]]:
+        """Candidati per ogni riga: un solo aggiornamento dell'indice e una sola verifica"""
+        self.refresh()
+        with self._lock:
+            matches = [
+                [
+                    dict(self.index.info(key), punteggio=score, motivo=motivo)
+                    for key, score, motivo in self.index.match(
+                        row.get('ragione_sociale'), row.get('sito_web'), (row.get('email'), row.get('email_hr'))
+                    )
+                ]
+                for row in rows
+            ]
+        
+        # Le aziende unite o cancellate da altri processi escono dall'indice
+        ids = list({c['id'] for candidates in matches for c in candidates})
+        if ids:
+            with self.db_manager.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id FROM prospect WHERE id = ANY(%s)', (ids,))
+                existing = {row[0] for row in cursor.fetchall()}
+            with self._lock:
+                for prospect_id in set(ids) - existing:
+                    self.index.remove(prospect_id)
+            matches = [[c for c in candidates if c['id'] in existing] for candidates in matches]
+        return matches
+    
+    def cluster(self, progress=None) -> List[List[Dict]]:
+        """Raggruppa i prospect esistenti simili tra loro (union-find sulle coppie)"""
+        self.refresh()
+        parent: Dict[int, int] = {}
+        scores: Dict[int, Tuple[float, str]] = {}
+        
+        def root(key: int) -> int:
+            while parent.get(key, key) != key:
+                parent[key] = parent.get(parent[key], parent[key])
+                key = parent[key]
+            return key
+        
+        with self._lock:
+            keys = sorted(self.index.entries)
+            for n, key in enumerate(keys, start=1):
+                for other, score, motivo in self.index.match_entry(key):
+                    a, b = root(key), root(other)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+                    for member in (key, other):
+                        if score > scores.get(member, (0, ''))[0]:
+                            scores[member] = (score, motivo)
+                if progress and n % 5000 == 0:
+                    progress(n, len(keys))
+        
+        groups: Dict[int, List[Dict]] = defaultdict(list)
+        for key in scores:
+            groups[root(key)].append(dict(self.index.info(key), punteggio=scores[key][0], motivo=scores[key][1]))
+        return [sorted(members, key=lambda m: m['id']) for _, members in sorted(groups.items()) if len(members) > 1]
+    
+    def save_clusters(self, clusters: List[List[Dict]]):
+        rows = [
+            (members[0]['id'], member['id'], member['punteggio'], member['motivo'])
+            for members in clusters for member in members
+        ]
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM duplicati_cluster')
+            for start in range(0, len(rows), 1000):
+                chunk = rows[start:start + 1000]
+                cursor.execute(
+                    f"INSERT INTO duplicati_cluster (cluster, id_prospect, punteggio, motivo) VALUES "
+                    f"{', '.join(['(%s, %s, %s, %s)'] * len(chunk))} ON CONFLICT DO NOTHING",
+                    [value for row in chunk for value in row]
+                )
+    
+    def run_cluster_job(self, job: Dict, queue) -> Dict:
+        """Handler job 'cluster_duplicati': ricalcola i cluster e li salva per la revisione"""
+        clusters = self.cluster(progress=lambda n, totale: queue.set_progress(job['id'], job['worker'], n, 0, totale=totale))
+        self.save_clusters(clusters)
+        risultato = {'cluster': len(clusters), 'prospect_coinvolti': sum(len(c) for c in clusters)}
+        logging.info(f"🔎 Cluster duplicati: {risultato}")
+        return risultato
+    
+    def get_clusters(self, limit: int = 50) -> List[Dict]:
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT d.cluster, p.id, p.ragione_sociale, p.provincia, p.sito_web, p.email,
+                       p.stato, p.data_inserimento, d.punteggio, d.motivo
+                FROM duplicati_cluster d
+                JOIN prospect p ON p.id = d.id_prospect
+                WHERE d.cluster IN (
+                    SELECT DISTINCT cluster FROM duplicati_cluster ORDER BY cluster LIMIT %s
+                )
+                ORDER BY d.cluster, p.id
+            ''', (limit,))
+            rows = cursor.fetchall()
+        
+        clusters: Dict[int, List[Dict]] = defaultdict(list)
+        for cluster, *values in rows:
+            clusters[cluster].append(dict(zip(
+                ['id', 'ragione_sociale', 'provincia', 'sito_web', 'email', 'stato',
+                 'data_inserimento', 'punteggio', 'motivo'], values
+            )))
+        return [{'cluster': cluster, 'prospect': members} for cluster, members in clusters.items() if len(members) > 1]
+    
+    def merge(self, principale: int, duplicati: Iterable[int]) -> Dict:
+        """Unisce i duplicati nel prospect principale: campi vuoti, attività e outbox"""
+        duplicati = [int(d) for d in duplicati if int(d) != principale]
+        if not duplicati:
+            raise ValueError("Nessun duplicato da unire")
+        
+        columns = MERGE_FIELDS + ['fatturato', 'dipendenti', 'note']
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, {', '.join(columns)} FROM prospect WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+                ([principale] + duplicati,)
+            )
+            rows = {row[0]: dict(zip(columns, row[1:])) for row in cursor.fetchall()}
+            if principale not in rows:
+                raise ValueError(f"Prospect {principale} non trovato")
+            duplicati = [d for d in duplicati if d in rows]
+            
+            # Campi vuoti del principale dal primo duplicato (per id) che li ha, numeri dal massimo
+            p, altri = rows[principale], [rows[d] for d in sorted(duplicati)]
+            values = {field: p[field] or next((r[field] for r in altri if r[field]), p[field]) for field in MERGE_FIELDS}
+            for field in ('fatturato', 'dipendenti'):
+                values[field] = p[field] if p[field] is not None else max(
+                    (r[field] for r in altri if r[field] is not None), default=None
+                )
+            values['note'] = '\n'.join(filter(None, [p['note'], f"Uniti i duplicati: {', '.join(f'#{d}' for d in duplicati)}"]))
+            
+            cursor.execute(
+                f"UPDATE prospect SET {', '.join(f'{field} = %s' for field in values)} WHERE id = %s",
+                list(values.values()) + [principale]
+            )
+            cursor.execute('UPDATE attivita SET id_prospect = %s WHERE id_prospect = ANY(%s)', (principale, duplicati))
+            attivita = cursor.rowcount
+            cursor.execute('UPDATE email_outbox SET id_prospect = %s WHERE id_prospect = ANY(%s)', (principale, duplicati))
+            cursor.execute('UPDATE email_eventi SET id_prospect = %s WHERE id_prospect = ANY(%s)', (principale, duplicati))
+            cursor.execute('DELETE FROM prospect WHERE id = ANY(%s)', (duplicati,))
+        
+        with self._lock:
+            for prospect_id in duplicati:
+                self.index.remove(prospect_id)
+            # Il principale ha preso sito ed email dei duplicati: reindicizzato al prossimo controllo
+            self._next_scan = 0.0
+        self.db_manager.invalidate_stats()
+        logging.info(f"🔗 Prospect {principale}: uniti {len(duplicati)} duplicati")
+        return {'principale': principale, 'uniti': duplicati, 'attivita_spostate': attivita}
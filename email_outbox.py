@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+ETJCA Email Outbox - Coda transazionale dei messaggi da inviare
+Più worker svuotano l'outbox in parallelo con FOR UPDATE SKIP LOCKED; consegna almeno una volta:
+un messaggio inviato da un worker terminato prima di segnarlo viene rimesso in coda e reinviato
+"""
+
+import os
+import random
+import time
+import socket
+import smtplib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+OUTBOX_COLUMNS = ['id', 'id_prospect', 'job_id', 'destinatario', 'oggetto', 'corpo', 'tipo', 'tentativi']
+
+def is_session_error(error: Exception) -> bool:
+    """Errori della sessione SMTP (credenziali, connessione) e non del singolo messaggio"""
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return False
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, socket.gaierror))
+
+def is_transient(error: Exception) -> bool:
+    """Errori SMTP temporanei (4xx, disconnessioni, timeout) da ritentare"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, OSError))
+
+class SessionBackoff:
+    """Pausa degli invii dopo un errore di sessione SMTP, condivisa dai dispatcher del processo:
+    raddoppia a ogni errore consecutivo, perché login ripetuti con credenziali errate bloccano l'account"""
+    
+    def __init__(self, base: float, maximum: float):
+        self.base = base
+        self.maximum = maximum
+        self.errori = 0
+        self._until = 0.0
+        self._lock = threading.Lock()
+    
+    def remaining(self) -> float:
+        """Secondi di pausa rimasti (0 se gli invii sono consentiti)"""
+        return max(0.0, self._until - time.monotonic())
+    
+    def failed(self) -> float:
+        with self._lock:
+            self.errori += 1
+            pausa = min(self.base * (2 ** (self.errori - 1)), self.maximum)
+            self._until = time.monotonic() + pausa
+        return pausa
+    
+    def succeeded(self):
+        with self._lock:
+            self.errori = 0
+            self._until = 0.0
+
+class EmailOutbox:
+    """Outbox transazionale: accodamento idempotente e cambi di stato atomici"""
+    
+    def __init__(self, db_manager, max_tentativi: int = None, backoff_base: float = None,
+                 backoff_max: float = None, lease_timeout: int = None):
+        self.db_manager = db_manager
+        self.max_tentativi = max_tentativi or int(os.getenv('OUTBOX_MAX_TENTATIVI', 5))
+        self.backoff_base = backoff_base or float(os.getenv('OUTBOX_BACKOFF_BASE', 60))
+        self.backoff_max = backoff_max or float(os.getenv('OUTBOX_BACKOFF_MAX', 3600))
+        self.lease_timeout = lease_timeout or int(os.getenv('OUTBOX_LEASE_TIMEOUT', 600))
+        self.session_backoff = SessionBackoff(self.backoff_base, self.backoff_max)
+    
+    def enqueue(self, messages: List[Dict]) -> int:
+        """Accoda più messaggi in un'unica INSERT; la chiave evita doppi accodamenti"""
+        if not messages:
+            return 0
+        
+        rows = [
+            (m.get('chiave'), m.get('id_prospect'), m.get('job_id'), m['destinatario'],
+             m.get('oggetto'), m.get('corpo'), m.get('tipo', 'email'))
+            for m in messages
+        ]
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(rows))
+            cursor.execute(f'''
+                INSERT INTO email_outbox (chiave, id_prospect, job_id, destinatario, oggetto, corpo, tipo)
+                VALUES {values}
+                ON CONFLICT (chiave) DO NOTHING
+            ''', [value for row in rows for value in row])
+            inserted = cursor.rowcount
+        
+        logging.info(f"Outbox: {inserted} messaggi accodati")
+        return inserted
+    
+    def claim(self, worker: str, limit: int = 20) -> List[Dict]:
+        """Prenota un blocco di messaggi pronti; i lock saltati evitano che due worker prenotino lo stesso messaggio"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE email_outbox SET
+                    stato = 'in_invio',
+                    bloccato_da = %s,
+                    bloccato_il = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE stato = 'in_attesa' AND prossimo_tentativo <= CURRENT_TIMESTAMP
+                    ORDER BY prossimo_tentativo, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING {', '.join(OUTBOX_COLUMNS)}
+            ''', (worker, limit))
+            rows = cursor.fetchall()
+        
+        return sorted((dict(zip(OUTBOX_COLUMNS, row)) for row in rows), key=lambda m: m['id'])
+    
+    def mark_sent(self, message: Dict, worker: str):
+        """Segna il messaggio inviato e registra l'attività nella stessa transazione"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_outbox SET
+                    stato = 'inviata',
+                    inviato_il = CURRENT_TIMESTAMP,
+                    tentativi = tentativi + 1,
+                    bloccato_da = NULL
+                WHERE id = %s AND bloccato_da = %s
+            ''', (message['id'], worker))
+            if cursor.rowcount and message['id_prospect']:
+                cursor.execute('''
+                    INSERT INTO attivita (id_prospect, tipo, oggetto, descrizione, esito)
+                    VALUES (%s, %s, %s, %s, %s)
+                ''', (
+                    message['id_prospect'], message['tipo'], 'Email ETJCA inviata',
+                    f"Email inviata a {message['destinatario']}", 'inviata'
+                ))
+        self.db_manager.invalidate_stats()
+    
+    def mark_failed(self, message: Dict, worker: str, error: Exception):
+        """Ritenta con backoff esponenziale o chiude il messaggio come fallito"""
+        tentativi = message['tentativi'] + 1
+        definitivo = not is_transient(error) or tentativi >= self.max_tentativi
+        ritardo = min(self.backoff_base * (2 ** (tentativi - 1)), self.backoff_max)
+        ritardo *= random.uniform(0.8, 1.2)
+        
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_outbox SET
+                    stato = %s,
+                    tentativi = %s,
+                    ultimo_errore = %s,
+                    prossimo_tentativo = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                    bloccato_da = NULL
+                WHERE id = %s AND bloccato_da = %s
+            ''', ('fallita' if definitivo else 'in_attesa', tentativi, str(error), ritardo,
+                  message['id'], worker))
+            if cursor.rowcount and definitivo and message['id_prospect']:
+                cursor.execute('''
+                    INSERT INTO attivita (id_prospect, tipo, oggetto, descrizione, esito)
+                    VALUES (%s, %s, %s, %s, %s)
+                ''', (
+                    message['id_prospect'], f"{message['tipo']}_fallita", 'Email ETJCA non recapitata',
+                    f"Invio a {message['destinatario']} fallito: {error}", 'fallita'
+                ))
+        
+        if definitivo:
+            logging.error(f"Outbox {message['id']}: invio fallito definitivamente ({error})")
+        else:
+            logging.warning(f"Outbox {message['id']}: nuovo tentativo tra {int(ritardo)}s ({error})")
+    
+    def release(self, messages: List[Dict], worker: str, error: Optional[Exception] = None):
+        """Restituisce alla coda messaggi prenotati senza consumare tentativi"""
+        if not messages:
+            return
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_outbox SET stato = 'in_attesa', bloccato_da = NULL,
+                    ultimo_errore = COALESCE(%s, ultimo_errore)
+                WHERE id = ANY(%s) AND bloccato_da = %s AND stato = 'in_invio'
+            ''', (str(error) if error else None, [m['id'] for m in messages], worker))
+    
+    def recover_stale(self) -> int:
+        """Rimette in coda le prenotazioni di worker terminati senza rilasciarle
+        (un messaggio già inviato ma non ancora segnato viene inviato di nuovo)"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE email_outbox SET stato = 'in_attesa', bloccato_da = NULL
+                WHERE stato = 'in_invio'
+                  AND bloccato_il < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            ''', (self.lease_timeout,))
+            recovered = cursor.rowcount
+        
+        if recovered:
+            logging.warning(f"Outbox: {recovered} messaggi rimessi in coda dopo timeout")
+        return recovered
+    
+    def job_counts(self, job_id: int) -> Dict:
+        """Conteggi per stato dei messaggi di un job"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT
+                    COUNT(*) FILTER (WHERE stato = 'inviata'),
+                    COUNT(*) FILTER (WHERE stato = 'fallita'),
+                    COUNT(*) FILTER (WHERE stato IN ('in_attesa', 'in_invio')),
+                    MIN(prossimo_tentativo) FILTER (WHERE stato = 'in_attesa'),
+                    LOCALTIMESTAMP
+                FROM email_outbox WHERE job_id = %s
+            ''', (job_id,))
+            inviate, fallite, in_coda, prossimo, now = cursor.fetchone()
+        
+        return {
+            'inviate': inviate,
+            'fallite': fallite,
+            'in_coda': in_coda,
+            'prossimo_tentativo_tra': max((prossimo - now).total_seconds(), 0) if prossimo is not None else None
+        }
+    
+    def stats(self) -> Dict:
+        """Profondità dell'outbox per stato"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT stato, COUNT(*) FROM email_outbox GROUP BY stato')
+            return dict(cursor.fetchall())
+
+class OutboxDispatcher:
+    """Svuota l'outbox su una sessione SMTP riutilizzata, rispettando il rate limit"""
+    
+    def __init__(self, outbox: EmailOutbox, email_manager, batch_size: int = None,
+                 poll_interval: float = None):
+        self.outbox = outbox
+        self.email_manager = email_manager
+        self.batch_size = batch_size or int(os.getenv('OUTBOX_BATCH_SIZE', 20))
+        self.poll_interval = poll_interval or float(os.getenv('OUTBOX_POLL_INTERVAL', 10))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    
+    def dispatch_batch(self) -> int:
+        """Invia un blocco di messaggi; restituisce quanti ne ha tentati. Se cade la sessione SMTP
+        (credenziali, connessione) il blocco si interrompe, gli invii restano sospesi con backoff
+        esponenziale e l'errore viene rilanciato"""
+        if self.outbox.session_backoff.remaining():
+            return 0
+        messages = self.outbox.claim(self.worker_id, self.batch_size)
+        if not messages:
+            return 0
+        
+        attempted = 0
+        error = None
+        try:
+            with self.email_manager.smtp_session() as session:
+                for message in messages:
+                    self.email_manager.rate_limiter.acquire()
+                    try:
+                        session.send(self.email_manager.build_mime(
+                            message['destinatario'], message['oggetto'], message['corpo'],
+                            id_prospect=message['id_prospect'], id_messaggio=message['id']
+                        ))
+                    except Exception as e:
+                        if is_session_error(e):
+                            error = e
+                            raise
+                        attempted += 1
+                        self.outbox.mark_failed(message, self.worker_id, e)
+                        continue
+                    attempted += 1
+                    self.outbox.mark_sent(message, self.worker_id)
+                    self.outbox.session_backoff.succeeded()
+        except Exception as e:
+            if is_session_error(e):
+                pausa = self.outbox.session_backoff.failed()
+                logging.error(f"📮 Sessione SMTP non disponibile ({e}): invii sospesi per {int(pausa)}s")
+            raise
+        finally:
+            # Messaggi non tentati o interrotti da un errore di sessione: tornano disponibili
+            # senza consumare tentativi, non è colpa del messaggio
+            self.outbox.release(messages[attempted:], self.worker_id, error)
+        
+        return attempted
+    
+    def run_forever(self, stop_event: Optional[threading.Event] = None):
+        stop_event = stop_event or threading.Event()
+        logging.info(f"📮 Outbox dispatcher {self.worker_id} avviato")
+        
+        while not stop_event.is_set():
+            try:
+                self.outbox.recover_stale()
+                while self.dispatch_batch() and not stop_event.is_set():
+                    pass
+            except Exception as e:
+                logging.error(f"Errore outbox dispatcher: {e}")
+            stop_event.wait(max(self.poll_interval, self.outbox.session_backoff.remaining()))
+    
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run_forever, name='outbox-dispatcher', daemon=True)
+        thread.start()
+        return thread
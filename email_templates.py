@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+ETJCA Email Templates - Template email precompilati per settore e lingua
+File <settore>.<lingua>.txt nella cartella EMAIL_TEMPLATE_DIR, caricati una sola volta
+"""
+
+import os
+import re
+import logging
+from string import Formatter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_NAME = 'default'
+DEFAULT_LANGUAGE = 'it'
+FOLLOW_UP = 'follow_up'
+
+# Campi del prospect disponibili nei template, con il valore usato se mancano
+PROSPECT_FIELDS = {
+    'ragione_sociale': '',
+    'settore': 'il vostro settore',
+    'provincia': '',
+    'nome_hr': 'Responsabile HR',
+    'cognome_hr': '',
+    'email_hr': '',
+    'sito_web': '',
+}
+
+# Campi dell'account: risolti in fase di compilazione, restano nelle parti statiche
+ACCOUNT_FIELDS = ('nome_account', 'telefono_account', 'email_account')
+
+DEFAULT_SUBJECT = "ETJCA - Partnership per {ragione_sociale}"
+
+DEFAULT_BODY = """Gentile {nome_hr} {cognome_hr},
+
+Mi presento, sono {nome_account} di ETJCA, una delle prime dieci agenzie per il lavoro in Italia con oltre 25 anni di esperienza nel settore delle risorse umane.
+
+Ho notato che {ragione_sociale} opera con successo nel settore {settore} in Friuli Venezia Giulia, e credo che possiamo offrire un valore significativo alla vostra crescita aziendale.
+
+ETJCA offre soluzioni complete per la gestione delle risorse umane:
+• Somministrazione di lavoro a tempo determinato e indeterminato
+• Ricerca e selezione del personale specializzato
+• Formazione professionale e sviluppo competenze
+• Outsourcing HR e gestione amministrativa
+• Politiche attive del lavoro e incentivi
+
+La nostra esperienza nel territorio friulano ci permette di comprendere le specifiche esigenze del mercato locale e di fornire candidati qualificati in tempi rapidi.
+
+Sarei lieto di illustrarle personalmente come ETJCA può supportare i vostri obiettivi di crescita.
+
+Sarebbe disponibile per un breve incontro, anche via Microsoft Teams, nella prossima settimana?
+
+Resto a disposizione per qualsiasi informazione.
+
+Cordiali saluti,
+
+{nome_account}
+Account Manager ETJCA Friuli Venezia Giulia
+📞 {telefono_account}
+✉️ {email_account}
+🌐 www.etjca.it
+
+P.S. Allegato trova la nostra brochure con i servizi dedicati alle aziende del territorio."""
+
+FOLLOW_UP_SUBJECT = "Re: ETJCA - Partnership per {ragione_sociale}"
+
+FOLLOW_UP_BODY = """Gentile {nome_hr} {cognome_hr},
+
+le scrivo per riprendere la mia email dei giorni scorsi sui servizi ETJCA per {ragione_sociale}.
+
+Se nei prossimi mesi prevedete inserimenti di personale o progetti di formazione nel settore {settore}, sarei lieto di fissare un breve incontro, anche via Microsoft Teams, per capire come possiamo esservi utili.
+
+Resto a disposizione per qualsiasi informazione.
+
+Cordiali saluti,
+
+{nome_account}
+Account Manager ETJCA Friuli Venezia Giulia
+📞 {telefono_account}
+✉️ {email_account}
+🌐 www.etjca.it"""
+
+def slugify(value: Optional[str]) -> str:
+    """Nome file per settore: 'Metalmeccanico/Automotive' -> 'metalmeccanico_automotive'"""
+    return re.sub(r'[^a-z0-9]+', '_', (value or '').lower()).strip('_')
+
+class CompiledText:
+    """Testo scomposto in parti statiche e campi: il render è una sola join"""
+    
+    def __init__(self, text: str, account: Dict[str, str]):
+        self.head = ''
+        self.fields: List[str] = []
+        self.parts: List[Tuple[str, str]] = []
+        literal = []
+        for prefix, field, spec, conversion in Formatter().parse(text):
+            literal.append(prefix)
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Formattazione non supportata nel campo {{{field}}}")
+            if field in account:
+                literal.append(account[field])
+            elif field in PROSPECT_FIELDS:
+                self._close(''.join(literal))
+                self.fields.append(field)
+                literal = []
+            else:
+                raise ValueError(f"Campo sconosciuto nel template: {{{field}}}")
+        self._close(''.join(literal))
+    
+    def _close(self, literal: str):
+        # Ogni campo è seguito dal testo statico fino al campo successivo
+        if self.fields:
+            self.parts.append((self.fields[-1], literal))
+        else:
+            self.head = literal
+    
+    def render(self, values: Dict[str, str]) -> str:
+        out = [self.head]
+        for field, literal in self.parts:
+            out.append(values[field])
+            out.append(literal)
+        return ''.join(out)
+
+class EmailTemplate:
+    """Oggetto e corpo precompilati di un template"""
+    
+    def __init__(self, name: str, language: str, subject: str, body: str, account: Dict[str, str]):
+        self.name = name
+        self.language = language
+        self.subject = CompiledText(subject, account)
+        self.body = CompiledText(body, account)
+        # Solo i campi effettivamente usati vengono letti dal prospect
+        self.defaults = [
+            (field, PROSPECT_FIELDS[field])
+            for field in dict.fromkeys(self.subject.fields + self.body.fields)
+        ]
+    
+    def render(self, prospect) -> Tuple[str, str]:
+        values = {field: str(getattr(prospect, field, None) or default) for field, default in self.defaults}
+        return self.subject.render(values), self.body.render(values)
+
+def parse_template_file(path: str) -> Tuple[str, str]:
+    """Prima riga 'Oggetto: ...' opzionale, poi il corpo"""
+    with open(path, encoding='utf-8') as handle:
+        text = handle.read().replace('\r\n', '\n')
+    first, _, rest = text.partition('\n')
+    if first.lower().startswith('oggetto:'):
+        return first.split(':', 1)[1].strip(), rest.lstrip('\n').rstrip()
+    return DEFAULT_SUBJECT, text.rstrip()
+
+class TemplateRegistry:
+    """Template caricati e compilati una volta sola, scelti per settore e lingua"""
+    
+    def __init__(self, account: Dict[str, str], directory: Optional[str] = None,
+                 language: Optional[str] = None):
+        self.account = {field: account.get(field) or '' for field in ACCOUNT_FIELDS}
+        self.directory = directory or os.getenv('EMAIL_TEMPLATE_DIR', 'templates_email')
+        self.language = language or os.getenv('EMAIL_LINGUA', DEFAULT_LANGUAGE)
+        self.reload()
+    
+    def reload(self):
+        """Ricarica i file dalla cartella (il template predefinito è sempre disponibile)"""
+        templates = {
+            (DEFAULT_NAME, DEFAULT_LANGUAGE): EmailTemplate(
+                DEFAULT_NAME, DEFAULT_LANGUAGE, DEFAULT_SUBJECT, DEFAULT_BODY, self.account
+            ),
+            (FOLLOW_UP, DEFAULT_LANGUAGE): EmailTemplate(
+                FOLLOW_UP, DEFAULT_LANGUAGE, FOLLOW_UP_SUBJECT, FOLLOW_UP_BODY, self.account
+            ),
+        }
+        if os.path.isdir(self.directory):
+            for filename in sorted(os.listdir(self.directory)):
+                match = re.fullmatch(r'([a-z0-9_]+)\.([a-z]{2})\.txt', filename)
+                if not match:
+                    continue
+                try:
+                    subject, body = parse_template_file(os.path.join(self.directory, filename))
+                    templates[match.groups()] = EmailTemplate(
+                        match.group(1), match.group(2), subject, body, self.account
+                    )
+                except Exception as e:
+                    logging.error(f"Template email {filename} non valido: {e}")
+        
+        self._templates = templates
+        self._lookup: Dict[Tuple[str, str], EmailTemplate] = {}
+        logging.info(f"✉️ Template email caricati: {len(templates)}")
+    
+    @property
+    def names(self) -> List[str]:
+        return sorted(f"{name}.{language}" for name, language in self._templates)
+    
+    def select(self, settore: Optional[str], language: Optional[str] = None,
+               tipo: str = 'email') -> EmailTemplate:
+        """Template del settore nella lingua richiesta, con fallback sul predefinito"""
+        key = (settore or '', language or self.language, tipo)
+        template = self._lookup.get(key)
+        if template is None:
+            slug = slugify(settore)
+            default = FOLLOW_UP if tipo == FOLLOW_UP else DEFAULT_NAME
+            # Solleciti: <settore>_follow_up, poi follow_up
+            if tipo == FOLLOW_UP:
+                slug = f"{slug}_{FOLLOW_UP}"
+            for candidate in ((slug, key[1]), (default, key[1]),
+                              (slug, self.language), (default, self.language)):
+                template = self._templates.get(candidate)
+                if template is not None:
+                    break
+            else:
+                template = self._templates[(default, DEFAULT_LANGUAGE)]
+            self._lookup[key] = template
+        return template
+    
+    def render(self, prospect, language: Optional[str] = None, tipo: str = 'email') -> Tuple[str, str]:
+        """(oggetto, corpo) per un prospect"""
+        return self.select(prospect.settore, language, tipo).render(prospect)
+    
+    def render_batch(self, prospects: Iterable, language: Optional[str] = None,
+                     tipo: str = 'email') -> List[Tuple[str, str]]:
+        """(oggetto, corpo) per ogni prospect, nello stesso ordine"""
+        select = self.select
+        return [select(prospect.settore, language, tipo).render(prospect) for prospect in prospects]
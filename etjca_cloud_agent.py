@@ -6,12 +6,36 @@ Corretti tutti gli errori di deployment
 
 import os
 import json
+import base64
 import logging
 from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Iterator, Callable
+from contextlib import contextmanager
 import re
 import time
+import threading
+import queue
+
+from bulk_import import BulkImporter, detect_format, read_rows
+from job_queue import JobQueue
+from email_outbox import EmailOutbox, OutboxDispatcher, is_session_error
+from live_events import LiveEventHub
+from reports import ReportGenerator
+from email_templates import TemplateRegistry
+from lead_pipeline import LeadPipeline
+from dedup import DuplicateDetector, DuplicateProspectError
+from scoring import LeadScorer
+from migrations import Migrator
+from storage import create_backend
+from health import HealthProber
+from search import ProspectSearch
+from activity_log import ActivityLog, TIMELINE_MAX_LIMIT
+from tracking import TrackingBuffer
+import tracking
+import http_cache
+import metrics
+from query_log import query_log
 
 # Setup logging per Railway
 logging.basicConfig(
@@ -19,17 +43,9 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Import condizionali per evitare errori se mancano
-try:
-    import psycopg2
-    import pandas as pd
-    from flask import Flask, render_template_string, jsonify, request, send_file
-    HAS_POSTGRES = True
-except ImportError as e:
-    logging.warning(f"Import error: {e}")
-    HAS_POSTGRES = False
-    # Fallback imports
-    from flask import Flask, jsonify, request
+# pandas, openpyxl e requests sono importati solo dove servono (punteggio, report, scraper):
+# il worker web parte senza caricarli
+from flask import Flask, render_template_string, jsonify, request, send_file, Response, stream_with_context, redirect
 
 try:
     import smtplib
@@ -45,6 +61,28 @@ except ImportError:
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'etjca-secret-key-2024')
 
+@app.before_request
+def start_timer():
+    request.environ['etjca.start'] = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Latenza per route (il modello della route, non l'URL: etichette in numero limitato)"""
+    start = request.environ.get('etjca.start')
+    if start is not None:
+        metrics.HTTP_REQUEST.observe(
+            time.perf_counter() - start,
+            route=request.url_rule.rule if request.url_rule else 'non_trovata',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+@app.after_request
+def cache_api_response(response):
+    """ETag, 304 e compressione delle risposte JSON"""
+    return http_cache.negotiate(request, response)
+
 @dataclass
 class Prospect:
     """Modello Prospect semplificato"""
@@ -68,134 +106,205 @@ class Prospect:
     note: str = ""
     id: Optional[int] = None
 
+class TTLCache:
+    """Cache in-process con scadenza, condivisa tra le richieste del worker"""
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: str, loader: Callable):
+        """Valore in cache o ricalcolato da loader (un solo ricalcolo alla volta)"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            value = loader()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            return value
+    
+    def invalidate(self, key: Optional[str] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
 class DatabaseManager:
-    """Gestione database con fallback graceful"""
+    """Gestione database con fallback graceful, inizializzato al primo utilizzo"""
     
     def __init__(self):
         self.db_url = os.getenv('DATABASE_URL')
-        self.connected = False
-        self.init_database()
+        self.backend = None
+        self.cache = TTLCache(float(os.getenv('STATS_CACHE_TTL', 30)))
+        self.retry_interval = float(os.getenv('DB_RETRY_INTERVAL', 30))
+        self._connected = False
+        self._retry_at = 0.0
+        self._init_lock = threading.RLock()
+        self.duplicates = DuplicateDetector(self)
+    
+    @property
+    def connected(self) -> bool:
+        """Connessione e schema verificati alla prima richiesta; dopo un errore nuovo tentativo
+        ogni DB_RETRY_INTERVAL secondi invece di restare disconnessi fino al riavvio"""
+        if not self._connected and time.monotonic() >= self._retry_at:
+            with self._init_lock:
+                if not self._connected and time.monotonic() >= self._retry_at:
+                    self._connected = self.init_database()
+                    if not self._connected:
+                        self._retry_at = time.monotonic() + self.retry_interval
+        return self._connected
+    
+    @property
+    def dialect(self) -> Optional[str]:
+        """'postgresql' o 'sqlite', per le poche query che non hanno una forma comune"""
+        return self.backend.dialect if self.backend else None
     
     def get_connection(self):
-        """Connessione sicura al database"""
-        if not HAS_POSTGRES or not self.db_url:
+        """Preleva una connessione dal pool (restituirla con release_connection)"""
+        if not self.connected:
             raise Exception("Database non disponibile")
-        return psycopg2.connect(self.db_url, sslmode='require')
+        return self.backend.getconn()
+    
+    def open_dedicated_connection(self):
+        """Connessione fuori dal pool per usi a lunga durata (es. LISTEN)"""
+        # Durante init_database (migrazioni) il backend esiste già: nessuna inizializzazione ricorsiva
+        if self.backend is None and not self.connected:
+            raise Exception("Database non disponibile")
+        return self.backend.dedicated()
+    
+    def release_connection(self, conn, close: bool = False):
+        """Restituisce una connessione al pool"""
+        if self.backend is not None:
+            self.backend.putconn(conn, close=close)
+    
+    @contextmanager
+    def connection(self):
+        """Prestito di una connessione: commit all'uscita, rollback in caso di errore"""
+        conn = self.get_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_connection(conn)
+    
+    def pool_stats(self) -> Dict:
+        """Metriche del pool di connessioni"""
+        if self.backend is None:
+            return {}
+        return self.backend.stats()
     
-    def init_database(self):
+    def close(self):
+        """Chiude tutte le connessioni del pool"""
+        if self.backend is not None:
+            self.backend.close()
+    
+    def init_database(self) -> bool:
         """Inizializza database con gestione errori"""
-        if not HAS_POSTGRES or not self.db_url:
-            logging.warning("Database PostgreSQL non configurato")
-            return False
-        
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            # PostgreSQL, oppure SQLite con DATABASE_URL=sqlite:///percorso o SQLITE_PATH
+            if self.backend is None:
+                self.backend = create_backend(self.db_url)
+            if self.backend is None:
+                logging.warning("Database non configurato (DATABASE_URL mancante)")
+                return False
             
-            # Tabella prospect
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS prospect (
-                    id SERIAL PRIMARY KEY,
-                    ragione_sociale VARCHAR(255) NOT NULL,
-                    settore VARCHAR(100),
-                    fatturato BIGINT,
-                    dipendenti INTEGER,
-                    indirizzo TEXT,
-                    provincia VARCHAR(50),
-                    telefono VARCHAR(50),
-                    email VARCHAR(255),
-                    sito_web VARCHAR(255),
-                    nome_hr VARCHAR(100),
-                    cognome_hr VARCHAR(100),
-                    email_hr VARCHAR(255),
-                    linkedin_hr VARCHAR(255),
-                    fonte VARCHAR(50),
-                    data_inserimento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    stato VARCHAR(50) DEFAULT 'nuovo',
-                    priorita VARCHAR(20) DEFAULT 'media',
-                    note TEXT
-                )
-            ''')
+            if os.getenv('DB_SKIP_MIGRATIONS', 'false').lower() == 'true':
+                # Schema già aggiornato prima dell'avvio (gunicorn.conf.py o fase di deploy):
+                # basta verificare la connessione, che resta nel pool
+                self.backend.putconn(self.backend.getconn())
+            else:
+                # Schema versionato: solo le migrazioni mancanti (cartella migrazioni/)
+                applicate = Migrator(self).migrate()
+                if applicate:
+                    logging.info(f"🗄️ Migrazioni applicate: {applicate}")
             
-            # Tabella attivita
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS attivita (
-                    id SERIAL PRIMARY KEY,
-                    id_prospect INTEGER REFERENCES prospect(id),
-                    tipo VARCHAR(50),
-                    data TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    oggetto VARCHAR(255),
-                    descrizione TEXT,
-                    esito VARCHAR(100)
-                )
-            ''')
-            
-            # Indici
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_prospect_stato ON prospect(stato)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_prospect_provincia ON prospect(provincia)')
-            
-            conn.commit()
-            conn.close()
-            
-            self.connected = True
-            logging.info("✅ Database PostgreSQL inizializzato")
+            logging.info(f"✅ Database {self.backend.name} inizializzato")
             return True
             
         except Exception as e:
             logging.error(f"❌ Errore database: {e}")
-            self.connected = False
             return False
     
-    def insert_prospect(self, prospect: Prospect) -> int:
-        """Inserisce prospect nel database"""
+    @metrics.DB_QUERY.timed(metodo='insert_prospect')
+    def insert_prospect(self, prospect: Prospect, check_duplicates: bool = True) -> int:
+        """Inserisce prospect nel database (DuplicateProspectError se somiglia a un'azienda esistente)"""
         if not self.connected:
             raise Exception("Database non connesso")
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO prospect (
-                ragione_sociale, settore, fatturato, dipendenti, indirizzo, provincia,
-                telefono, email, sito_web, nome_hr, cognome_hr, email_hr,
-                linkedin_hr, fonte, stato, priorita, note
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        ''', (
-            prospect.ragione_sociale, prospect.settore, prospect.fatturato,
-            prospect.dipendenti, prospect.indirizzo, prospect.provincia,
-            prospect.telefono, prospect.email, prospect.sito_web,
-            prospect.nome_hr, prospect.cognome_hr, prospect.email_hr,
-            prospect.linkedin_hr, prospect.fonte, prospect.stato,
-            prospect.priorita, prospect.note
-        ))
+        if check_duplicates:
+            candidati = self.duplicates.find(
+                prospect.ragione_sociale, prospect.sito_web, prospect.email, prospect.email_hr
+            )
+            if candidati:
+                raise DuplicateProspectError(candidati)
         
-        prospect_id = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO prospect (
+                    ragione_sociale, settore, fatturato, dipendenti, indirizzo, provincia,
+                    telefono, email, sito_web, nome_hr, cognome_hr, email_hr,
+                    linkedin_hr, fonte, stato, priorita, note
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                prospect.ragione_sociale, prospect.settore, prospect.fatturato,
+                prospect.dipendenti, prospect.indirizzo, prospect.provincia,
+                prospect.telefono, prospect.email, prospect.sito_web,
+                prospect.nome_hr, prospect.cognome_hr, prospect.email_hr,
+                prospect.linkedin_hr, prospect.fonte, prospect.stato,
+                prospect.priorita, prospect.note
+            ))
+            
+            prospect_id = cursor.fetchone()[0]
         
+        self.duplicates.add(
+            prospect_id, prospect.ragione_sociale, prospect.provincia,
+            prospect.sito_web, prospect.email, prospect.email_hr
+        )
+        self.invalidate_stats()
         logging.info(f"Prospect inserito: {prospect.ragione_sociale}")
         return prospect_id
     
-    def get_prospects(self, limit: int = 50) -> List[Dict]:
-        """Recupera lista prospect"""
+    @metrics.DB_QUERY.timed(metodo='get_prospects')
+    def get_prospects(self, limit: int = 50, filters: Optional[Dict] = None,
+                      after: Optional[tuple] = None) -> List[Dict]:
+        """Recupera lista prospect, dal più recente, con filtri e paginazione keyset"""
         if not self.connected:
             return []
         
+        where, params = self._prospect_filters(filters or {})
+        if after:
+            # Keyset su (data_inserimento, id): costo costante anche nelle pagine profonde
+            where.append('(data_inserimento, id) < (%s, %s)')
+            params.extend(after)
+        
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, ragione_sociale, settore, provincia, stato, fonte, 
-                       dipendenti, fatturato, data_inserimento
-                FROM prospect 
-                ORDER BY data_inserimento DESC 
-                LIMIT %s
-            ''', (limit,))
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(f'''
+                    SELECT id, ragione_sociale, settore, provincia, stato, fonte, 
+                           dipendenti, fatturato, data_inserimento,
+                           nome_hr, cognome_hr, email_hr, priorita
+                    FROM prospect 
+                    {'WHERE ' + ' AND '.join(where) if where else ''}
+                    ORDER BY data_inserimento DESC, id DESC 
+                    LIMIT %s
+                ''', params + [limit])
+                rows = cursor.fetchall()
             
             prospects = []
-            for row in cursor.fetchall():
+            for row in rows:
                 prospects.append({
                     'id': row[0],
                     'ragione_sociale': row[1],
@@ -205,16 +314,71 @@ class DatabaseManager:
                     'fonte': row[5],
                     'dipendenti': row[6],
                     'fatturato': row[7],
-                    'data_inserimento': row[8].isoformat() if row[8] else None
+                    'data_inserimento': row[8].isoformat() if row[8] else None,
+                    'nome_hr': row[9],
+                    'cognome_hr': row[10],
+                    'email_hr': row[11],
+                    'priorita': row[12]
                 })
             
-            conn.close()
             return prospects
             
         except Exception as e:
             logging.error(f"Errore get_prospects: {e}")
             return []
     
+    def _prospect_filters(self, filters: Dict) -> tuple:
+        """Condizioni WHERE per i filtri della lista prospect"""
+        where, params = [], []
+        
+        for column in ('stato', 'provincia', 'settore', 'priorita'):
+            values = filters.get(column)
+            if not values:
+                continue
+            # Uguaglianza semplice quando possibile: sfrutta l'ordinamento dell'indice composto
+            if len(values) == 1:
+                where.append(f'{column} = %s')
+                params.append(values[0])
+            else:
+                where.append(f'{column} = ANY(%s)')
+                params.append(list(values))
+        
+        for column in ('fatturato', 'dipendenti'):
+            if filters.get(f'{column}_min') is not None:
+                where.append(f'{column} >= %s')
+                params.append(filters[f'{column}_min'])
+            if filters.get(f'{column}_max') is not None:
+                where.append(f'{column} <= %s')
+                params.append(filters[f'{column}_max'])
+        
+        return where, params
+    
+    def iter_prospects_by_ids(self, prospect_ids: List[int], chunk_size: int = 500) -> Iterator[Prospect]:
+        """Carica a blocchi i prospect indicati, nell'ordine richiesto"""
+        for start in range(0, len(prospect_ids), chunk_size):
+            chunk = prospect_ids[start:start + chunk_size]
+            with metrics.DB_QUERY.time(metodo='iter_prospects_by_ids'), self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, ragione_sociale, settore, provincia, nome_hr, cognome_hr, email_hr
+                    FROM prospect
+                    WHERE id = ANY(%s)
+                ''', (chunk,))
+                rows = {row[0]: row for row in cursor.fetchall()}
+            
+            for prospect_id in chunk:
+                row = rows.get(prospect_id)
+                if row:
+                    yield Prospect(
+                        id=row[0],
+                        ragione_sociale=row[1],
+                        settore=row[2] or '',
+                        provincia=row[3] or '',
+                        nome_hr=row[4] or '',
+                        cognome_hr=row[5] or '',
+                        email_hr=row[6] or ''
+                    )
+    
     def get_stats(self) -> Dict:
         """Recupera statistiche"""
         if not self.connected:
@@ -225,30 +389,7 @@ class DatabaseManager:
             }
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT COUNT(*) FROM prospect')
-            total_prospects = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM attivita WHERE tipo = %s', ('email',))
-            total_emails = cursor.fetchone()[0]
-            
-            cursor.execute('''
-                SELECT COUNT(*) FROM prospect 
-                WHERE stato IN ('interessato', 'appuntamento_fissato', 'cliente_acquisito')
-            ''')
-            interested = cursor.fetchone()[0]
-            
-            conversion_rate = (interested / max(total_prospects, 1)) * 100
-            
-            conn.close()
-            
-            return {
-                'total_prospects': total_prospects,
-                'total_emails': total_emails,
-                'conversion_rate': round(conversion_rate, 2)
-            }
+            return dict(self.cache.get('stats', self._compute_stats))
             
         except Exception as e:
             logging.error(f"Errore get_stats: {e}")
@@ -257,6 +398,109 @@ class DatabaseManager:
                 'total_emails': 0,
                 'conversion_rate': 0
             }
+    
+    @metrics.DB_QUERY.timed(metodo='compute_stats')
+    def _compute_stats(self) -> Dict:
+        """Statistiche in una sola query aggregata"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT p.totale, p.interessati, a.email
+                FROM (
+                    SELECT COUNT(*) AS totale,
+                           COUNT(*) FILTER (
+                               WHERE stato IN ('interessato', 'appuntamento_fissato', 'cliente_acquisito')
+                           ) AS interessati
+                    FROM prospect
+                ) p, (
+                    SELECT COUNT(*) AS email FROM attivita WHERE tipo = 'email'
+                ) a
+            ''')
+            total_prospects, interested, total_emails = cursor.fetchone()
+        
+        conversion_rate = (interested / max(total_prospects, 1)) * 100
+        
+        return {
+            'total_prospects': total_prospects,
+            'total_emails': total_emails,
+            'conversion_rate': round(conversion_rate, 2)
+        }
+    
+    def invalidate_stats(self):
+        """Da chiamare dopo ogni scrittura su prospect o attivita"""
+        self.cache.invalidate('stats')
+
+class TokenBucket:
+    """Rate limiter token bucket thread-safe"""
+    
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, tokens: int = 1):
+        """Attende finché non sono disponibili i token richiesti"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+class SMTPSession:
+    """Connessione SMTP autenticata con riconnessione automatica"""
+    
+    def __init__(self, host: str, port: int, user: str, password: str, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.server = None
+    
+    def connect(self):
+        """Apre la connessione con STARTTLS e LOGIN"""
+        self.close()
+        context = ssl.create_default_context()
+        try:
+            with metrics.SMTP.time(fase='connect'):
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                server.starttls(context=context)
+                server.login(self.user, self.password)
+        except Exception:
+            metrics.SMTP_ERRORS.inc(fase='connect')
+            raise
+        self.server = server
+    
+    def send(self, msg):
+        """Invia un messaggio, riconnettendo se il server ha chiuso la sessione"""
+        if self.server is None:
+            self.connect()
+        try:
+            with metrics.SMTP.time(fase='send'):
+                try:
+                    self.server.send_message(msg)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    logging.info("Sessione SMTP chiusa dal server, riconnessione...")
+                    self.connect()
+                    self.server.send_message(msg)
+        except Exception:
+            metrics.SMTP_ERRORS.inc(fase='send')
+            raise
+    
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
 
 class EmailManager:
     """Gestione email semplificata"""
@@ -268,47 +512,27 @@ class EmailManager:
         self.email = os.getenv('ETJCA_EMAIL')
         self.password = os.getenv('ETJCA_EMAIL_PASSWORD')
         self.enabled = HAS_EMAIL and self.email and self.password
+        self.outbox = EmailOutbox(db_manager)
+        
+        # Firma letta una sola volta e compilata nelle parti statiche dei template
+        self.templates = TemplateRegistry({
+            'nome_account': os.getenv('NOME_ACCOUNT', 'Account Manager ETJCA'),
+            'telefono_account': os.getenv('TELEFONO_ACCOUNT', '+39 XXX XXXXXXX'),
+            'email_account': self.email
+        })
+        
+        # Default prudenziali rispetto ai limiti di invio Gmail
+        self.rate_limiter = TokenBucket(
+            rate=float(os.getenv('EMAIL_RATE_PER_MINUTE', 20)) / 60,
+            capacity=int(os.getenv('EMAIL_BURST', 5))
+        )
         
         if not self.enabled:
             logging.warning("Email non configurato - inserire ETJCA_EMAIL e ETJCA_EMAIL_PASSWORD")
     
-    def create_email_template(self, prospect: Prospect) -> str:
-        """Crea email personalizzata"""
-        nome_account = os.getenv('NOME_ACCOUNT', 'Account Manager ETJCA')
-        telefono = os.getenv('TELEFONO_ACCOUNT', '+39 XXX XXXXXXX')
-        
-        template = f"""Gentile {prospect.nome_hr or 'Responsabile HR'} {prospect.cognome_hr or ''},
-
-Mi presento, sono {nome_account} di ETJCA, una delle prime dieci agenzie per il lavoro in Italia con oltre 25 anni di esperienza nel settore delle risorse umane.
-
-Ho notato che {prospect.ragione_sociale} opera con successo nel settore {prospect.settore or 'il vostro settore'} in Friuli Venezia Giulia, e credo che possiamo offrire un valore significativo alla vostra crescita aziendale.
-
-ETJCA offre soluzioni complete per la gestione delle risorse umane:
-• Somministrazione di lavoro a tempo determinato e indeterminato
-• Ricerca e selezione del personale specializzato
-• Formazione professionale e sviluppo competenze
-• Outsourcing HR e gestione amministrativa
-• Politiche attive del lavoro e incentivi
-
-La nostra esperienza nel territorio friulano ci permette di comprendere le specifiche esigenze del mercato locale e di fornire candidati qualificati in tempi rapidi.
-
-Sarei lieto di illustrarle personalmente come ETJCA può supportare i vostri obiettivi di crescita.
-
-Sarebbe disponibile per un breve incontro, anche via Microsoft Teams, nella prossima settimana?
-
-Resto a disposizione per qualsiasi informazione.
-
-Cordiali saluti,
-
-{nome_account}
-Account Manager ETJCA Friuli Venezia Giulia
-📞 {telefono}
-✉️ {self.email}
-🌐 www.etjca.it
-
-P.S. Allegato trova la nostra brochure con i servizi dedicati alle aziende del territorio."""
-        
-        return template
+    def create_email_template(self, prospect: Prospect, lingua: Optional[str] = None) -> str:
+        """Crea email personalizzata dal template del settore"""
+        return self.templates.render(prospect, lingua)[1]
     
     def send_email(self, prospect: Prospect) -> bool:
         """Invia email al prospect"""
@@ -321,58 +545,330 @@ P.S. Allegato trova la nostra brochure con i servizi dedicati alle aziende del t
             return False
         
         try:
-            msg = MIMEMultipart()
-            msg['From'] = self.email
-            msg['To'] = prospect.email_hr
-            msg['Subject'] = f"ETJCA - Partnership per {prospect.ragione_sociale}"
-            
-            body = self.create_email_template(prospect)
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-            
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email, self.password)
-                server.send_message(msg)
+            with self.smtp_session() as session:
+                session.send(self.build_message(prospect))
             
             # Registra attività se database disponibile
-            if self.db_manager.connected and prospect.id:
-                try:
-                    conn = self.db_manager.get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        INSERT INTO attivita (id_prospect, tipo, oggetto, descrizione, esito)
-                        VALUES (%s, %s, %s, %s, %s)
-                    ''', (
-                        prospect.id, 'email', 'Email ETJCA inviata',
-                        f'Email inviata a {prospect.email_hr}', 'inviata'
-                    ))
-                    conn.commit()
-                    conn.close()
-                except Exception as e:
-                    logging.error(f"Errore registrazione attività: {e}")
+            self.record_activities([prospect])
             
             logging.info(f"Email inviata a {prospect.ragione_sociale}")
             return True
-            
+        
         except Exception as e:
             logging.error(f"Errore invio email: {e}")
             return False
+    
+    def build_subject(self, prospect: Prospect, lingua: Optional[str] = None) -> str:
+        return self.templates.render(prospect, lingua)[0]
+    
+    def build_mime(self, destinatario: str, oggetto: str, corpo: str, id_prospect: Optional[int] = None,
+                   id_messaggio: Optional[int] = None) -> MIMEMultipart:
+        """Costruisce il messaggio MIME; con il tracciamento attivo anche la versione HTML
+        con il pixel delle aperture, e i link passano dal reindirizzamento che conta i click"""
+        if tracking.ENABLED:
+            token = tracking.make_token(id_prospect, id_messaggio)
+            msg = MIMEMultipart('alternative')
+            msg.attach(MIMEText(tracking.track_text(corpo, token), 'plain', 'utf-8'))
+            msg.attach(MIMEText(tracking.track_html(corpo, token), 'html', 'utf-8'))
+        else:
+            msg = MIMEMultipart()
+            msg.attach(MIMEText(corpo, 'plain', 'utf-8'))
+        msg['From'] = self.email
+        msg['To'] = destinatario
+        msg['Subject'] = oggetto
+        return msg
+    
+    def build_message(self, prospect: Prospect) -> MIMEMultipart:
+        """Costruisce il messaggio MIME per il prospect"""
+        oggetto, corpo = self.templates.render(prospect)
+        return self.build_mime(prospect.email_hr, oggetto, corpo, id_prospect=prospect.id)
+    
+    @contextmanager
+    def smtp_session(self):
+        """Sessione SMTP autenticata riutilizzabile per più messaggi"""
+        session = SMTPSession(self.smtp_server, self.smtp_port, self.email, self.password)
+        try:
+            yield session
+        finally:
+            session.close()
+    
+    def record_activities(self, prospects: List[Prospect]):
+        """Registra in un'unica transazione le email inviate"""
+        rows = [
+            (p.id, 'email', 'Email ETJCA inviata', f'Email inviata a {p.email_hr}', 'inviata')
+            for p in prospects if p.id
+        ]
+        if not rows or not self.db_manager.connected:
+            return
+        
+        try:
+            with self.db_manager.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO attivita (id_prospect, tipo, oggetto, descrizione, esito)
+                    VALUES (%s, %s, %s, %s, %s)
+                ''', rows)
+            self.db_manager.invalidate_stats()
+        except Exception as e:
+            logging.error(f"Errore registrazione attività: {e}")
+    
+    def send_batch(self, prospects: Iterable[Prospect], rate_limiter: Optional['TokenBucket'] = None) -> Dict:
+        """Invia più email su una sola sessione SMTP con rate limiting"""
+        result = {'inviate': 0, 'fallite': 0, 'saltate': 0}
+        if not self.enabled:
+            logging.warning("Email non abilitato")
+            result['saltate'] = sum(1 for _ in prospects)
+            return result
+        
+        limiter = rate_limiter or self.rate_limiter
+        sent = []
+        
+        with self.smtp_session() as session:
+            for prospect in prospects:
+                if not prospect.email_hr:
+                    result['saltate'] += 1
+                    continue
+                
+                limiter.acquire()
+                try:
+                    session.send(self.build_message(prospect))
+                    sent.append(prospect)
+                    result['inviate'] += 1
+                    logging.info(f"Email inviata a {prospect.ragione_sociale}")
+                except Exception as e:
+                    result['fallite'] += 1
+                    logging.error(f"Errore invio email a {prospect.ragione_sociale}: {e}")
+                
+                # Flush periodico per non perdere lo storico su batch lunghi
+                if len(sent) >= 50:
+                    self.record_activities(sent)
+                    sent = []
+        
+        self.record_activities(sent)
+        return result
+    
+    def outbox_message(self, prospect: Prospect, job_id: Optional[int] = None, tipo: str = 'email',
+                       lingua: Optional[str] = None) -> Dict:
+        """Messaggio già renderizzato pronto per l'outbox"""
+        return self.outbox_messages([prospect], job_id=job_id, tipo=tipo, lingua=lingua)[0]
+    
+    def outbox_messages(self, prospects: List[Prospect], job_id: Optional[int] = None, tipo: str = 'email',
+                        lingua: Optional[str] = None) -> List[Dict]:
+        """Renderizza un blocco di prospect in una sola chiamata"""
+        return [
+            {
+                'chiave': f"job:{job_id}:{prospect.id}" if job_id else None,
+                'id_prospect': prospect.id,
+                'job_id': job_id,
+                'destinatario': prospect.email_hr,
+                'oggetto': oggetto,
+                'corpo': corpo,
+                'tipo': tipo
+            }
+            for prospect, (oggetto, corpo) in zip(prospects, self.templates.render_batch(prospects, lingua, tipo))
+        ]
+    
+    def due_follow_ups(self, conn, giorni: int, max_solleciti: int):
+        """Prospect 'contattato' senza risposta dall'ultimo invio più vecchio di N giorni (una sola query)"""
+        cursor = conn.cursor(name='solleciti_dovuti')
+        cursor.itersize = 500
+        if self.db_manager.dialect == 'sqlite':
+            # SQLite non ha LATERAL: aggregato per prospect unito in join
+            invii = '''
+                JOIN (
+                    SELECT a.id_prospect, MAX(a.data) AS ultima, COUNT(*) AS invii
+                    FROM attivita a
+                    WHERE a.tipo IN ('email', 'follow_up')
+                    GROUP BY a.id_prospect
+                ) u ON u.id_prospect = p.id
+            '''
+        else:
+            invii = '''
+                CROSS JOIN LATERAL (
+                    SELECT MAX(a.data) AS ultima, COUNT(*) AS invii
+                    FROM attivita a
+                    WHERE a.id_prospect = p.id AND a.tipo IN ('email', 'follow_up')
+                ) u
+            '''
+        cursor.execute(f'''
+            SELECT p.id, p.ragione_sociale, p.settore, p.provincia, p.nome_hr, p.cognome_hr,
+                   p.email_hr, u.invii
+            FROM prospect p
+            {invii}
+            WHERE p.stato = 'contattato'
+              AND COALESCE(p.email_hr, '') <> ''
+              AND u.ultima < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+              AND u.invii <= %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM attivita r
+                  WHERE r.id_prospect = p.id
+                    AND r.tipo NOT IN ('email', 'follow_up', 'email_fallita', 'follow_up_fallita')
+                    AND r.data > u.ultima
+              )
+        ''', (giorni, max_solleciti))
+        return cursor
+    
+    def schedule_follow_ups(self) -> Dict:
+        """Accoda nell'outbox i solleciti dovuti, a blocchi; la chiave evita doppioni tra un giorno e l'altro"""
+        if not self.enabled or not self.db_manager.connected:
+            logging.warning("Solleciti saltati: email o database non configurati")
+            return {'candidati': 0, 'accodati': 0}
+        
+        giorni = int(os.getenv('FOLLOW_UP_GIORNI', 7))
+        max_solleciti = int(os.getenv('FOLLOW_UP_MAX', 2))
+        result = {'candidati': 0, 'accodati': 0}
+        
+        with self.db_manager.connection() as conn:
+            cursor = self.due_follow_ups(conn, giorni, max_solleciti)
+            try:
+                while True:
+                    rows = cursor.fetchmany(500)
+                    if not rows:
+                        break
+                    prospects = [
+                        Prospect(id=row[0], ragione_sociale=row[1], settore=row[2] or '', provincia=row[3] or '',
+                                 nome_hr=row[4] or '', cognome_hr=row[5] or '', email_hr=row[6])
+                        for row in rows
+                    ]
+                    messages = self.outbox_messages(prospects, tipo='follow_up')
+                    for message, row in zip(messages, rows):
+                        # Un sollecito per ogni invio già fatto: un messaggio ancora in coda non si duplica
+                        message['chiave'] = f"follow_up:{row[0]}:{row[7]}"
+                    result['candidati'] += len(rows)
+                    result['accodati'] += self.outbox.enqueue(messages)
+            finally:
+                cursor.close()
+        
+        logging.info(f"📬 Solleciti: {result['accodati']} accodati su {result['candidati']} prospect da ricontattare")
+        return result
+    
+    def run_campaign_job(self, job: Dict, queue) -> Dict:
+        """Handler job 'campagna_email': accoda i messaggi nell'outbox e ne segue l'invio"""
+        if not self.enabled:
+            raise Exception("Email non configurato")
+        
+        # Accodamento idempotente: una ripresa del job non duplica i messaggi
+        lingua = job['payload'].get('lingua')
+        batch = []
+        for prospect in self.db_manager.iter_prospects_by_ids(job['payload'].get('prospect_ids', [])):
+            if prospect.email_hr:
+                batch.append(prospect)
+            if len(batch) >= 500:
+                self.outbox.enqueue(self.outbox_messages(batch, job_id=job['id'], lingua=lingua))
+                queue.heartbeat(job['id'], job['worker'])
+                batch = []
+        self.outbox.enqueue(self.outbox_messages(batch, job_id=job['id'], lingua=lingua))
+        
+        # Il worker del job contribuisce allo svuotamento insieme agli altri dispatcher
+        dispatcher = OutboxDispatcher(self.outbox, self)
+        while True:
+            counts = self.outbox.job_counts(job['id'])
+            totale = counts['inviate'] + counts['fallite'] + counts['in_coda']
+            queue.set_progress(job['id'], job['worker'], counts['inviate'], counts['fallite'], totale=totale)
+            if not counts['in_coda']:
+                return {'inviate': counts['inviate'], 'fallite': counts['fallite']}
+            
+            try:
+                tentati = dispatcher.dispatch_batch()
+            except Exception as e:
+                if not is_session_error(e):
+                    raise
+                # Invii sospesi (SessionBackoff): il job attende come gli altri dispatcher, senza login ripetuti
+                tentati = 0
+            if not tentati:
+                attesa = counts['prossimo_tentativo_tra'] or dispatcher.poll_interval
+                time.sleep(min(attesa, dispatcher.poll_interval))
 
 # Inizializza componenti
 db_manager = DatabaseManager()
 email_manager = EmailManager(db_manager)
+job_queue = JobQueue(db_manager)
+job_queue.register('campagna_email', email_manager.run_campaign_job)
+job_queue.register('cluster_duplicati', db_manager.duplicates.run_cluster_job)
+lead_scorer = LeadScorer(db_manager)
+job_queue.register('punteggio_lead', lead_scorer.run_job)
+activity_log = ActivityLog(db_manager)
+job_queue.register('manutenzione_attivita', activity_log.run_job)
+live_hub = LiveEventHub(db_manager)
+report_generator = ReportGenerator(db_manager)
+prospect_search = ProspectSearch(db_manager)
+tracking_buffer = TrackingBuffer(db_manager)
+health_prober = HealthProber(db_manager, email_manager)
+
+@metrics.registry.collector
+def collect_pool_metrics():
+    stats = db_manager.pool_stats()
+    if stats:
+        metrics.DB_POOL.set(stats['in_use'], stato='in_uso')
+        metrics.DB_POOL.set(stats['max_size'], stato='massimo')
+        metrics.DB_POOL_WAITS.set(stats['waits'], esito='attesa')
+        metrics.DB_POOL_WAITS.set(stats['timeouts'], esito='timeout')
+    metrics.TRACKING_PENDING.set(len(tracking_buffer))
+
+@metrics.registry.collector
+def save_query_log():
+    # Statistiche SQL accanto alle metriche: il report admin unisce web e worker
+    query_log.save(metrics.registry.directory)
+
+# Salvataggio periodico per /metrics: ogni worker gunicorn e lo scheduler hanno il proprio file
+metrics.registry.start()
+
+class CloudLeadAgent:
+    """Agente per il ciclo giornaliero di lead generation (processo worker)"""
+    
+    def __init__(self):
+        self.db_manager = db_manager
+        self.email_manager = email_manager
+        # Le nuove aziende con email HR entrano subito in una campagna, se l'email è configurata
+        self.pipeline = LeadPipeline(db_manager, job_queue, outreach=bool(email_manager.enabled))
+        
+        # Sorgenti web configurate (SCRAPER_CAMERA_URLS, SCRAPER_LINKEDIN_URLS)
+        # Import qui: requests serve solo al processo worker
+        from scraper import build_sources
+        for name, source in build_sources().items():
+            self.register_source(name, source)
+    
+    def register_source(self, name: str, func: Callable[[], Iterator[Dict]]):
+        self.pipeline.register_source(name, func)
+    
+    def run_full_cycle(self) -> Dict:
+        """sorgenti -> normalizzazione -> deduplica -> punteggio -> salvataggio -> outreach"""
+        if not db_manager.connected:
+            logging.warning("Ciclo lead saltato: database non connesso")
+            return {}
+        
+        try:
+            report = self.pipeline.run()
+            # Nuovi prospect e attività del ciclo: ricalcolo incrementale
+            report['punteggio'] = lead_scorer.run()
+            return report
+        except Exception as e:
+            logging.error(f"Errore ciclo lead: {e}")
+            return {'error': str(e)}
+
+def encode_cursor(data: str, item_id: int) -> str:
+    """Cursore opaco con la chiave (data, id) dell'ultimo elemento della pagina"""
+    raw = json.dumps([data, item_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data, item_id = json.loads(raw)
+        return datetime.fromisoformat(data), int(item_id)
+    except Exception:
+        raise ValueError('cursore non valido')
 
 # Routes Flask
 @app.route('/')
 def dashboard():
-    """Dashboard principale"""
-    return render_template_string(DASHBOARD_TEMPLATE)
+    """Dashboard principale (pagina statica resa una volta, con ETag e compressione)"""
+    return DASHBOARD_PAGE.response(request, Response)
 
 @app.route('/manual_prospect')
 def manual_prospect_form():
     """Form inserimento manuale"""
-    return render_template_string(MANUAL_PROSPECT_TEMPLATE)
+    return MANUAL_PROSPECT_PAGE.response(request, Response)
 
 @app.route('/api/stats')
 def api_stats():
@@ -383,12 +879,90 @@ def api_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events: statistiche e log aggiornati ad ogni modifica"""
+    if not db_manager.connected:
+        return jsonify({'error': 'Database non connesso'}), 503
+    
+    # Stream a durata limitata: libera il thread, EventSource si riconnette da solo
+    max_duration = float(os.getenv('SSE_MAX_DURATION', 300))
+    client = live_hub.subscribe()
+    if client is None:
+        # Thread del worker riservati alle altre route (compreso /health/ready)
+        return jsonify({'error': 'Troppi client collegati agli eventi live'}), 503, {'Retry-After': '300'}
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            yield f"event: stats\ndata: {json.dumps(db_manager.get_stats())}\n\n"
+            deadline = time.monotonic() + max_duration
+            while time.monotonic() < deadline:
+                try:
+                    yield client.get(timeout=15)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            live_hub.unsubscribe(client)
+    
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Anche se il client si scollega prima del primo evento (il generatore non parte mai)
+    response.call_on_close(lambda: live_hub.unsubscribe(client))
+    return response
+
 @app.route('/api/prospects')
 def api_prospects():
-    """API lista prospect"""
+    """API lista prospect con filtri e paginazione a cursore (header X-Next-Cursor)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        
+        filters = {
+            column: [v.strip() for v in request.args[column].split(',') if v.strip()]
+            for column in ('stato', 'provincia', 'settore', 'priorita')
+            if request.args.get(column)
+        }
+        for column in ('fatturato_min', 'fatturato_max', 'dipendenti_min', 'dipendenti_max'):
+            if request.args.get(column):
+                filters[column] = int(request.args[column])
+        
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        
+        prospects = db_manager.get_prospects(limit=limit, filters=filters, after=after)
+        response = jsonify(prospects)
+        if len(prospects) == limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(prospects[-1]['data_inserimento'], prospects[-1]['id'])
+        return response
+    except ValueError as e:
+        return jsonify({'error': f'Parametri non validi: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/prospects/<int:prospect_id>/timeline')
+def api_prospect_timeline(prospect_id):
+    """Attività del prospect dalla più recente (?dal=&al=&limit=&cursor=, header X-Next-Cursor):
+    solo le partizioni mensili del periodo, ultimi 12 mesi se dal manca"""
     try:
-        prospects = db_manager.get_prospects()
-        return jsonify(prospects)
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        # Stesso limite di timeline(): con il valore grezzo il confronto per X-Next-Cursor fallirebbe
+        limit = min(max(int(request.args.get('limit', 50)), 1), TIMELINE_MAX_LIMIT)
+        attivita = activity_log.timeline(
+            prospect_id,
+            dal=datetime.fromisoformat(request.args['dal']) if request.args.get('dal') else None,
+            al=datetime.fromisoformat(request.args['al']) if request.args.get('al') else None,
+            limit=limit,
+            after=decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        )
+        response = jsonify(attivita)
+        if len(attivita) == limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(attivita[-1]['data'], attivita[-1]['id'])
+        return response
+    except ValueError as e:
+        return jsonify({'error': f'Parametri non validi: {e}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -424,7 +998,7 @@ def api_manual_prospect():
         )
         
         # Inserisci nel database
-        prospect_id = db_manager.insert_prospect(prospect)
+        prospect_id = db_manager.insert_prospect(prospect, check_duplicates=not data.get('forza'))
         prospect.id = prospect_id
         
         return jsonify({
@@ -433,52 +1007,283 @@ def api_manual_prospect():
             'message': f'Prospect {prospect.ragione_sociale} inserito con successo'
         })
         
+    except DuplicateProspectError as e:
+        return jsonify({'error': str(e), 'duplicati': e.candidati}), 409
     except Exception as e:
         logging.error(f"Errore inserimento prospect: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/bulk_import', methods=['POST'])
+def api_bulk_import():
+    """API importazione massiva prospect (CSV, XLSX, NDJSON)"""
+    try:
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        # Upload multipart (spool su disco) oppure body grezzo in streaming
+        upload = request.files.get('file')
+        if upload:
+            stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+        else:
+            stream, filename, content_type = request.stream, '', request.mimetype
+        
+        formato = request.args.get('formato') or detect_format(filename, content_type)
+        if not formato:
+            return jsonify({'error': 'Formato non riconosciuto (csv, xlsx, ndjson)'}), 400
+        if formato == 'xlsx' and not upload:
+            return jsonify({'error': 'Il formato XLSX richiede un upload multipart'}), 400
+        
+        importer = BulkImporter(
+            db_manager,
+            chunk_size=int(request.args.get('chunk_size', 5000)),
+            duplicates=db_manager.duplicates
+        )
+        report = importer.run(read_rows(stream, formato))
+        
+        return jsonify({'success': True, **report})
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Errore import massivo: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/send_emails', methods=['POST'])
 def api_send_emails():
-    """API invio email"""
+    """API invio email: accoda una campagna eseguita dal processo worker"""
     try:
         if not email_manager.enabled:
             return jsonify({'error': 'Email non configurato'}), 400
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
         
-        prospects = db_manager.get_prospects(limit=5)
-        email_count = 0
-        
-        for prospect_data in prospects:
-            if prospect_data.get('email_hr'):
-                prospect = Prospect(
-                    id=prospect_data['id'],
-                    ragione_sociale=prospect_data['ragione_sociale'],
-                    settore=prospect_data.get('settore', ''),
-                    email_hr=prospect_data['email_hr']
-                )
-                
-                if email_manager.send_email(prospect):
-                    email_count += 1
-                
-                time.sleep(2)  # Pausa tra invii
+        data = request.get_json(silent=True) or {}
+        prospect_ids = data.get('prospect_ids') or [
+            prospect_data['id']
+            for prospect_data in db_manager.get_prospects(limit=int(data.get('limit', 5)))
+            if prospect_data.get('email_hr')
+        ]
+        
+        payload = {'prospect_ids': prospect_ids}
+        if data.get('lingua'):
+            payload['lingua'] = data['lingua']
+        job_id = job_queue.enqueue('campagna_email', payload, totale=len(prospect_ids))
         
         return jsonify({
             'success': True,
-            'email_inviate': email_count
+            'job_id': job_id,
+            'email_in_coda': len(prospect_ids)
+        }), 202
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job_status(job_id):
+    """API stato job: avanzamento, inviate/fallite e ETA"""
+    try:
+        status = job_queue.get_status(job_id)
+        if status is None:
+            return jsonify({'error': 'Job non trovato'}), 404
+        return jsonify(status)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/duplicati', methods=['GET', 'POST'])
+def api_duplicati():
+    """GET: cluster di possibili duplicati da rivedere; POST: ricalcolo in background"""
+    try:
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        if request.method == 'POST':
+            job_id = job_queue.enqueue('cluster_duplicati', {})
+            return jsonify({'success': True, 'job_id': job_id}), 202
+        
+        limit = min(int(request.args.get('limit', 50)), 500)
+        return jsonify({'cluster': db_manager.duplicates.get_clusters(limit)})
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/duplicati/unisci', methods=['POST'])
+def api_unisci_duplicati():
+    """Unisce i duplicati nel prospect principale: {"principale": id, "duplicati": [id, ...]}"""
+    try:
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        data = request.get_json(silent=True) or {}
+        if not data.get('principale') or not data.get('duplicati'):
+            return jsonify({'error': 'Indicare principale e duplicati'}), 400
+        
+        return jsonify({'success': True, **db_manager.duplicates.merge(int(data['principale']), data['duplicati'])})
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Errore unione duplicati: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/punteggio', methods=['GET', 'POST'])
+def api_punteggio():
+    """GET: ultime esecuzioni del punteggio lead; POST: ricalcolo in background ({"completo": true} per tutta la tabella)"""
+    try:
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            job_id = job_queue.enqueue('punteggio_lead', {'completo': bool(data.get('completo'))})
+            return jsonify({'success': True, 'job_id': job_id}), 202
+        
+        return jsonify({'esecuzioni': lead_scorer.get_runs()})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/report')
+def api_report():
+    """Download report Excel (tutte le tabelle) o CSV (?tipo=prospect|attivita)"""
+    try:
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        stream, filename, mimetype = report_generator.download(
+            formato=request.args.get('formato', 'xlsx'),
+            tipo=request.args.get('tipo', 'prospect')
+        )
+        return Response(stream_with_context(stream), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{filename}"'
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Errore generazione report: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ricerca')
+def api_ricerca():
+    """Ricerca full-text su prospect e attività (?q=&tipo=prospect|attivita|tutti&limit=), con evidenziazione"""
+    try:
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        return jsonify(prospect_search.search(
+            request.args.get('q', ''),
+            tipo=request.args.get('tipo', 'tutti'),
+            limit=int(request.args.get('limit', 10)),
+            prefix=request.args.get('prefisso', 'true').lower() != 'false'
+        ))
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Errore ricerca: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/t/o/<token>.gif')
+def track_open(token):
+    """Pixel delle aperture: l'evento va nel buffer, la risposta non attende il database"""
+    ids = tracking.read_token(token)
+    if ids:
+        tracking_buffer.record('apertura', *ids, user_agent=request.user_agent.string)
+    return Response(tracking.PIXEL, mimetype='image/gif', headers={'Cache-Control': 'no-store, private'})
+
+@app.route('/t/c/<token>')
+def track_click(token):
+    """Reindirizzamento dei link delle email: solo verso destinazioni firmate"""
+    url = request.args.get('u', '')
+    ids = tracking.read_token(token)
+    if not ids or not tracking.verify_click(token, url, request.args.get('s', '')):
+        return jsonify({'error': 'Link non valido'}), 400
+    tracking_buffer.record('click', *ids, url=url, user_agent=request.user_agent.string)
+    response = redirect(url, 302)
+    response.headers['Cache-Control'] = 'no-store, private'
+    return response
+
+@app.route('/api/tracciamento')
+def api_tracciamento():
+    """Aperture e click delle email inviate (?job_id= per una campagna)"""
+    try:
+        if not db_manager.connected:
+            return jsonify({'error': 'Database non connesso'}), 503
+        
+        job_id = int(request.args['job_id']) if request.args.get('job_id') else None
+        return jsonify(dict(tracking_buffer.stats(job_id), attivo=tracking.ENABLED))
+        
+    except ValueError as e:
+        return jsonify({'error': f'Parametri non validi: {e}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/health')
 def health():
-    """Health check per Railway"""
+    """Riepilogo dello stato dall'ultimo giro di controlli in background"""
+    report = health_prober.readiness()
+    database = report.get('controlli', {}).get('database', {})
     return jsonify({
-        'status': 'healthy',
-        'database': 'connected' if db_manager.connected else 'disconnected',
+        'status': 'healthy' if report['pronto'] else 'unhealthy',
+        'database': 'connected' if database.get('stato') == 'ok' else 'disconnected',
         'email': 'configured' if email_manager.enabled else 'not_configured',
+        'pool': db_manager.pool_stats(),
+        'readiness': report,
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/health/live')
+def health_live():
+    """Liveness: il processo risponde, senza toccare le dipendenze (health check del deploy Railway)"""
+    return jsonify(health_prober.liveness())
+
+@app.route('/health/ready')
+def health_ready():
+    """Readiness per il bilanciamento del carico: ultimo risultato dei controlli, 503 se il database non risponde"""
+    report = health_prober.readiness()
+    return jsonify(report), 200 if report['pronto'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Metriche Prometheus sommate su tutti i processi, con la profondità delle code"""
+    extra = []
+    if db_manager.connected:
+        try:
+            extra.append((metrics.JOB_QUEUE, {(stato,): n for stato, n in job_queue.stats().items()}))
+            extra.append((metrics.EMAIL_OUTBOX, {(stato,): n for stato, n in email_manager.outbox.stats().items()}))
+        except Exception as e:
+            logging.error(f"Errore metriche code: {e}")
+    return Response(metrics.registry.render(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/query', methods=['GET', 'DELETE'])
+def api_admin_query():
+    """GET: query più lente di tutti i processi (?limit=20&ordina=totale|massimo|media|lente); DELETE: azzera il processo"""
+    # Le impronte contengono testo SQL e piani: senza ADMIN_TOKEN configurato l'accesso è negato
+    token = os.getenv('ADMIN_TOKEN')
+    if not token or request.headers.get('X-Admin-Token') != token:
+        return jsonify({'error': 'Non autorizzato'}), 403
+    try:
+        if request.method == 'DELETE':
+            query_log.reset()
+            return jsonify({'success': True})
+        
+        return jsonify({
+            'soglia_ms': query_log.threshold * 1000,
+            'explain': query_log.explain,
+            'query': query_log.top(
+                limit=request.args.get('limit', 20, type=int),
+                order=request.args.get('ordina', 'totale'),
+                directory=metrics.registry.directory
+            )
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Template Dashboard
 DASHBOARD_TEMPLATE = '''
 <!DOCTYPE html>
@@ -562,6 +1367,22 @@ DASHBOARD_TEMPLATE = '''
         .btn-success { background: linear-gradient(45deg, #27ae60, #229954); }
         .btn-warning { background: linear-gradient(45deg, #f39c12, #d68910); }
         .loading { display: none; text-align: center; color: #666; }
+        #search-input {
+            width: 100%;
+            padding: 0.75rem 1rem;
+            border: 2px solid #ddd;
+            border-radius: 8px;
+            font-size: 1rem;
+        }
+        #search-input:focus { outline: none; border-color: #3498db; }
+        #search-results { margin-top: 1rem; }
+        .search-item {
+            padding: 0.6rem 0;
+            border-bottom: 1px solid #eee;
+        }
+        .search-item small { color: #7f8c8d; }
+        .search-item mark { background: #f9e79f; padding: 0 1px; }
+        .search-snippet { color: #555; font-size: 0.9rem; }
         #log { 
             background: #2c3e50; 
             color: #ecf0f1; 
@@ -607,6 +1428,12 @@ DASHBOARD_TEMPLATE = '''
             <div class="loading" id="loading">⏳ Operazione in corso...</div>
         </div>
         
+        <div class="card">
+            <h2>🔎 Ricerca</h2>
+            <input type="search" id="search-input" placeholder="Azienda, indirizzo, note o attività..." autocomplete="off">
+            <div id="search-results"></div>
+        </div>
+        
         <div class="card">
             <h2>📋 Log Sistema</h2>
             <div id="log">
@@ -635,21 +1462,58 @@ DASHBOARD_TEMPLATE = '''
             document.getElementById('loading').style.display = show ? 'block' : 'none';
         }
 
+        function renderStats(data) {
+            document.getElementById('total-prospects').textContent = data.total_prospects || 0;
+            document.getElementById('emails-sent').textContent = data.total_emails || 0;
+            document.getElementById('conversion-rate').textContent = data.conversion_rate ? data.conversion_rate.toFixed(1) + '%' : '0%';
+        }
+
         async function refreshStats() {
             try {
                 const response = await fetch('/api/stats');
                 const data = await response.json();
                 
-                document.getElementById('total-prospects').textContent = data.total_prospects || 0;
-                document.getElementById('emails-sent').textContent = data.total_emails || 0;
-                document.getElementById('conversion-rate').textContent = data.conversion_rate ? data.conversion_rate.toFixed(1) + '%' : '0%';
-                
+                renderStats(data);
                 addLog('Statistiche aggiornate');
             } catch (error) {
                 addLog('Errore aggiornamento: ' + error);
             }
         }
 
+        let pollingTimer = null;
+
+        function startPolling() {
+            if (!pollingTimer) {
+                pollingTimer = setInterval(refreshStats, 60000); // Fallback senza eventi live
+            }
+        }
+
+        function connectLiveEvents() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            
+            const source = new EventSource('/api/events');
+            source.addEventListener('open', () => {
+                if (pollingTimer) {
+                    clearInterval(pollingTimer);
+                    pollingTimer = null;
+                    addLog('Aggiornamenti live ripristinati');
+                }
+            });
+            source.addEventListener('stats', (e) => renderStats(JSON.parse(e.data)));
+            source.addEventListener('log', (e) => addLog(JSON.parse(e.data).message));
+            source.addEventListener('error', () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    // Anche 503 quando sono collegati troppi client: nuovo tentativo tra 5 minuti
+                    addLog('Aggiornamenti live non disponibili, refresh ogni minuto');
+                    startPolling();
+                    setTimeout(connectLiveEvents, 300000);
+                }
+            });
+        }
+
         async function sendEmails() {
             showLoading(true);
             addLog('Invio email in corso...');
@@ -659,8 +1523,8 @@ DASHBOARD_TEMPLATE = '''
                 const result = await response.json();
                 
                 if (result.success) {
-                    addLog(`Email inviate: ${result.email_inviate} messaggi`);
-                    refreshStats();
+                    addLog(`Campagna #${result.job_id} accodata: ${result.email_in_coda} email`);
+                    pollJob(result.job_id);
                 } else {
                     addLog('Errore invio email: ' + result.error);
                 }
@@ -671,16 +1535,98 @@ DASHBOARD_TEMPLATE = '''
             }
         }
 
+        async function pollJob(jobId) {
+            try {
+                const response = await fetch(`/api/jobs/${jobId}`);
+                const job = await response.json();
+                
+                if (job.stato === 'completato' || job.stato === 'fallito') {
+                    addLog(`Campagna #${jobId} ${job.stato}: ${job.inviate} inviate, ${job.fallite} fallite`);
+                    refreshStats();
+                    return;
+                }
+                
+                const eta = job.eta_secondi !== null ? ` - ETA ${job.eta_secondi}s` : '';
+                addLog(`Campagna #${jobId}: ${job.processati}/${job.totale} (${job.progresso}%)${eta}`);
+                setTimeout(() => pollJob(jobId), 5000);
+            } catch (error) {
+                addLog('Errore stato campagna: ' + error);
+            }
+        }
+
+        let searchTimer = null;
+        let searchController = null;
+
+        function searchItem(titleHtml, meta, snippetHtml) {
+            // I campi *_html arrivano già con escape dal server, solo <mark> come markup
+            const item = document.createElement('div');
+            item.className = 'search-item';
+            const title = document.createElement('div');
+            title.innerHTML = titleHtml || '';
+            const small = document.createElement('small');
+            small.textContent = ' ' + meta;
+            title.appendChild(small);
+            item.appendChild(title);
+            if (snippetHtml) {
+                const snippet = document.createElement('div');
+                snippet.className = 'search-snippet';
+                snippet.innerHTML = snippetHtml;
+                item.appendChild(snippet);
+            }
+            return item;
+        }
+
+        function renderSearch(data) {
+            const results = document.getElementById('search-results');
+            results.replaceChildren();
+            data.prospect.forEach((p) => results.appendChild(
+                searchItem(p.titolo_html, [p.provincia, p.settore, p.stato].filter(Boolean).join(' · '), p.estratto_html)
+            ));
+            data.attivita.forEach((a) => results.appendChild(
+                searchItem(a.titolo_html || a.tipo, `${a.tipo} · ${a.ragione_sociale || ''} · ${(a.data || '').slice(0, 10)}`, a.estratto_html)
+            ));
+            if (!results.children.length) {
+                results.textContent = 'Nessun risultato';
+            }
+        }
+
+        async function runSearch(text) {
+            // Una sola richiesta in volo: quella precedente viene annullata
+            if (searchController) {
+                searchController.abort();
+            }
+            searchController = new AbortController();
+            try {
+                const response = await fetch('/api/ricerca?limit=8&q=' + encodeURIComponent(text), { signal: searchController.signal });
+                renderSearch(await response.json());
+            } catch (error) {
+                if (error.name !== 'AbortError') {
+                    addLog('Errore ricerca: ' + error);
+                }
+            }
+        }
+
+        function onSearchInput(e) {
+            const text = e.target.value.trim();
+            clearTimeout(searchTimer);
+            if (text.length < 2) {
+                document.getElementById('search-results').replaceChildren();
+                return;
+            }
+            searchTimer = setTimeout(() => runSearch(text), 200); // Type-ahead: attesa della pausa di battitura
+        }
+
         function generateReport() {
             addLog('Generazione report...');
-            alert('Report generato! Funzionalità disponibile nella versione completa.');
+            window.location.href = '/api/report?formato=xlsx';
         }
 
         // Inizializzazione
         document.addEventListener('DOMContentLoaded', function() {
             addLog('Dashboard ETJCA caricata');
             refreshStats();
-            setInterval(refreshStats, 60000); // Auto-refresh ogni minuto
+            connectLiveEvents();
+            document.getElementById('search-input').addEventListener('input', onSearchInput);
         });
     </script>
 </body>
@@ -991,6 +1937,24 @@ MANUAL_PROSPECT_TEMPLATE = '''
                 
                 const result = await response.json();
                 
+                if (response.status === 409 && result.duplicati) {
+                    const elenco = result.duplicati.map(d => `#${d.id} ${d.ragione_sociale} ${d.provincia || ''}`).join('\n');
+                    if (confirm(`Possibile duplicato di:\n${elenco}\n\nInserire comunque?`)) {
+                        data.forza = true;
+                        const forced = await fetch('/api/manual_prospect', {
+                            method: 'POST',
+                            headers: { 'Content-Type': 'application/json' },
+                            body: JSON.stringify(data)
+                        });
+                        const forcedResult = await forced.json();
+                        if (forced.ok) {
+                            window.location.href = '/';
+                            return;
+                        }
+                        result.error = forcedResult.error;
+                    }
+                }
+                
                 if (response.ok) {
                     document.getElementById('success-alert').textContent = result.message;
                     document.getElementById('success-alert').style.display = 'block';
@@ -1019,6 +1983,10 @@ MANUAL_PROSPECT_TEMPLATE = '''
 </html>
 '''
 
+# Template senza dati della richiesta: resi e compressi una sola volta per processo
+DASHBOARD_PAGE = http_cache.StaticPage(lambda: render_template_string(DASHBOARD_TEMPLATE))
+MANUAL_PROSPECT_PAGE = http_cache.StaticPage(lambda: render_template_string(MANUAL_PROSPECT_TEMPLATE))
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+ETJCA Gunicorn - Configurazione letta automaticamente da gunicorn nella cartella di avvio
+Le migrazioni girano una volta sola nel master: i worker partono senza DDL
+"""
+
+import os
+import sys
+
+def on_starting(server):
+    """Profilo query dell'avvio precedente azzerato e schema aggiornato prima di avviare i worker;
+    se le migrazioni falliscono ci riprovano i worker"""
+    from metrics import METRICS_DIR
+    from query_log import QueryLog
+    QueryLog.clear_saved(METRICS_DIR)
+    
+    if os.getenv('DB_SKIP_MIGRATIONS', 'false').lower() == 'true':
+        return
+    # Import qui: il master non carica l'applicazione (i worker la importano dopo il fork)
+    from migrations import migrate_database
+    try:
+        applicate = migrate_database()
+    except Exception as e:
+        server.log.error(f"❌ Migrazioni non applicate nel master: {e}")
+        return
+    server.log.info(f"🗄️ Migrazioni applicate: {applicate or 'nessuna'}")
+    # Ereditata dai worker: DatabaseManager verifica solo la connessione
+    os.environ['DB_SKIP_MIGRATIONS'] = 'true'
+
+def worker_exit(server, worker):
+    """Eventi di tracciamento ancora in memoria scritti prima che il worker termini"""
+    app = sys.modules.get('etjca_cloud_agent')
+    if app is not None:
+        app.tracking_buffer.close()
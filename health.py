@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+ETJCA Health - Liveness e readiness per i controlli di Railway
+Database, pool, SMTP e code sono verificati da un thread in background a intervalli:
+gli endpoint restituiscono l'ultimo risultato senza lavoro sul percorso della richiesta
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', 15))
+PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', 5))
+QUEUE_LAG_MAX = float(os.getenv('HEALTH_QUEUE_LAG_MAX', 900))
+POOL_UTILIZATION_MAX = 0.9
+
+# Controlli senza i quali il processo non può servire richieste
+CRITICAL = ('database',)
+
+class HealthProber:
+    """Controlli delle dipendenze eseguiti in parallelo a intervalli, con l'ultimo risultato in memoria"""
+    
+    def __init__(self, db_manager, email_manager, interval: float = PROBE_INTERVAL,
+                 timeout: float = PROBE_TIMEOUT):
+        self.db_manager = db_manager
+        self.email_manager = email_manager
+        self.interval = interval
+        self.timeout = timeout
+        self.probes: Dict[str, Callable[[], Dict]] = {
+            'database': self.probe_database,
+            'pool': self.probe_pool,
+            'smtp': self.probe_smtp,
+            'code': self.probe_queues,
+        }
+        self.started = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.probes), thread_name_prefix='health-probe')
+        self._pending: Dict[str, Future] = {}
+        self._report: Optional[Dict] = None
+        self._updated = 0.0
+        self._first = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pool_timeouts = 0
+    
+    def start(self):
+        """Avvia il thread dei controlli alla prima richiesta (non all'import del modulo)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Errore controlli di salute: {e}")
+            time.sleep(self.interval)
+    
+    def refresh(self) -> Dict:
+        """Un giro di controlli; quelli oltre il timeout contano come falliti"""
+        start = time.perf_counter()
+        for name, probe in self.probes.items():
+            # Un controllo ancora bloccato dal giro precedente non viene rilanciato
+            if name not in self._pending or self._pending[name].done():
+                self._pending[name] = self._executor.submit(probe)
+        wait(self._pending.values(), timeout=self.timeout)
+        
+        controlli = {}
+        for name, future in self._pending.items():
+            if not future.done():
+                controlli[name] = {'stato': 'errore', 'messaggio': f'Nessuna risposta in {self.timeout:g}s'}
+            elif future.exception() is not None:
+                controlli[name] = {'stato': 'errore', 'messaggio': str(future.exception())}
+            else:
+                controlli[name] = future.result()
+        
+        pronto = all(controlli[name]['stato'] != 'errore' for name in CRITICAL)
+        if not pronto:
+            stato = 'non_pronto'
+        elif any(c['stato'] in ('errore', 'degradato') for c in controlli.values()):
+            stato = 'degradato'
+        else:
+            stato = 'ok'
+        report = {
+            'stato': stato,
+            'pronto': pronto,
+            'controlli': controlli,
+            'aggiornato_il': datetime.now().isoformat(),
+            'durata_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+        with self._lock:
+            self._report, self._updated = report, time.monotonic()
+        self._first.set()
+        return report
+    
+    def probe_database(self) -> Dict:
+        """Round-trip con SELECT 1 su una connessione del pool"""
+        if not self.db_manager.connected:
+            return {'stato': 'errore', 'messaggio': 'Database non connesso'}
+        start = time.perf_counter()
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        return {'stato': 'ok', 'latenza_ms': round((time.perf_counter() - start) * 1000, 1)}
+    
+    def probe_pool(self) -> Dict:
+        """Pool quasi saturo o prelievi scaduti dall'ultimo controllo"""
+        stats = self.db_manager.pool_stats()
+        if not stats:
+            return {'stato': 'non_configurato'}
+        timeouts = stats['timeouts'] - self._pool_timeouts
+        self._pool_timeouts = stats['timeouts']
+        return {
+            'stato': 'degradato' if timeouts or stats['utilization'] >= POOL_UTILIZATION_MAX else 'ok',
+            'in_uso': stats['in_use'],
+            'massimo': stats['max_size'],
+            'timeout_recenti': timeouts,
+        }
+    
+    def probe_smtp(self) -> Dict:
+        """Solo apertura TCP verso il server: nessun login a ogni controllo"""
+        if not self.email_manager.enabled:
+            return {'stato': 'non_configurato'}
+        start = time.perf_counter()
+        with socket.create_connection(
+            (self.email_manager.smtp_server, self.email_manager.smtp_port), timeout=self.timeout
+        ):
+            pass
+        return {'stato': 'ok', 'latenza_ms': round((time.perf_counter() - start) * 1000, 1)}
+    
+    def probe_queues(self) -> Dict:
+        """Ritardo del job in coda più vecchio e del messaggio dell'outbox pronto da più tempo"""
+        if not self.db_manager.connected:
+            return {'stato': 'errore', 'messaggio': 'Database non connesso'}
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT
+                    (SELECT creato_il FROM job_queue WHERE stato = 'in_coda' ORDER BY id LIMIT 1),
+                    (SELECT MIN(prossimo_tentativo) FROM email_outbox
+                     WHERE stato = 'in_attesa' AND prossimo_tentativo <= LOCALTIMESTAMP),
+                    LOCALTIMESTAMP
+            ''')
+            job, outbox, now = cursor.fetchone()
+        ritardi = {
+            'job_s': round((now - job).total_seconds(), 1) if job else 0,
+            'outbox_s': round((now - outbox).total_seconds(), 1) if outbox else 0,
+        }
+        stato = 'degradato' if max(ritardi.values()) > QUEUE_LAG_MAX else 'ok'
+        return dict(ritardi, stato=stato)
+    
+    def liveness(self) -> Dict:
+        """Il processo risponde: nessun controllo delle dipendenze"""
+        return {'stato': 'ok', 'pid': os.getpid(), 'attivo_da_s': round(time.monotonic() - self.started)}
+    
+    def readiness(self) -> Dict:
+        """Ultimo risultato dei controlli; non pronto se il thread ha smesso di aggiornarlo"""
+        self.start()
+        # Solo subito dopo l'avvio: attesa del primo giro di controlli
+        self._first.wait(self.timeout + 1)
+        with self._lock:
+            report, updated = self._report, self._updated
+        if report is None:
+            return {'stato': 'non_pronto', 'pronto': False, 'messaggio': 'Primo controllo in corso'}
+        eta = time.monotonic() - updated
+        if eta > 3 * self.interval + self.timeout:
+            report = dict(report, stato='non_pronto', pronto=False, messaggio='Controlli non aggiornati')
+        return dict(report, eta_s=round(eta, 1))
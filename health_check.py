@@ -3,42 +3,86 @@
 #!/usr/bin/env python3
 import requests
 import psycopg2
+import sqlite3
+import socket
 import os
+import sys
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
+# Ogni controllo ha un proprio timeout; l'attesa complessiva non supera TIMEOUT + 1 secondo
+TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', 5))
+
 def check_database():
+    url = os.getenv('DATABASE_URL', '')
+    if url.startswith('sqlite:'):
+        conn = sqlite3.connect(url[len('sqlite:///'):], timeout=TIMEOUT)
+    else:
+        conn = psycopg2.connect(
+            url, connect_timeout=max(int(TIMEOUT), 1), options=f'-c statement_timeout={int(TIMEOUT * 1000)}'
+        )
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
         cursor = conn.cursor()
         cursor.execute('SELECT 1')
-        conn.close()
         return True, "Database OK"
-    except Exception as e:
-        return False, f"Database Error: {e}"
+    finally:
+        conn.close()
 
 def check_web_app():
+    # Readiness dell'app: stato delle dipendenze visto dal prober in background
+    url = os.getenv('RAILWAY_STATIC_URL', 'http://localhost:5000')
+    response = requests.get(f"{url}/health/ready", timeout=TIMEOUT)
+    try:
+        stato = response.json().get('stato')
+    except ValueError:
+        stato = None
+    return response.status_code == 200, f"Web App: {response.status_code} {stato or ''}".strip()
+
+def check_smtp():
+    if not os.getenv('ETJCA_EMAIL'):
+        return True, "SMTP non configurato"
+    with socket.create_connection(('smtp.gmail.com', 587), timeout=TIMEOUT):
+        return True, "SMTP raggiungibile"
+
+CHECKS = {
+    'database': check_database,
+    'web_app': check_web_app,
+    'smtp': check_smtp,
+}
+
+def run_check(func):
+    start = time.perf_counter()
     try:
-        url = os.getenv('RAILWAY_STATIC_URL', 'http://localhost:5000')
-        response = requests.get(f"{url}/api/stats", timeout=10)
-        return response.status_code == 200, f"Web App: {response.status_code}"
+        ok, message = func()
     except Exception as e:
-        return False, f"Web App Error: {e}"
+        ok, message = False, f"{type(e).__name__}: {e}"
+    return ok, message, round((time.perf_counter() - start) * 1000, 1)
 
 def main():
-    checks = {
-        'database': check_database(),
-        'web_app': check_web_app(),
-        'timestamp': datetime.now().isoformat()
-    }
+    # Controlli in parallelo: la durata totale è quella del più lento, non la somma
+    executor = ThreadPoolExecutor(max_workers=len(CHECKS))
+    futures = {name: executor.submit(run_check, func) for name, func in CHECKS.items()}
+    wait(futures.values(), timeout=TIMEOUT + 1)
+    executor.shutdown(wait=False, cancel_futures=True)
+    
+    checks = {}
+    for name, future in futures.items():
+        if future.done():
+            ok, message, durata = future.result()
+        else:
+            ok, message, durata = False, f"Nessuna risposta in {TIMEOUT:g}s", None
+        checks[name] = {'status': ok, 'message': message, 'durata_ms': durata}
     
     result = {
-        'status': 'healthy' if all(check[0] for check in checks.values() if isinstance(check, tuple)) else 'unhealthy',
-        'checks': {k: {'status': v[0], 'message': v[1]} for k, v in checks.items() if isinstance(v, tuple)},
-        'timestamp': checks['timestamp']
+        'status': 'healthy' if all(check['status'] for check in checks.values()) else 'unhealthy',
+        'checks': checks,
+        'timestamp': datetime.now().isoformat()
     }
     
     print(json.dumps(result, indent=2))
+    return 0 if result['status'] == 'healthy' else 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+ETJCA HTTP Cache - ETag, richieste condizionali (304) e compressione gzip/brotli
+Pagine statiche rese e compresse una sola volta; risposte JSON compresse se il client le accetta
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+    logging.warning("brotli non disponibile - compressione solo gzip")
+
+# Le pagine cambiano solo con un nuovo deploy: il browser rivalida con l'ETag (304 senza corpo)
+PAGE_CACHE_CONTROL = os.getenv('PAGE_CACHE_CONTROL', 'public, no-cache')
+API_CACHE_CONTROL = 'private, no-cache'
+# Sotto questa dimensione la compressione costa più di quanto fa risparmiare
+MIN_COMPRESS_SIZE = int(os.getenv('HTTP_MIN_COMPRESS_SIZE', 1024))
+
+ENCODINGS = ('br', 'gzip') if HAS_BROTLI else ('gzip',)
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    """Livello massimo per le pagine statiche (una volta sola), veloce per le risposte dinamiche"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if static else 5)
+    return gzip.compress(body, compresslevel=9 if static else 6, mtime=0)
+
+def choose_encoding(request, encodings) -> str:
+    """Codifica preferita dal client (Accept-Encoding con i pesi q) tra quelle disponibili"""
+    return request.accept_encodings.best_match(list(encodings) + ['identity'], default='identity')
+
+def etag_for(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:32]
+
+def not_modified(request, tags) -> Optional[str]:
+    """ETag della richiesta condizionale che corrisponde a una delle varianti"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return next((tag for tag in tags if request.if_none_match.contains_weak(tag)), None)
+
+class StaticPage:
+    """Pagina resa al primo utilizzo e poi servita da memoria, con una variante per codifica"""
+    
+    def __init__(self, render: Callable[[], str], mimetype: str = 'text/html'):
+        self.render = render
+        self.mimetype = mimetype
+        self.variants: Optional[Dict[str, bytes]] = None
+        self.etags: Dict[str, str] = {}
+        self._lock = threading.Lock()
+    
+    def build(self):
+        with self._lock:
+            if self.variants is not None:
+                return
+            body = self.render().encode('utf-8')
+            # ETag forte diverso per ogni codifica: le varianti non sono identiche byte per byte
+            tag = etag_for(body)
+            variants = {'identity': body}
+            etags = {'identity': tag}
+            for encoding in ENCODINGS:
+                variants[encoding] = compress(body, encoding, static=True)
+                etags[encoding] = f'{tag}-{encoding}'
+            self.etags = etags
+            self.variants = variants
+    
+    def response(self, request, response_class):
+        if self.variants is None:
+            self.build()
+        headers = {'Cache-Control': PAGE_CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+        matched = not_modified(request, self.etags.values())
+        if matched:
+            response = response_class(status=304, headers=headers)
+            response.set_etag(matched)
+            return response
+        
+        encoding = choose_encoding(request, ENCODINGS)
+        response = response_class(self.variants[encoding], mimetype=self.mimetype, headers=headers)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etags[encoding])
+        return response
+
+def negotiate(request, response):
+    """ETag, 304 e compressione per le risposte JSON complete (non per stream e download)"""
+    if (response.status_code != 200 or response.mimetype != 'application/json'
+            or response.direct_passthrough or response.is_streamed):
+        return response
+    body = response.get_data()
+    tag = etag_for(body)
+    response.headers.setdefault('Cache-Control', API_CACHE_CONTROL)
+    response.vary.add('Accept-Encoding')
+    
+    matched = not_modified(request, [tag] + [f'{tag}-{encoding}' for encoding in ENCODINGS])
+    if matched:
+        response.status_code = 304
+        response.set_data(b'')
+        response.headers.pop('Content-Length', None)
+        response.set_etag(matched)
+        return response
+    
+    encoding = choose_encoding(request, ENCODINGS) if len(body) >= MIN_COMPRESS_SIZE else 'identity'
+    if encoding != 'identity':
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        tag = f'{tag}-{encoding}'
+    response.set_etag(tag)
+    return response
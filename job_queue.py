@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+ETJCA Job Queue - Coda lavori persistente su PostgreSQL
+Le campagne email vengono accodate dal web e eseguite dal processo worker
+"""
+
+import os
+import json
+import socket
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+JOB_COLUMNS = [
+    'id', 'tipo', 'stato', 'payload', 'risultato', 'totale', 'processati', 'inviate',
+    'fallite', 'tentativi', 'errore', 'worker', 'creato_il', 'avviato_il',
+    'aggiornato_il', 'completato_il'
+]
+
+class JobLostError(Exception):
+    """Il job non è più del worker (rimesso in coda dopo un timeout): l'esecuzione va interrotta"""
+
+def _job(row) -> Dict:
+    """Riga di job_queue come dizionario (su SQLite le colonne JSON tornano come testo)"""
+    job = dict(zip(JOB_COLUMNS, row))
+    for column in ('payload', 'risultato'):
+        if isinstance(job[column], str):
+            job[column] = json.loads(job[column])
+    return job
+
+class JobQueue:
+    """Coda lavori con claim concorrente tramite FOR UPDATE SKIP LOCKED"""
+    
+    def __init__(self, db_manager, max_tentativi: int = 3):
+        self.db_manager = db_manager
+        self.max_tentativi = max_tentativi
+        self.handlers: Dict[str, Callable] = {}
+    
+    def register(self, tipo: str, handler: Callable):
+        """Associa un handler a un tipo di lavoro: handler(job, queue) -> dict"""
+        self.handlers[tipo] = handler
+    
+    def enqueue(self, tipo: str, payload: Dict, totale: int = 0) -> int:
+        """Accoda un lavoro e restituisce il suo id"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO job_queue (tipo, payload, totale)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            ''', (tipo, json.dumps(payload), totale))
+            job_id = cursor.fetchone()[0]
+        
+        logging.info(f"Job {job_id} ({tipo}) accodato: {totale} elementi")
+        return job_id
+    
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Preleva il prossimo lavoro in coda senza contese tra worker"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE job_queue SET
+                    stato = 'in_esecuzione',
+                    worker = %s,
+                    tentativi = tentativi + 1,
+                    avviato_il = COALESCE(avviato_il, CURRENT_TIMESTAMP),
+                    aggiornato_il = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM job_queue
+                    WHERE stato = 'in_coda'
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING {', '.join(JOB_COLUMNS)}
+            ''', (worker,))
+            row = cursor.fetchone()
+        
+        return _job(row) if row else None
+    
+    def set_progress(self, job_id: int, worker: str, inviate: int, fallite: int, totale: Optional[int] = None):
+        """Aggiorna l'avanzamento del job (funge anche da heartbeat); JobLostError se il job
+        è stato rimesso in coda e non appartiene più a worker"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE job_queue SET
+                    totale = COALESCE(%s, totale),
+                    processati = %s,
+                    inviate = %s,
+                    fallite = %s,
+                    aggiornato_il = CURRENT_TIMESTAMP
+                WHERE id = %s AND worker = %s AND stato = 'in_esecuzione'
+            ''', (totale, inviate + fallite, inviate, fallite, job_id, worker))
+            if not cursor.rowcount:
+                raise JobLostError(f"Job {job_id} non più assegnato a {worker}")
+    
+    def heartbeat(self, job_id: int, worker: str):
+        """Segnala che il job è ancora in esecuzione, per le fasi senza avanzamento da riportare"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE job_queue SET aggiornato_il = CURRENT_TIMESTAMP
+                WHERE id = %s AND worker = %s AND stato = 'in_esecuzione'
+            ''', (job_id, worker))
+            if not cursor.rowcount:
+                raise JobLostError(f"Job {job_id} non più assegnato a {worker}")
+    
+    def complete(self, job_id: int, worker: str, risultato: Optional[Dict] = None) -> bool:
+        """Segna il job completato; False (risultato scartato) se non appartiene più a worker"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE job_queue SET
+                    stato = 'completato',
+                    risultato = %s,
+                    aggiornato_il = CURRENT_TIMESTAMP,
+                    completato_il = CURRENT_TIMESTAMP
+                WHERE id = %s AND worker = %s AND stato = 'in_esecuzione'
+            ''', (json.dumps(risultato or {}), job_id, worker))
+            completato = bool(cursor.rowcount)
+        if completato:
+            logging.info(f"Job {job_id} completato")
+        else:
+            logging.warning(f"Job {job_id} non più assegnato a {worker}: risultato scartato")
+        return completato
+    
+    def fail(self, job_id: int, worker: str, errore: str):
+        """Rimette in coda il lavoro o lo segna fallito dopo max_tentativi"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE job_queue SET
+                    stato = CASE WHEN tentativi >= %s THEN 'fallito' ELSE 'in_coda' END,
+                    errore = %s,
+                    worker = NULL,
+                    aggiornato_il = CURRENT_TIMESTAMP,
+                    completato_il = CASE WHEN tentativi >= %s THEN CURRENT_TIMESTAMP END
+                WHERE id = %s AND worker = %s AND stato = 'in_esecuzione'
+            ''', (self.max_tentativi, errore, self.max_tentativi, job_id, worker))
+        logging.error(f"Job {job_id} in errore: {errore}")
+    
+    def requeue_stale(self, stale_after: int = 300) -> int:
+        """Rimette in coda i lavori di worker morti (nessun heartbeat recente); dopo max_tentativi
+        il job è fallito: un lavoro che blocca o termina il worker non viene ripreso all'infinito"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE job_queue SET
+                    stato = CASE WHEN tentativi >= %s THEN 'fallito' ELSE 'in_coda' END,
+                    errore = 'Worker ' || worker || ' senza heartbeat da oltre ' || %s || ' secondi',
+                    worker = NULL,
+                    aggiornato_il = CURRENT_TIMESTAMP,
+                    completato_il = CASE WHEN tentativi >= %s THEN CURRENT_TIMESTAMP END
+                WHERE stato = 'in_esecuzione'
+                  AND aggiornato_il < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                RETURNING stato
+            ''', (self.max_tentativi, stale_after, self.max_tentativi, stale_after))
+            stati = [row[0] for row in cursor.fetchall()]
+        
+        falliti = stati.count('fallito')
+        if len(stati) > falliti:
+            logging.warning(f"{len(stati) - falliti} job rimessi in coda dopo timeout worker")
+        if falliti:
+            logging.error(f"{falliti} job falliti dopo timeout worker ({self.max_tentativi} tentativi)")
+        return len(stati)
+    
+    def stats(self) -> Dict:
+        """Numero di job per stato"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT stato, COUNT(*) FROM job_queue GROUP BY stato')
+            return dict(cursor.fetchall())
+    
+    def get_status(self, job_id: int) -> Optional[Dict]:
+        """Stato, avanzamento e tempo stimato di completamento"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {', '.join(JOB_COLUMNS)}, LOCALTIMESTAMP
+                FROM job_queue WHERE id = %s
+            ''', (job_id,))
+            row = cursor.fetchone()
+        
+        if not row:
+            return None
+        
+        job = _job(row[:-1])
+        now = row[-1]
+        totale, processati = job['totale'] or 0, job['processati'] or 0
+        
+        eta_secondi = None
+        if job['stato'] == 'in_esecuzione' and job['avviato_il'] and processati:
+            elapsed = (now - job['avviato_il']).total_seconds()
+            eta_secondi = round(elapsed / processati * max(totale - processati, 0))
+        
+        return {
+            'id': job['id'],
+            'tipo': job['tipo'],
+            'stato': job['stato'],
+            'totale': totale,
+            'processati': processati,
+            'inviate': job['inviate'],
+            'fallite': job['fallite'],
+            'progresso': round(processati / totale * 100, 1) if totale else 0,
+            'eta_secondi': eta_secondi,
+            'errore': job['errore'],
+            'risultato': job['risultato'],
+            'creato_il': job['creato_il'].isoformat() if job['creato_il'] else None,
+            'avviato_il': job['avviato_il'].isoformat() if job['avviato_il'] else None,
+            'completato_il': job['completato_il'].isoformat() if job['completato_il'] else None
+        }
+
+class JobWorker:
+    """Esegue in loop i lavori in coda (processo worker)"""
+    
+    def __init__(self, queue: JobQueue, poll_interval: float = None, stale_after: int = None):
+        self.queue = queue
+        self.poll_interval = poll_interval or float(os.getenv('JOB_POLL_INTERVAL', 5))
+        self.stale_after = stale_after or int(os.getenv('JOB_STALE_AFTER', 300))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    
+    def run_once(self) -> bool:
+        """Esegue un lavoro se disponibile; False se la coda è vuota"""
+        job = self.queue.claim(self.worker_id)
+        if not job:
+            return False
+        
+        handler = self.queue.handlers.get(job['tipo'])
+        if handler is None:
+            self.queue.fail(job['id'], self.worker_id, f"Nessun handler per il tipo {job['tipo']}")
+            return True
+        
+        logging.info(f"Job {job['id']} ({job['tipo']}) avviato da {self.worker_id}")
+        try:
+            self.queue.complete(job['id'], self.worker_id, handler(job, self.queue))
+        except JobLostError as e:
+            # Rimesso in coda dopo un timeout: l'altra esecuzione ne è ora responsabile
+            logging.warning(f"Job {job['id']} interrotto: {e}")
+        except Exception as e:
+            self.queue.fail(job['id'], self.worker_id, str(e))
+        return True
+    
+    def run_forever(self, stop_event: Optional[threading.Event] = None):
+        stop_event = stop_event or threading.Event()
+        logging.info(f"⚙️ Job worker {self.worker_id} avviato")
+        
+        while not stop_event.is_set():
+            try:
+                self.queue.requeue_stale(self.stale_after)
+                while self.run_once() and not stop_event.is_set():
+                    pass
+            except Exception as e:
+                logging.error(f"Errore job worker: {e}")
+            stop_event.wait(self.poll_interval)
+    
+    def start(self) -> threading.Thread:
+        """Avvia il worker in un thread daemon"""
+        thread = threading.Thread(target=self.run_forever, name='job-worker', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+ETJCA Lead Pipeline - Ciclo di lead generation a stadi concorrenti
+sorgenti -> normalizzazione -> deduplica -> punteggio -> salvataggio -> outreach
+Gli stadi sono generatori collegati da code limitate; quelli di I/O girano su più thread
+"""
+
+import os
+import queue
+import shutil
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bulk_import import IMPORT_COLUMNS, detect_format, read_rows, validate_row
+from dedup import DuplicateIndex
+from scoring import TARGET_SETTORI, SOGLIA_FATTURATO, SOGLIA_DIPENDENTI
+
+BATCH_SIZE = 500
+QUEUE_SIZE = 8
+OUTREACH_JOB_SIZE = 2000
+
+# Tipi espliciti per le colonne numeriche: VALUES con soli NULL sarebbe di tipo text (SQLite li ignora)
+PG_TYPES = {'fatturato': 'bigint', 'dipendenti': 'integer'}
+
+_FINE = object()
+
+def _rows(item) -> int:
+    return len(item) if isinstance(item, list) else 1
+
+class Batch(list):
+    """Blocco di righe con il sorgente da cui proviene"""
+    
+    def __init__(self, rows: Iterable, sorgente: Optional[str] = None):
+        super().__init__(rows)
+        self.sorgente = sorgente
+    
+    @classmethod
+    def of(cls, rows: Iterable, origin) -> 'Batch':
+        """Blocco prodotto da uno stadio: conserva il sorgente del blocco ricevuto"""
+        return cls(rows, getattr(origin, 'sorgente', None))
+
+class Stage:
+    """Stadio della pipeline: func(elemento) è un generatore di elementi per lo stadio successivo;
+    on_error(elemento, errore) viene chiamata quando func fallisce su un elemento"""
+    
+    def __init__(self, name: str, func: Callable[[object], Iterator], workers: int = 1,
+                 on_error: Optional[Callable[[object, Exception], None]] = None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        self.ricevuti = 0
+        self.prodotti = 0
+        self.righe_in = 0
+        self.righe_out = 0
+        self.errori = 0
+        self.latenze: List[float] = []
+    
+    def record(self, elapsed: float, prodotti: int, righe_in: int, righe_out: int, errore: bool):
+        with self.lock:
+            self.ricevuti += 1
+            self.prodotti += prodotti
+            self.righe_in += righe_in
+            self.righe_out += righe_out
+            self.errori += int(errore)
+            self.latenze.append(elapsed)
+    
+    def stats(self, durata: float) -> Dict:
+        """Throughput sull'intero ciclo e latenza di elaborazione per elemento"""
+        latenze = sorted(self.latenze) or [0.0]
+        righe = self.righe_in or self.righe_out
+        return {
+            'stadio': self.name,
+            'thread': self.workers,
+            'elementi': self.ricevuti,
+            'righe_in': self.righe_in,
+            'righe_out': self.righe_out,
+            'errori': self.errori,
+            'righe_al_secondo': round(righe / durata, 1) if durata else 0,
+            'latenza_media_ms': round(sum(latenze) / len(latenze) * 1000, 1),
+            'latenza_p95_ms': round(latenze[min(len(latenze) - 1, int(len(latenze) * 0.95))] * 1000, 1),
+        }
+
+class Pipeline:
+    """Esegue gli stadi in thread separati collegati da code limitate (backpressure)"""
+    
+    def __init__(self, stages: List[Stage], queue_size: int = QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+    
+    def run(self, items: Iterable) -> Tuple[List, List[Dict]]:
+        """Elabora gli elementi e restituisce (uscite dell'ultimo stadio, statistiche per stadio)"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = []
+        start = time.monotonic()
+        
+        for stage in self.stages:
+            stage.reset()
+        
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], queues[index + 1], remaining),
+                    name=f"pipeline-{stage.name}-{n}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+        
+        feeder = threading.Thread(target=self._feed, args=(items, queues[0], self.stages[0].workers), daemon=True)
+        feeder.start()
+        
+        results = []
+        while True:
+            item = queues[-1].get()
+            if item is _FINE:
+                break
+            results.append(item)
+        
+        for thread in threads:
+            thread.join()
+        durata = time.monotonic() - start
+        return results, [stage.stats(durata) for stage in self.stages]
+    
+    def _feed(self, items: Iterable, output: queue.Queue, workers: int):
+        try:
+            for item in items:
+                output.put(item)
+        except Exception as e:
+            logging.error(f"Errore sorgenti pipeline: {e}")
+        finally:
+            for _ in range(workers):
+                output.put(_FINE)
+    
+    def _work(self, stage: Stage, input_queue: queue.Queue, output: queue.Queue, remaining: List[int]):
+        next_stage = self.stages.index(stage) + 1
+        while True:
+            item = input_queue.get()
+            if item is _FINE:
+                break
+            
+            elapsed, prodotti, righe_out, errore = 0.0, 0, 0, False
+            generator = stage.func(item)
+            while True:
+                # La latenza esclude l'attesa sulla coda a valle
+                started = time.monotonic()
+                try:
+                    result = next(generator)
+                except StopIteration:
+                    elapsed += time.monotonic() - started
+                    break
+                except Exception as e:
+                    elapsed += time.monotonic() - started
+                    errore = True
+                    logging.error(f"Errore stadio {stage.name}: {e}")
+                    if stage.on_error:
+                        stage.on_error(item, e)
+                    break
+                elapsed += time.monotonic() - started
+                prodotti += 1
+                righe_out += _rows(result)
+                output.put(result)
+            stage.record(elapsed, prodotti, _rows(item) if isinstance(item, list) else 0, righe_out, errore)
+        
+        # L'ultimo thread dello stadio chiude lo stadio successivo
+        with stage.lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            workers = self.stages[next_stage].workers if next_stage < len(self.stages) else 1
+            for _ in range(workers):
+                output.put(_FINE)
+
+def directory_sources(directory: str) -> List[Tuple[str, Callable[[], Iterator[Dict]]]]:
+    """Un sorgente per ogni file CSV/XLSX/NDJSON presente nella cartella di arrivo"""
+    sources = []
+    if not os.path.isdir(directory):
+        return sources
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        formato = detect_format(filename)
+        if formato and os.path.isfile(path):
+            sources.append((path, lambda path=path, formato=formato: _read_file(path, formato)))
+    return sources
+
+def _read_file(path: str, formato: str) -> Iterator[Dict]:
+    with open(path, 'rb') as stream:
+        for _, row in read_rows(stream, formato):
+            yield row
+
+def priorita_lead(lead: Dict) -> str:
+    """Priorità in base al target: settore e dimensione aziendale"""
+    settore = (lead.get('settore') or '').lower()
+    in_target = any(target in settore for target in TARGET_SETTORI)
+    grande = (lead.get('fatturato') or 0) > SOGLIA_FATTURATO or (lead.get('dipendenti') or 0) > SOGLIA_DIPENDENTI
+    if in_target and grande:
+        return 'alta'
+    if in_target or grande:
+        return 'media'
+    return 'bassa'
+
+class LeadPipeline:
+    """Stadi della lead generation sul database ETJCA"""
+    
+    def __init__(self, db_manager, job_queue=None, outreach: bool = False):
+        self.db_manager = db_manager
+        self.job_queue = job_queue
+        self.outreach = outreach
+        self.batch_size = int(os.getenv('PIPELINE_BATCH_SIZE', BATCH_SIZE))
+        self.inbox = os.getenv('LEAD_INBOX_DIR', 'lead_in_arrivo')
+        self.outreach_job_size = int(os.getenv('OUTREACH_JOB_SIZE', OUTREACH_JOB_SIZE))
+        self._pending: List[int] = []
+        self.sources: Dict[str, Callable[[], Iterator[Dict]]] = {}
+        self._seen = DuplicateIndex()
+        self._seen_lock = threading.Lock()
+        self._lock = threading.Lock()
+        
+        io_workers = int(os.getenv('PIPELINE_IO_WORKERS', 4))
+        db_workers = int(os.getenv('PIPELINE_DB_WORKERS', 2))
+        # Un errore in qualsiasi stadio lascia il file del blocco nella cartella di arrivo
+        self.pipeline = Pipeline([
+            Stage('sorgenti', self.source, workers=io_workers, on_error=self._failed),
+            Stage('normalizzazione', self.normalize, on_error=self._failed),
+            Stage('deduplica', self.dedupe, workers=db_workers, on_error=self._failed),
+            Stage('punteggio', self.score, on_error=self._failed),
+            Stage('salvataggio', self.persist, workers=db_workers, on_error=self._failed),
+            Stage('outreach', self.enqueue_outreach, on_error=self._failed),
+        ], queue_size=int(os.getenv('PIPELINE_QUEUE_SIZE', QUEUE_SIZE)))
+    
+    def register_source(self, name: str, func: Callable[[], Iterator[Dict]]):
+        """Registra un sorgente di lead (es. scraper): func() restituisce righe come dizionari"""
+        self.sources[name] = func
+    
+    def run(self) -> Dict:
+        """Esegue un ciclo completo e restituisce il report con le statistiche per stadio"""
+        file_sources = directory_sources(self.inbox)
+        sources = list(self.sources.items()) + file_sources
+        report = {'sorgenti': len(sources), 'lette': 0, 'scartate': 0, 'duplicati': 0,
+                  'inserite': 0, 'job_outreach': [], 'sorgenti_fallite': []}
+        self._report = report
+        self._seen = DuplicateIndex(self.db_manager.duplicates.index.threshold)
+        self._pending = []
+        
+        start = time.monotonic()
+        results, stats = self.pipeline.run(sources)
+        self._flush_outreach()
+        report['durata_secondi'] = round(time.monotonic() - start, 2)
+        report['stadi'] = stats
+        
+        if report['inserite']:
+            self.db_manager.invalidate_stats()
+        self._archive([path for path, _ in file_sources if path not in report['sorgenti_fallite']])
+        
+        logging.info(
+            f"🔄 Ciclo lead completato in {report['durata_secondi']}s: {report['lette']} lette, "
+            f"{report['inserite']} inserite, {report['duplicati']} duplicati, {report['scartate']} scartate"
+        )
+        for stage in stats:
+            logging.info(
+                f"   {stage['stadio']:<16} {stage['righe_in']:>7} -> {stage['righe_out']:<7} righe  {stage['righe_al_secondo']:>9} righe/s  "
+                f"latenza media {stage['latenza_media_ms']} ms  p95 {stage['latenza_p95_ms']} ms  errori {stage['errori']}"
+            )
+        return report
+    
+    def _count(self, key: str, value: int):
+        with self._lock:
+            self._report[key] += value
+    
+    def _failed(self, item, error: Exception):
+        """Sorgente da rileggere al ciclo successivo: i lead già salvati risultano duplicati"""
+        sorgente = item[0] if isinstance(item, tuple) else getattr(item, 'sorgente', None)
+        if sorgente is None:
+            return
+        with self._lock:
+            if sorgente not in self._report['sorgenti_fallite']:
+                self._report['sorgenti_fallite'].append(sorgente)
+    
+    def source(self, item: Tuple[str, Callable[[], Iterator[Dict]]]) -> Iterator[Batch]:
+        """Legge un sorgente a blocchi; la fonte di default è il nome del sorgente"""
+        name, func = item
+        fonte = os.path.splitext(os.path.basename(name))[0][:50]
+        batch = Batch([], name)
+        for row in func():
+            if row is not None and not row.get('fonte'):
+                row['fonte'] = fonte
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = Batch([], name)
+        if batch:
+            yield batch
+    
+    def normalize(self, batch: Batch) -> Iterator[Batch]:
+        """Validazione e normalizzazione con le regole dell'import massivo"""
+        leads = Batch.of([], batch)
+        for row in batch:
+            values, error = validate_row(row)
+            if error:
+                continue
+            leads.append(dict(zip(IMPORT_COLUMNS, values)))
+        self._count('lette', len(batch))
+        self._count('scartate', len(batch) - len(leads))
+        if leads:
+            yield leads
+    
+    def dedupe(self, leads: Batch) -> Iterator[Batch]:
+        """Scarta le aziende simili a lead del ciclo o a prospect già presenti"""
+        unique = Batch.of([], leads)
+        with self._seen_lock:
+            for lead in leads:
+                emails = (lead['email'], lead['email_hr'])
+                if not self._seen.match(lead['ragione_sociale'], lead['sito_web'], emails, limit=1):
+                    self._seen.add(len(self._seen), lead['ragione_sociale'], lead['sito_web'], emails)
+                    unique.append(lead)
+        
+        if unique:
+            unique = Batch.of((
+                lead for lead, candidati in zip(unique, self.db_manager.duplicates.find_many(unique))
+                if not candidati
+            ), leads)
+        
+        self._count('duplicati', len(leads) - len(unique))
+        if unique:
+            yield unique
+    
+    def score(self, leads: Batch) -> Iterator[Batch]:
+        # Priorità iniziale: il punteggio completo arriva dal LeadScorer a fine ciclo
+        for lead in leads:
+            if not lead.get('priorita'):
+                lead['priorita'] = priorita_lead(lead)
+        yield leads
+    
+    def persist(self, leads: Batch) -> Iterator[Batch]:
+        """Inserimento multi-riga; il controllo di esistenza è ripetuto sotto lock come nell'import"""
+        columns = ', '.join(IMPORT_COLUMNS)
+        values = ', '.join(['(' + ', '.join(['%s'] * len(IMPORT_COLUMNS)) + ')'] * len(leads))
+        params = []
+        for lead in leads:
+            params.extend(
+                lead[column] if lead[column] is not None or column in ('fatturato', 'dipendenti') else ''
+                for column in IMPORT_COLUMNS
+            )
+        
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('prospect_bulk_import'))")
+            cursor.execute(f'''
+                WITH n ({columns}) AS (VALUES {values})
+                INSERT INTO prospect ({columns})
+                SELECT {', '.join(f"n.{c}::{PG_TYPES.get(c, 'text')}" for c in IMPORT_COLUMNS)}
+                FROM n
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM prospect p
+                    WHERE lower(p.ragione_sociale) = lower(n.ragione_sociale)
+                      AND COALESCE(p.provincia, '') = COALESCE(n.provincia, '')
+                )
+                RETURNING id, email_hr
+            ''', params)
+            inserted = cursor.fetchall()
+        
+        self._count('inserite', len(inserted))
+        self._count('duplicati', len(leads) - len(inserted))
+        if inserted:
+            yield Batch.of(inserted, leads)
+    
+    def enqueue_outreach(self, inserted: Batch) -> Iterator[int]:
+        """Accoda campagne email da OUTREACH_JOB_SIZE nuovi prospect con email HR"""
+        if not (self.outreach and self.job_queue):
+            return
+        self._pending.extend(prospect_id for prospect_id, email_hr in inserted if email_hr)
+        while len(self._pending) >= self.outreach_job_size:
+            prospect_ids = self._pending[:self.outreach_job_size]
+            del self._pending[:self.outreach_job_size]
+            yield self._enqueue_campaign(prospect_ids)
+    
+    def _flush_outreach(self):
+        # Campagna con i prospect residui di fine ciclo
+        if self._pending:
+            self._enqueue_campaign(self._pending)
+            self._pending = []
+    
+    def _enqueue_campaign(self, prospect_ids: List[int]) -> int:
+        job_id = self.job_queue.enqueue('campagna_email', {'prospect_ids': prospect_ids}, totale=len(prospect_ids))
+        self._report['job_outreach'].append(job_id)
+        return job_id
+    
+    def _archive(self, paths: List[str]):
+        """Sposta i file elaborati nella sottocartella 'elaborati'"""
+        if not paths:
+            return
+        archive = os.path.join(self.inbox, 'elaborati')
+        os.makedirs(archive, exist_ok=True)
+        for path in paths:
+            try:
+                shutil.move(path, os.path.join(archive, f"{time.strftime('%Y%m%d_%H%M%S')}_{os.path.basename(path)}"))
+            except Exception as e:
+                logging.error(f"Errore archiviazione {path}: {e}")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+ETJCA Live Events - Aggiornamenti in tempo reale per la dashboard
+Trigger PostgreSQL -> LISTEN/NOTIFY -> un solo ricalcolo -> Server-Sent Events
+(su SQLite i trigger scrivono nella tabella eventi_live, letta a intervalli)
+"""
+
+import os
+import json
+import queue
+import select
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Funzione e trigger di notifica: migrazione 0004_eventi_live
+CHANNEL = 'etjca_eventi'
+POLL_INTERVAL = 1.0
+# Attesa massima di una notifica PostgreSQL: anche il ritardo con cui il listener si accorge
+# che non ci sono più client e chiude la sua connessione
+LISTEN_TIMEOUT = 30
+# Ogni stream occupa un thread del worker gthread (8 in Procfile) per tutta la sua durata:
+# oltre il limite il client riceve 503 e la dashboard passa al refresh periodico
+MAX_SUBSCRIBERS = int(os.getenv('SSE_MAX_CLIENTS', 4))
+
+def describe(event: Dict) -> str:
+    """Messaggio per il log della dashboard"""
+    righe = event.get('righe', 0)
+    descrizione = event.get('descrizione')
+    if event.get('tabella') == 'prospect':
+        if event.get('operazione') == 'INSERT':
+            return f"Nuovo prospect: {descrizione}" if righe == 1 else f"{righe} prospect importati"
+        return f"Prospect aggiornato: {descrizione}" if righe == 1 else f"{righe} prospect aggiornati"
+    if righe == 1 and descrizione:
+        return f"Attività: {descrizione}"
+    return f"{righe} attività registrate"
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+class LiveEventHub:
+    """Ascolta le notifiche PostgreSQL e le distribuisce ai client SSE"""
+    
+    def __init__(self, db_manager, debounce: float = 0.5, max_queue: int = 100,
+                 max_subscribers: int = MAX_SUBSCRIBERS):
+        self.db_manager = db_manager
+        self.debounce = debounce
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._subscribers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+    
+    def subscribe(self) -> Optional[queue.Queue]:
+        """Registra un client (None se i client sono già max_subscribers); avvia il listener al primo iscritto
+        (si ferma da solo dopo l'ultimo)"""
+        client = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.append(client)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='live-events', daemon=True)
+                self._thread.start()
+        return client
+    
+    def unsubscribe(self, client: queue.Queue):
+        with self._lock:
+            if client in self._subscribers:
+                self._subscribers.remove(client)
+    
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+    
+    def publish(self, event: str, data):
+        """Serializza l'evento una sola volta e lo accoda a tutti i client"""
+        frame = format_sse(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for client in subscribers:
+            try:
+                client.put_nowait(frame)
+            except queue.Full:
+                # Client troppo lento: lo si scollega, EventSource si riconnetterà
+                self.unsubscribe(client)
+    
+    def _run(self):
+        """Listener su una connessione dedicata (fuori dal pool) finché ci sono client: dopo l'ultimo
+        il thread termina e chiude la connessione, il prossimo subscribe() ne avvia uno nuovo"""
+        backoff = 1
+        while True:
+            conn = None
+            errore = False
+            try:
+                conn = self.db_manager.open_dedicated_connection()
+                conn.autocommit = True
+                logging.info("📡 Listener eventi live attivo")
+                backoff = 1
+                if self.db_manager.dialect == 'sqlite':
+                    self._poll(conn)
+                else:
+                    conn.cursor().execute(f'LISTEN {CHANNEL}')
+                    self._listen(conn)
+            except Exception as e:
+                logging.error(f"Errore listener eventi live: {e}")
+                errore = True
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            if errore:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            # Sotto lock: un client che si iscrive adesso trova il thread ancora registrato oppure ne avvia uno
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    logging.info("📡 Listener eventi live fermato: nessun client collegato")
+                    return
+    
+    def _listen(self, conn):
+        while self._subscribers:
+            if select.select([conn], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                continue
+            conn.poll()
+            
+            # Raccoglie le notifiche arrivate a raffica prima di ricalcolare
+            deadline = time.monotonic() + self.debounce
+            while time.monotonic() < deadline:
+                if select.select([conn], [], [], max(deadline - time.monotonic(), 0)) != ([], [], []):
+                    conn.poll()
+            
+            events = []
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    events.append(json.loads(notify.payload))
+                except ValueError:
+                    continue
+            if events:
+                self._dispatch(events)
+    
+    def _poll(self, conn):
+        """SQLite: righe nuove di eventi_live, raggruppate per tabella e operazione come le notifiche
+        (le righe vecchie le cancella il trigger della migrazione 0012)"""
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM eventi_live')
+        last = cursor.fetchone()[0]
+        while self._subscribers:
+            time.sleep(max(POLL_INTERVAL, self.debounce))
+            cursor.execute('''
+                SELECT id, tabella, operazione, descrizione FROM eventi_live WHERE id > %s ORDER BY id
+            ''', (last,))
+            rows = cursor.fetchall()
+            if rows:
+                last = rows[-1][0]
+                events = {}
+                for _, tabella, operazione, descrizione in rows:
+                    event = events.setdefault((tabella, operazione), {
+                        'tabella': tabella, 'operazione': operazione, 'righe': 0, 'descrizione': descrizione
+                    })
+                    event['righe'] += 1
+                self._dispatch(list(events.values()))
+    
+    def _dispatch(self, events: List[Dict]):
+        """Un solo ricalcolo delle statistiche per blocco di modifiche"""
+        self.db_manager.invalidate_stats()
+        if not self._subscribers:
+            return
+        self.publish('stats', self.db_manager.get_stats())
+        for event in events:
+            self.publish('log', {'message': describe(event)})
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+ETJCA Metrics - Metriche in formato Prometheus per /metrics
+Ogni processo (worker gunicorn, scheduler) tiene i valori in memoria e li salva in METRICS_DIR;
+alla lettura i file di tutti i processi vengono sommati
+"""
+
+import os
+import json
+import time
+import atexit
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'etjca_metrics'))
+FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# File di processi terminati da più di N secondi: eliminati (i contatori ripartono come dopo un riavvio)
+RETENTION = float(os.getenv('METRICS_RETENTION', 3600))
+
+# Secondi: da una query su indice a un invio SMTP lento
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: Tuple[str, ...], values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Metric:
+    """Serie per combinazione di etichette, protette da un lock"""
+    
+    kind = ''
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+    
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Valore istantaneo del processo; alla lettura si sommano i processi ancora vivi"""
+    
+    kind = 'gauge'
+    
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    """Conteggi per bucket (non cumulativi), somma e numero di osservazioni"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Misura il blocco, anche se termina con un'eccezione"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def timed(self, **labels) -> Callable:
+        """Decoratore: durata di ogni chiamata della funzione"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {json.dumps(key): list(value) for key, value in self._values.items()}
+
+class Registry:
+    """Metriche del processo, salvate periodicamente e unite a quelle degli altri processi"""
+    
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable] = []
+        self._lock = threading.Lock()
+        self._pid = None
+    
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+    
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+    
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+    
+    def collector(self, func: Callable):
+        """Funzione chiamata prima di ogni salvataggio (es. per aggiornare i gauge del pool)"""
+        self._collectors.append(func)
+        return func
+    
+    def start(self):
+        """Avvia il salvataggio periodico; dopo un fork il figlio riparte da zero con il suo file"""
+        pid = os.getpid()
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                for metric in self._metrics.values():
+                    metric.reset()
+            self._pid = pid
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+    
+    def _run(self):
+        while self._pid == os.getpid():
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning(f"Salvataggio metriche non riuscito: {e}")
+    
+    def _snapshot(self) -> Dict:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logging.debug(f"Collector metriche in errore: {e}")
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {'kind': metric.kind, 'values': metric.snapshot()}
+            for metric in metrics
+        }
+    
+    def flush(self):
+        """Scrittura atomica del file del processo"""
+        if self._pid != os.getpid():
+            return
+        path = os.path.join(self.directory, f'metrics_{self._pid}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as handle:
+            json.dump(self._snapshot(), handle)
+        os.replace(path + '.tmp', path)
+    
+    def collect(self) -> Dict[str, Dict]:
+        """Valori sommati su tutti i processi: contatori e istogrammi anche dei processi terminati,
+        gauge solo dei processi vivi"""
+        snapshots = {os.getpid(): self._snapshot()}
+        for filename in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if not (filename.startswith('metrics_') and filename.endswith('.json')):
+                continue
+            pid = int(filename[len('metrics_'):-len('.json')])
+            if pid in snapshots:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                if not process_alive(pid) and time.time() - os.path.getmtime(path) > RETENTION:
+                    os.remove(path)
+                    continue
+                with open(path, encoding='utf-8') as handle:
+                    snapshots[pid] = json.load(handle)
+            except (OSError, ValueError):
+                continue
+        
+        merged: Dict[str, Dict] = {}
+        for pid, snapshot in snapshots.items():
+            alive = None
+            for name, data in snapshot.items():
+                if data['kind'] == 'gauge':
+                    alive = process_alive(pid) if alive is None else alive
+                    if not alive:
+                        continue
+                values = merged.setdefault(name, {})
+                for key, value in data['values'].items():
+                    if isinstance(value, list):
+                        current = values.get(key)
+                        values[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                    else:
+                        values[key] = values.get(key, 0) + value
+        return merged
+    
+    def render(self, extra: Optional[List[Tuple[Metric, Dict]]] = None) -> str:
+        """Testo nel formato di esposizione Prometheus; extra: metriche calcolate al momento della lettura"""
+        merged = self.collect()
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric, values in [(m, merged.get(m.name, {})) for m in metrics] + list(extra or []):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key, value in sorted(values.items()):
+                label_values = json.loads(key) if isinstance(key, str) else key
+                if metric.kind != 'histogram':
+                    lines.append(f'{metric.name}{_labels(metric.labels, label_values)} {_format(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-2]):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float('inf') else f'le="{_format(bound)}"'
+                    lines.append(f'{metric.name}_bucket{_labels(metric.labels, label_values, le)} {cumulative}')
+                lines.append(f'{metric.name}_sum{_labels(metric.labels, label_values)} {_format(value[-2])}')
+                lines.append(f'{metric.name}_count{_labels(metric.labels, label_values)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+HTTP_REQUEST = registry.histogram(
+    'etjca_http_request_duration_seconds', 'Durata delle richieste HTTP per route', ('route', 'method', 'status')
+)
+DB_QUERY = registry.histogram(
+    'etjca_db_query_duration_seconds', 'Durata delle operazioni di DatabaseManager', ('metodo',)
+)
+SMTP = registry.histogram(
+    'etjca_smtp_duration_seconds', 'Durata di connessione (con login) e invio SMTP', ('fase',)
+)
+SMTP_ERRORS = registry.counter(
+    'etjca_smtp_errors_total', 'Errori SMTP per fase', ('fase',)
+)
+TRACKING_EVENTS = registry.counter(
+    'etjca_email_eventi_total', 'Aperture e click delle email ricevuti', ('tipo',)
+)
+TRACKING_PENDING = registry.gauge(
+    'etjca_email_eventi_in_attesa', 'Eventi di tracciamento in memoria non ancora scritti', ()
+)
+DB_POOL = registry.gauge(
+    'etjca_db_pool_connections', 'Connessioni del pool per stato (somma dei processi)', ('stato',)
+)
+DB_POOL_WAITS = registry.gauge(
+    'etjca_db_pool_waits', 'Prelievi dal pool in attesa o scaduti dall\'avvio dei processi vivi', ('esito',)
+)
+
+# Profondità delle code: stato globale letto dal database a ogni richiesta di /metrics
+JOB_QUEUE = Gauge('etjca_job_queue_jobs', 'Job per stato', ('stato',))
+EMAIL_OUTBOX = Gauge('etjca_email_outbox_messages', 'Messaggi dell\'outbox per stato', ('stato',))
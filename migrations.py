@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+ETJCA Migrations - Schema del database versionato
+File NNNN_nome.sql nella cartella migrazioni/ (migrazioni/sqlite/ per SQLite), applicati
+in ordine una sola volta; i file con CREATE INDEX CONCURRENTLY girano fuori transazione
+Uso: python migrations.py [--stato | --check]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrazioni')
+SQLITE_MIGRATIONS_DIR = os.path.join(MIGRATIONS_DIR, 'sqlite')
+
+# Lock condiviso da tutti i processi (web e worker) durante l'aggiornamento
+LOCK_KEY = 'etjca_migrazioni'
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS schema_migrazioni (
+        versione INTEGER PRIMARY KEY,
+        nome VARCHAR(255) NOT NULL,
+        checksum VARCHAR(64),
+        applicata_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        durata REAL
+    )
+'''
+
+CONCURRENT_INDEX = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE
+)
+
+# Query più frequenti dell'applicazione, con valori di esempio, per la modalità --check
+HOT_QUERIES = {
+    'lista_prospect': '''
+        SELECT id, ragione_sociale, settore, provincia, stato, fonte, dipendenti, fatturato,
+               data_inserimento, nome_hr, cognome_hr, email_hr, priorita
+        FROM prospect ORDER BY data_inserimento DESC, id DESC LIMIT 50
+    ''',
+    'lista_prospect_filtrata': '''
+        SELECT id, ragione_sociale FROM prospect
+        WHERE stato = 'nuovo' ORDER BY data_inserimento DESC, id DESC LIMIT 50
+    ''',
+    'lista_prospect_pagina': '''
+        SELECT id, ragione_sociale FROM prospect
+        WHERE (data_inserimento, id) < (CURRENT_TIMESTAMP - INTERVAL '30 days', 1000)
+        ORDER BY data_inserimento DESC, id DESC LIMIT 50
+    ''',
+    'prospect_per_id': '''
+        SELECT id, ragione_sociale, settore, provincia, nome_hr, cognome_hr, email_hr
+        FROM prospect WHERE id = ANY(ARRAY[1, 2, 3])
+    ''',
+    'chiave_import': '''
+        SELECT id FROM prospect
+        WHERE lower(ragione_sociale) = lower('ACME S.p.A.') AND COALESCE(provincia, '') = 'Udine'
+    ''',
+    'attivita_prospect': '''
+        SELECT id, tipo, data, esito FROM attivita WHERE id_prospect = 1
+    ''',
+    'timeline_prospect': '''
+        SELECT id, tipo, data, oggetto, esito FROM attivita
+        WHERE id_prospect = 1 AND data >= CURRENT_TIMESTAMP - INTERVAL '12 months'
+        ORDER BY data DESC, id DESC LIMIT 50
+    ''',
+    'solleciti_dovuti': '''
+        SELECT p.id, u.invii
+        FROM prospect p
+        CROSS JOIN LATERAL (
+            SELECT MAX(a.data) AS ultima, COUNT(*) AS invii
+            FROM attivita a
+            WHERE a.id_prospect = p.id AND a.tipo IN ('email', 'follow_up')
+        ) u
+        WHERE p.stato = 'contattato'
+          AND u.ultima < CURRENT_TIMESTAMP - INTERVAL '7 days'
+          AND NOT EXISTS (
+              SELECT 1 FROM attivita r
+              WHERE r.id_prospect = p.id
+                AND r.tipo NOT IN ('email', 'follow_up', 'email_fallita', 'follow_up_fallita')
+                AND r.data > u.ultima
+          )
+    ''',
+    'punteggio_incrementale': '''
+        SELECT id FROM prospect WHERE aggiornato_il > CURRENT_TIMESTAMP - INTERVAL '1 day'
+        UNION
+        SELECT id_prospect FROM attivita WHERE data > CURRENT_TIMESTAMP - INTERVAL '1 day'
+    ''',
+    'duplicati_modificati': '''
+        SELECT id, ragione_sociale, provincia, sito_web, email, email_hr
+        FROM prospect WHERE id > 1000000 OR aggiornato_il > CURRENT_TIMESTAMP - INTERVAL '10 minutes'
+        ORDER BY id
+    ''',
+    'outbox_pronte': '''
+        SELECT id FROM email_outbox
+        WHERE stato = 'in_attesa' AND prossimo_tentativo <= CURRENT_TIMESTAMP
+        ORDER BY prossimo_tentativo, id LIMIT 20
+    ''',
+    'outbox_job': '''
+        SELECT COUNT(*) FILTER (WHERE stato = 'inviata') FROM email_outbox WHERE job_id = 1
+    ''',
+    'outbox_prospect': '''
+        SELECT id FROM email_outbox WHERE id_prospect = 1
+    ''',
+    'tracciamento_job': '''
+        SELECT COUNT(DISTINCT o.id), COUNT(DISTINCT e.id_messaggio) FILTER (WHERE e.tipo = 'apertura')
+        FROM email_outbox o
+        LEFT JOIN email_eventi e ON e.id_messaggio = o.id
+        WHERE o.stato = 'inviata' AND o.job_id = 1
+    ''',
+    'job_in_coda': '''
+        SELECT id FROM job_queue WHERE stato = 'in_coda' ORDER BY id LIMIT 1
+    ''',
+    'ricerca_prospect': '''
+        SELECT id, ragione_sociale FROM prospect
+        WHERE ricerca @@ (to_tsquery('italian', 'rossi:*') || to_tsquery('simple', 'rossi:*')) LIMIT 1000
+    ''',
+    'ricerca_attivita': '''
+        SELECT id, oggetto FROM attivita
+        WHERE ricerca @@ (to_tsquery('italian', 'preventivo') || to_tsquery('simple', 'preventivo')) LIMIT 1000
+    ''',
+}
+
+# Su SQLite i solleciti usano il join con l'aggregato (niente LATERAL) e la ricerca le tabelle FTS5
+SQLITE_QUERIES = dict(HOT_QUERIES, ricerca_prospect='''
+    SELECT rowid, bm25(prospect_ricerca) AS rango FROM prospect_ricerca
+    WHERE prospect_ricerca MATCH '"rossi"*' ORDER BY rango LIMIT 10
+''', ricerca_attivita='''
+    SELECT rowid FROM attivita_ricerca WHERE attivita_ricerca MATCH '"preventivo"'
+''', solleciti_dovuti='''
+    SELECT p.id, u.invii
+    FROM prospect p
+    JOIN (
+        SELECT a.id_prospect, MAX(a.data) AS ultima, COUNT(*) AS invii
+        FROM attivita a
+        WHERE a.tipo IN ('email', 'follow_up')
+        GROUP BY a.id_prospect
+    ) u ON u.id_prospect = p.id
+    WHERE p.stato = 'contattato'
+      AND u.ultima < CURRENT_TIMESTAMP - INTERVAL '7 days'
+''')
+
+def split_statements(sql: str) -> List[str]:
+    """Divide un file SQL sui ';' fuori da stringhe, commenti, corpi $$ e trigger SQLite (BEGIN ... END)"""
+    statements, current = [], []
+    i, quote = 0, None
+    while i < len(sql):
+        if quote:
+            end = sql.find(quote, i)
+            end = len(sql) if end < 0 else end + len(quote)
+            current.append(sql[i:end])
+            i, quote = end, None
+            continue
+        char = sql[i]
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end < 0 else end
+            continue
+        match = re.match(r'\$\w*\$', sql[i:]) if char == '$' else None
+        if match:
+            quote = match.group(0)
+            current.append(quote)
+            i += len(quote)
+            continue
+        if char == "'":
+            quote = "'"
+            current.append(char)
+            i += 1
+            continue
+        if char == ';' and not _open_trigger(''.join(current)):
+            statements.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append(''.join(current).strip())
+    return [statement for statement in statements if statement]
+
+def _open_trigger(statement: str) -> bool:
+    """CREATE TRIGGER SQLite con il corpo BEGIN ... END non ancora chiuso"""
+    statement = statement.strip()
+    return bool(
+        re.match(r'CREATE\s+(TEMP\w*\s+)?TRIGGER\b', statement, re.IGNORECASE)
+        and re.search(r'\bBEGIN\b', statement, re.IGNORECASE)
+        and not re.search(r'\bEND$', statement, re.IGNORECASE)
+    )
+
+def sqlite_scans(rows: List[tuple], query: str) -> List[Dict]:
+    """Scansioni complete nel piano EXPLAIN QUERY PLAN di SQLite (SCAN senza indice)"""
+    # Il piano riporta l'alias: si risale alla tabella dalle clausole FROM/JOIN
+    tables = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE):
+        tables[table] = table
+        tables.setdefault(alias, table)
+    found = []
+    for row in rows:
+        match = re.match(r'SCAN (\w+)$', row[-1])
+        if match:
+            found.append({'tabella': tables.get(match.group(1), match.group(1)), 'righe_stimate': None})
+    return found
+
+@dataclass
+class Migration:
+    """File di migrazione NNNN_nome.sql"""
+    versione: int
+    nome: str
+    sql: str
+    
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.sql.encode('utf-8')).hexdigest()
+    
+    @property
+    def statements(self) -> List[str]:
+        return split_statements(self.sql)
+    
+    @property
+    def concorrente(self) -> bool:
+        """CREATE INDEX CONCURRENTLY non può girare in una transazione"""
+        return bool(CONCURRENT_INDEX.search(self.sql))
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for filename in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        match = re.fullmatch(r'(\d+)_(\w+)\.sql', filename)
+        if not match:
+            continue
+        with open(os.path.join(directory, filename), encoding='utf-8') as handle:
+            migrations.append(Migration(int(match.group(1)), match.group(2), handle.read()))
+    
+    versions = [m.versione for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise Exception(f"Versioni di migrazione duplicate in {directory}")
+    return migrations
+
+def seq_scans(plan: Dict) -> List[Dict]:
+    """Nodi Seq Scan del piano EXPLAIN (FORMAT JSON)"""
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append({'tabella': plan.get('Relation Name'), 'righe_stimate': plan.get('Plan Rows')})
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+class Migrator:
+    """Applica le migrazioni mancanti e controlla i piani delle query principali"""
+    
+    def __init__(self, db_manager, directory: Optional[str] = None):
+        self.db_manager = db_manager
+        self.sqlite = db_manager.dialect == 'sqlite'
+        self.directory = directory or (SQLITE_MIGRATIONS_DIR if self.sqlite else MIGRATIONS_DIR)
+    
+    def applied(self, cursor) -> Dict[int, str]:
+        cursor.execute(SCHEMA)
+        cursor.execute('SELECT versione, checksum FROM schema_migrazioni')
+        return dict(cursor.fetchall())
+    
+    def migrate(self) -> List[int]:
+        """Applica in ordine le migrazioni non ancora registrate; restituisce le versioni applicate"""
+        migrations = load_migrations(self.directory)
+        # Connessione dedicata in autocommit: CONCURRENTLY e lock di sessione
+        # (su SQLite il lock è la transazione IMMEDIATE che contiene tutto l'aggiornamento)
+        conn = self.db_manager.open_dedicated_connection()
+        conn.autocommit = not self.sqlite
+        try:
+            cursor = conn.cursor()
+            self._lock(cursor)
+            applied = self.applied(cursor)
+            done = []
+            for migration in migrations:
+                checksum = applied.get(migration.versione)
+                if checksum is not None:
+                    if checksum != migration.checksum:
+                        logging.warning(f"⚠️ Migrazione {migration.versione} modificata dopo l'applicazione")
+                    continue
+                self._apply(conn, cursor, migration)
+                done.append(migration.versione)
+            if self.sqlite:
+                conn.commit()
+            return done
+        finally:
+            conn.close()
+    
+    def _lock(self, cursor, poll: float = 1.0):
+        if self.sqlite:
+            # Un solo scrittore alla volta: gli altri processi attendono (busy_timeout) e poi trovano tutto applicato
+            cursor.execute('BEGIN IMMEDIATE')
+            return
+        # Attesa senza transazione aperta: un lock bloccante terrebbe uno snapshot
+        # e fermerebbe il CREATE INDEX CONCURRENTLY dell'altro processo
+        while True:
+            cursor.execute('SELECT pg_try_advisory_lock(hashtext(%s))', (LOCK_KEY,))
+            if cursor.fetchone()[0]:
+                return
+            time.sleep(poll)
+    
+    def _apply(self, conn, cursor, migration: Migration):
+        start = time.monotonic()
+        logging.info(f"🗄️ Migrazione {migration.versione:04d}_{migration.nome}...")
+        if migration.concorrente:
+            # Istruzione per istruzione: un errore lascia applicate solo quelle precedenti,
+            # tutte idempotenti, e la migrazione viene ripresa al prossimo avvio
+            for statement in migration.statements:
+                self._drop_invalid_index(cursor, statement)
+                cursor.execute(statement)
+            self._record(cursor, migration, time.monotonic() - start)
+        elif self.sqlite:
+            # DDL transazionale dentro il lock: un errore annulla l'intero aggiornamento
+            for statement in migration.statements:
+                cursor.execute(statement)
+            self._record(cursor, migration, time.monotonic() - start)
+        else:
+            conn.autocommit = False
+            try:
+                for statement in migration.statements:
+                    cursor.execute(statement)
+                self._record(cursor, migration, time.monotonic() - start)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+        logging.info(f"✅ Migrazione {migration.versione:04d} applicata in {time.monotonic() - start:.2f}s")
+    
+    def _drop_invalid_index(self, cursor, statement: str):
+        """Un CREATE INDEX CONCURRENTLY interrotto lascia un indice INVALID che IF NOT EXISTS salterebbe"""
+        match = CONCURRENT_INDEX.search(statement)
+        if not match:
+            return
+        cursor.execute('''
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND NOT i.indisvalid
+        ''', (match.group(1),))
+        if cursor.fetchone():
+            logging.warning(f"Indice {match.group(1)} non valido: ricostruzione")
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}')
+    
+    def _record(self, cursor, migration: Migration, durata: float):
+        cursor.execute('''
+            INSERT INTO schema_migrazioni (versione, nome, checksum, durata)
+            VALUES (%s, %s, %s, %s)
+        ''', (migration.versione, migration.nome, migration.checksum, round(durata, 3)))
+    
+    def status(self) -> List[Dict]:
+        """Migrazioni presenti nella cartella con data di applicazione"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SCHEMA)
+            cursor.execute('SELECT versione, applicata_il, checksum FROM schema_migrazioni')
+            applied = {row[0]: row[1:] for row in cursor.fetchall()}
+        return [
+            {
+                'versione': m.versione,
+                'nome': m.nome,
+                'applicata_il': applied[m.versione][0].isoformat() if m.versione in applied else None,
+                'modificata': m.versione in applied and applied[m.versione][1] != m.checksum,
+                'concorrente': m.concorrente,
+            }
+            for m in load_migrations(self.directory)
+        ]
+    
+    def check(self, queries: Optional[Dict[str, str]] = None, min_rows: int = 1000) -> List[Dict]:
+        """EXPLAIN delle query principali: segnala le scansioni sequenziali su tabelle non piccole"""
+        results = []
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            sizes = self._table_sizes(cursor)
+            for name, query in (queries or (SQLITE_QUERIES if self.sqlite else HOT_QUERIES)).items():
+                try:
+                    costo, scans = self._explain(cursor, query)
+                except Exception as e:
+                    conn.rollback()
+                    results.append({'query': name, 'errore': str(e).strip()})
+                    continue
+                scans = [
+                    dict(scan, righe_tabella=sizes.get(scan['tabella'], 0))
+                    for scan in scans
+                    if sizes.get(scan['tabella'], 0) >= min_rows
+                ]
+                results.append({'query': name, 'costo': costo, 'seq_scan': scans})
+        return results
+    
+    def _table_sizes(self, cursor) -> Dict[str, int]:
+        if not self.sqlite:
+            cursor.execute('''
+                SELECT relname, reltuples::bigint FROM pg_class
+                WHERE relkind IN ('r', 'p') AND relnamespace = 'public'::regnamespace
+            ''')
+            return dict(cursor.fetchall())
+        # SQLite non tiene stime delle righe: conteggio esatto (database locali)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%%'")
+        sizes = {}
+        for (table,) in cursor.fetchall():
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            sizes[table] = cursor.fetchone()[0]
+        return sizes
+    
+    def _explain(self, cursor, query: str):
+        """Costo stimato (solo PostgreSQL) e scansioni sequenziali del piano"""
+        if self.sqlite:
+            cursor.execute(f'EXPLAIN QUERY PLAN {query}')
+            return None, sqlite_scans(cursor.fetchall(), query)
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {query}')
+        plan = cursor.fetchone()[0]
+        plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+        return plan.get('Total Cost'), seq_scans(plan)
+
+def open_backend(url: Optional[str] = None):
+    """Backend del database senza importare l'applicazione, che all'avvio applica le migrazioni"""
+    from storage import create_backend
+    backend = create_backend(url or os.getenv('DATABASE_URL'))
+    if backend is None:
+        raise Exception("Database non configurato (DATABASE_URL mancante)")
+    return backend
+
+def backend_manager(backend) -> SimpleNamespace:
+    """L'interfaccia di DatabaseManager usata da Migrator, su un backend"""
+    @contextmanager
+    def connection():
+        conn = backend.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            backend.putconn(conn)
+    
+    return SimpleNamespace(dialect=backend.dialect, open_dedicated_connection=backend.dedicated,
+                           connection=connection)
+
+def migrate_database(url: Optional[str] = None) -> List[int]:
+    """Migrazioni con una connessione propria, senza importare l'applicazione
+    (gunicorn.conf.py: una volta sola nel master prima di avviare i worker)"""
+    backend = open_backend(url)
+    try:
+        return Migrator(backend_manager(backend)).migrate()
+    finally:
+        backend.close()
+
+def main(argv: List[str]) -> int:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        backend = open_backend()
+    except Exception as e:
+        print(e)
+        return 1
+    try:
+        return run(Migrator(backend_manager(backend)), argv)
+    finally:
+        backend.close()
+
+def run(migrator: Migrator, argv: List[str]) -> int:
+    """--stato e --check leggono soltanto: le versioni mancanti restano da applicare"""
+    if '--stato' in argv:
+        for m in migrator.status():
+            stato = m['applicata_il'] or 'da applicare'
+            print(f"{m['versione']:04d}_{m['nome']:<30} {stato}{'  (modificata)' if m['modificata'] else ''}")
+        return 0
+    
+    if '--check' in argv:
+        problemi = 0
+        for result in migrator.check():
+            if result.get('errore'):
+                print(f"❌ {result['query']}: {result['errore']}")
+                problemi += 1
+            elif result['seq_scan']:
+                for scan in result['seq_scan']:
+                    print(f"⚠️ {result['query']}: Seq Scan su {scan['tabella']} ({scan['righe_tabella']} righe)")
+                problemi += 1
+            else:
+                costo = f": costo {result['costo']}" if result['costo'] is not None else ''
+                print(f"✅ {result['query']}{costo}")
+        return 1 if problemi else 0
+    
+    print(f"Migrazioni applicate: {migrator.migrate() or 'nessuna'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,22 @@
+-- Coda lavori del processo worker
+
+CREATE TABLE IF NOT EXISTS job_queue (
+    id SERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    stato VARCHAR(20) DEFAULT 'in_coda',
+    payload JSONB DEFAULT '{}',
+    risultato JSONB,
+    totale INTEGER DEFAULT 0,
+    processati INTEGER DEFAULT 0,
+    inviate INTEGER DEFAULT 0,
+    fallite INTEGER DEFAULT 0,
+    tentativi INTEGER DEFAULT 0,
+    errore TEXT,
+    worker VARCHAR(100),
+    creato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    avviato_il TIMESTAMP,
+    aggiornato_il TIMESTAMP,
+    completato_il TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_stato ON job_queue(stato, id);
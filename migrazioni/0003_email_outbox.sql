@@ -0,0 +1,25 @@
+-- Outbox transazionale dei messaggi da inviare
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id SERIAL PRIMARY KEY,
+    chiave VARCHAR(100) UNIQUE,
+    id_prospect INTEGER REFERENCES prospect(id),
+    job_id INTEGER,
+    destinatario VARCHAR(255) NOT NULL,
+    oggetto VARCHAR(255),
+    corpo TEXT,
+    tipo VARCHAR(50) DEFAULT 'email',
+    stato VARCHAR(20) DEFAULT 'in_attesa',
+    tentativi INTEGER DEFAULT 0,
+    prossimo_tentativo TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ultimo_errore TEXT,
+    bloccato_da VARCHAR(100),
+    bloccato_il TIMESTAMP,
+    creato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    inviato_il TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_pronte
+ON email_outbox(prossimo_tentativo, id) WHERE stato = 'in_attesa';
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_job ON email_outbox(job_id, stato);
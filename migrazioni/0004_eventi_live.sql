@@ -0,0 +1,50 @@
+-- Notifiche per la dashboard in tempo reale (canale etjca_eventi, vedi live_events.py)
+-- Trigger per istruzione (non per riga): un import massivo genera una sola notifica
+
+CREATE OR REPLACE FUNCTION etjca_notifica_modifiche() RETURNS trigger AS $$
+DECLARE
+    righe INTEGER;
+    descrizione TEXT;
+BEGIN
+    SELECT COUNT(*) INTO righe FROM modificate;
+    IF righe = 0 THEN
+        RETURN NULL;
+    END IF;
+    IF righe = 1 AND TG_TABLE_NAME = 'prospect' THEN
+        SELECT ragione_sociale INTO descrizione FROM modificate;
+    ELSIF righe = 1 THEN
+        SELECT oggetto INTO descrizione FROM modificate;
+    END IF;
+    PERFORM pg_notify('etjca_eventi', json_build_object(
+        'tabella', TG_TABLE_NAME,
+        'operazione', TG_OP,
+        'righe', righe,
+        'descrizione', left(descrizione, 200)
+    )::text);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_prospect_notifica_insert ON prospect;
+CREATE TRIGGER trg_prospect_notifica_insert
+AFTER INSERT ON prospect
+REFERENCING NEW TABLE AS modificate
+FOR EACH STATEMENT EXECUTE PROCEDURE etjca_notifica_modifiche();
+
+DROP TRIGGER IF EXISTS trg_prospect_notifica_update ON prospect;
+CREATE TRIGGER trg_prospect_notifica_update
+AFTER UPDATE ON prospect
+REFERENCING NEW TABLE AS modificate
+FOR EACH STATEMENT EXECUTE PROCEDURE etjca_notifica_modifiche();
+
+DROP TRIGGER IF EXISTS trg_attivita_notifica_insert ON attivita;
+CREATE TRIGGER trg_attivita_notifica_insert
+AFTER INSERT ON attivita
+REFERENCING NEW TABLE AS modificate
+FOR EACH STATEMENT EXECUTE PROCEDURE etjca_notifica_modifiche();
+
+DROP TRIGGER IF EXISTS trg_attivita_notifica_update ON attivita;
+CREATE TRIGGER trg_attivita_notifica_update
+AFTER UPDATE ON attivita
+REFERENCING NEW TABLE AS modificate
+FOR EACH STATEMENT EXECUTE PROCEDURE etjca_notifica_modifiche();
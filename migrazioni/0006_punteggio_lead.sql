@@ -0,0 +1,29 @@
+-- Punteggio lead con ricalcolo incrementale (scoring.py)
+
+ALTER TABLE prospect ADD COLUMN IF NOT EXISTS punteggio SMALLINT;
+ALTER TABLE prospect ADD COLUMN IF NOT EXISTS aggiornato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS punteggio_esecuzioni (
+    id SERIAL PRIMARY KEY,
+    completo BOOLEAN,
+    avviato_il TIMESTAMP,
+    valutati INTEGER,
+    aggiornati INTEGER,
+    durata REAL
+);
+
+-- aggiornato_il cambia solo quando cambia un dato usato dal punteggio
+CREATE OR REPLACE FUNCTION etjca_prospect_aggiornato() RETURNS trigger AS $$
+BEGIN
+    NEW.aggiornato_il := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_prospect_aggiornato ON prospect;
+CREATE TRIGGER trg_prospect_aggiornato
+BEFORE UPDATE OF settore, fatturato, dipendenti, provincia, stato ON prospect
+FOR EACH ROW
+WHEN ((OLD.settore, OLD.fatturato, OLD.dipendenti, OLD.provincia, OLD.stato)
+      IS DISTINCT FROM (NEW.settore, NEW.fatturato, NEW.dipendenti, NEW.provincia, NEW.stato))
+EXECUTE PROCEDURE etjca_prospect_aggiornato();
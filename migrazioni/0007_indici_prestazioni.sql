@@ -0,0 +1,12 @@
+-- Indici costruiti senza bloccare le scritture (CONCURRENTLY: migrazione fuori transazione)
+
+-- Chiave esterna attivita -> prospect e ricerche per tipo/data (solleciti): index-only scan
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_attivita_prospect_tipo_data ON attivita(id_prospect, tipo, data);
+
+-- Attività recenti per il ricalcolo incrementale del punteggio
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_attivita_data ON attivita(data);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_prospect_aggiornato ON prospect(aggiornato_il);
+
+-- Chiavi esterne verso prospect: unione e cancellazione dei duplicati
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_email_outbox_prospect ON email_outbox(id_prospect);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_duplicati_cluster_prospect ON duplicati_cluster(id_prospect);
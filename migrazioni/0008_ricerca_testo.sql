@@ -0,0 +1,57 @@
+-- Ricerca full-text (configurazione italiana) su prospect e note delle attività (search.py)
+-- Colonne tsvector mantenute da trigger, indici GIN
+
+ALTER TABLE prospect ADD COLUMN IF NOT EXISTS ricerca tsvector;
+ALTER TABLE attivita ADD COLUMN IF NOT EXISTS ricerca tsvector;
+
+-- Lessemi italiani (radici: "formazioni" trova "formazione") e le parole intere della configurazione
+-- 'simple': il prefisso digitato nella ricerca ("preventiv") non è sempre l'inizio della radice ("prevent")
+-- Pesi: ragione sociale (A) prima dell'indirizzo (C) e delle note (D)
+CREATE OR REPLACE FUNCTION etjca_ricerca_testo(testo TEXT, peso "char")
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('italian', coalesce(testo, '')) || to_tsvector('simple', coalesce(testo, '')), peso)
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION etjca_prospect_ricerca(ragione_sociale TEXT, indirizzo TEXT, note TEXT)
+RETURNS tsvector AS $$
+    SELECT etjca_ricerca_testo(ragione_sociale, 'A')
+        || etjca_ricerca_testo(indirizzo, 'C')
+        || etjca_ricerca_testo(note, 'D')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION etjca_attivita_ricerca(oggetto TEXT, descrizione TEXT)
+RETURNS tsvector AS $$
+    SELECT etjca_ricerca_testo(oggetto, 'B') || etjca_ricerca_testo(descrizione, 'D')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION etjca_prospect_ricerca_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.ricerca := etjca_prospect_ricerca(NEW.ragione_sociale, NEW.indirizzo, NEW.note);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION etjca_attivita_ricerca_trigger() RETURNS trigger AS $$
+BEGIN
+    NEW.ricerca := etjca_attivita_ricerca(NEW.oggetto, NEW.descrizione);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_prospect_ricerca ON prospect;
+CREATE TRIGGER trg_prospect_ricerca
+BEFORE INSERT OR UPDATE OF ragione_sociale, indirizzo, note ON prospect
+FOR EACH ROW EXECUTE PROCEDURE etjca_prospect_ricerca_trigger();
+
+DROP TRIGGER IF EXISTS trg_attivita_ricerca ON attivita;
+CREATE TRIGGER trg_attivita_ricerca
+BEFORE INSERT OR UPDATE OF oggetto, descrizione ON attivita
+FOR EACH ROW EXECUTE PROCEDURE etjca_attivita_ricerca_trigger();
+
+-- Righe esistenti: aggiornate una volta, senza passare dai trigger delle notifiche per riga
+UPDATE prospect SET ricerca = etjca_prospect_ricerca(ragione_sociale, indirizzo, note);
+UPDATE attivita SET ricerca = etjca_attivita_ricerca(oggetto, descrizione);
+
+-- Indici creati dopo il riempimento: una costruzione sola invece di un aggiornamento per riga
+CREATE INDEX IF NOT EXISTS idx_prospect_ricerca ON prospect USING GIN (ricerca);
+CREATE INDEX IF NOT EXISTS idx_attivita_ricerca ON attivita USING GIN (ricerca);
@@ -0,0 +1,91 @@
+-- attivita partizionata per mese su data (activity_log.py): inserimenti sulla sola partizione
+-- del mese corrente, timeline e ricalcoli recenti che leggono solo i mesi richiesti,
+-- mesi vecchi staccati e archiviati in file compressi invece di cancellare righe
+-- La tabella esistente viene copiata in una sola transazione: le scritture su attivita attendono la fine
+
+-- Partizioni mensili da un mese all'altro (compresi), create se mancano; le righe del mese
+-- finite nella partizione di default (mese non ancora creato) vengono spostate nella nuova partizione
+CREATE OR REPLACE FUNCTION etjca_partizioni_attivita(dal DATE, al DATE) RETURNS INTEGER AS $$
+DECLARE
+    inizio DATE := date_trunc('month', dal)::date;
+    fine DATE;
+    nome TEXT;
+    nuove INTEGER := 0;
+BEGIN
+    WHILE inizio <= al LOOP
+        fine := (inizio + INTERVAL '1 month')::date;
+        nome := 'attivita_' || to_char(inizio, 'YYYY_MM');
+        IF to_regclass(nome) IS NULL THEN
+            -- ATTACH invece di PARTITION OF: lock leggero sulla tabella madre, gli inserimenti continuano
+            EXECUTE format('CREATE TABLE %I (LIKE attivita INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', nome);
+            EXECUTE format(
+                'WITH spostate AS (DELETE FROM attivita_default WHERE data >= %L AND data < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM spostate', inizio, fine, nome
+            );
+            EXECUTE format('ALTER TABLE attivita ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', nome, inizio, fine);
+            nuove := nuove + 1;
+        END IF;
+        inizio := fine;
+    END LOOP;
+    RETURN nuove;
+END
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE attivita RENAME TO attivita_legacy;
+ALTER INDEX attivita_pkey RENAME TO attivita_legacy_pkey;
+ALTER SEQUENCE attivita_id_seq OWNED BY NONE;
+
+-- La chiave primaria di una tabella partizionata deve contenere la colonna di partizione
+CREATE TABLE attivita (
+    id INTEGER NOT NULL DEFAULT nextval('attivita_id_seq'),
+    id_prospect INTEGER REFERENCES prospect(id),
+    tipo VARCHAR(50),
+    data TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    oggetto VARCHAR(255),
+    descrizione TEXT,
+    esito VARCHAR(100),
+    ricerca tsvector,
+    PRIMARY KEY (id, data)
+) PARTITION BY RANGE (data);
+
+ALTER SEQUENCE attivita_id_seq OWNED BY attivita.id;
+
+-- Righe fuori dai mesi creati (date future lontane o mesi già archiviati): mai un inserimento rifiutato
+CREATE TABLE attivita_default PARTITION OF attivita DEFAULT;
+
+-- Dal mese più vecchio a tre mesi avanti; poi activity_log.py ogni notte
+SELECT etjca_partizioni_attivita(
+    (SELECT COALESCE(MIN(data), CURRENT_TIMESTAMP) FROM attivita_legacy)::date,
+    (CURRENT_TIMESTAMP + INTERVAL '3 months')::date
+);
+
+-- Copia prima di indici e trigger: costruzione degli indici in blocco, una notifica live in meno
+INSERT INTO attivita (id, id_prospect, tipo, data, oggetto, descrizione, esito, ricerca)
+SELECT id, id_prospect, tipo, COALESCE(data, CURRENT_TIMESTAMP), oggetto, descrizione, esito, ricerca
+FROM attivita_legacy;
+
+DROP TABLE attivita_legacy;
+
+-- Indici di 0007 e 0008, ora partizionati (uno per partizione, creato anche sulle nuove)
+CREATE INDEX IF NOT EXISTS idx_attivita_prospect_tipo_data ON attivita(id_prospect, tipo, data);
+CREATE INDEX IF NOT EXISTS idx_attivita_data ON attivita(data);
+CREATE INDEX IF NOT EXISTS idx_attivita_ricerca ON attivita USING GIN (ricerca);
+-- Timeline del prospect dalla più recente (paginazione su data, id)
+CREATE INDEX IF NOT EXISTS idx_attivita_prospect_data ON attivita(id_prospect, data, id);
+
+-- Trigger di 0004 (notifiche live) e 0008 (ricerca): sulla tabella madre valgono per tutte le partizioni
+CREATE TRIGGER trg_attivita_notifica_insert
+AFTER INSERT ON attivita
+REFERENCING NEW TABLE AS modificate
+FOR EACH STATEMENT EXECUTE PROCEDURE etjca_notifica_modifiche();
+
+CREATE TRIGGER trg_attivita_notifica_update
+AFTER UPDATE ON attivita
+REFERENCING NEW TABLE AS modificate
+FOR EACH STATEMENT EXECUTE PROCEDURE etjca_notifica_modifiche();
+
+CREATE TRIGGER trg_attivita_ricerca
+BEFORE INSERT OR UPDATE OF oggetto, descrizione ON attivita
+FOR EACH ROW EXECUTE PROCEDURE etjca_attivita_ricerca_trigger();
+
+ANALYZE attivita;
@@ -0,0 +1,18 @@
+-- Aperture (pixel) e click (link di reindirizzamento) delle email, scritti a blocchi da tracking.py
+-- Senza chiave esterna su prospect: un evento arrivato dopo l'unione dei duplicati non blocca
+-- l'intero blocco di righe (l'unione sposta anche gli eventi sul prospect principale)
+
+CREATE TABLE IF NOT EXISTS email_eventi (
+    id BIGSERIAL PRIMARY KEY,
+    id_prospect INTEGER,
+    -- email_outbox.id; NULL per gli invii diretti di send_email
+    id_messaggio INTEGER,
+    tipo VARCHAR(20) NOT NULL,
+    url TEXT,
+    user_agent VARCHAR(255),
+    registrato_il TIMESTAMP NOT NULL
+);
+
+-- Aperture e click dei messaggi di una campagna (join con email_outbox.job_id)
+CREATE INDEX IF NOT EXISTS idx_email_eventi_messaggio ON email_eventi(id_messaggio, tipo);
+CREATE INDEX IF NOT EXISTS idx_email_eventi_prospect ON email_eventi(id_prospect);
@@ -0,0 +1,13 @@
+-- aggiornato_il cambia anche con i dati dell'indice duplicati (dedup.py): nome, sito ed email
+-- modificati da upsert, unioni e modifiche manuali vengono reindicizzati dagli altri processi
+
+DROP TRIGGER IF EXISTS trg_prospect_aggiornato ON prospect;
+CREATE TRIGGER trg_prospect_aggiornato
+BEFORE UPDATE OF settore, fatturato, dipendenti, provincia, stato,
+                 ragione_sociale, sito_web, email, email_hr ON prospect
+FOR EACH ROW
+WHEN ((OLD.settore, OLD.fatturato, OLD.dipendenti, OLD.provincia, OLD.stato,
+       OLD.ragione_sociale, OLD.sito_web, OLD.email, OLD.email_hr)
+      IS DISTINCT FROM (NEW.settore, NEW.fatturato, NEW.dipendenti, NEW.provincia, NEW.stato,
+                        NEW.ragione_sociale, NEW.sito_web, NEW.email, NEW.email_hr))
+EXECUTE PROCEDURE etjca_prospect_aggiornato();
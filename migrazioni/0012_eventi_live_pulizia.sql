@@ -0,0 +1,2 @@
+-- Solo SQLite (migrazioni/sqlite/0012): su PostgreSQL le notifiche live passano da NOTIFY,
+-- non da una tabella da ripulire. File vuoto per tenere allineate le versioni dei due database
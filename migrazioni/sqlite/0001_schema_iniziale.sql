@@ -0,0 +1,46 @@
+-- Tabelle principali del CRM (SQLite: sviluppo locale, test e benchmark)
+-- Le colonne del punteggio (0006 su PostgreSQL) sono già qui: ALTER TABLE non accetta default non costanti
+
+CREATE TABLE IF NOT EXISTS prospect (
+    id INTEGER PRIMARY KEY,
+    ragione_sociale VARCHAR(255) NOT NULL,
+    settore VARCHAR(100),
+    fatturato BIGINT,
+    dipendenti INTEGER,
+    indirizzo TEXT,
+    provincia VARCHAR(50),
+    telefono VARCHAR(50),
+    email VARCHAR(255),
+    sito_web VARCHAR(255),
+    nome_hr VARCHAR(100),
+    cognome_hr VARCHAR(100),
+    email_hr VARCHAR(255),
+    linkedin_hr VARCHAR(255),
+    fonte VARCHAR(50),
+    data_inserimento TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+    stato VARCHAR(50) DEFAULT 'nuovo',
+    priorita VARCHAR(20) DEFAULT 'media',
+    note TEXT,
+    punteggio SMALLINT,
+    aggiornato_il TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TABLE IF NOT EXISTS attivita (
+    id INTEGER PRIMARY KEY,
+    id_prospect INTEGER REFERENCES prospect(id),
+    tipo VARCHAR(50),
+    data TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+    oggetto VARCHAR(255),
+    descrizione TEXT,
+    esito VARCHAR(100)
+);
+
+-- Lista prospect dal più recente, anche filtrata per colonna
+CREATE INDEX IF NOT EXISTS idx_prospect_recenti ON prospect(data_inserimento DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_prospect_stato_recenti ON prospect(stato, data_inserimento DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_prospect_provincia_recenti ON prospect(provincia, data_inserimento DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_prospect_settore_recenti ON prospect(settore, data_inserimento DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_prospect_priorita_recenti ON prospect(priorita, data_inserimento DESC, id DESC);
+
+-- Chiave dell'import (ragione sociale senza maiuscole + provincia)
+CREATE INDEX IF NOT EXISTS idx_prospect_ragione_lower ON prospect(lower(ragione_sociale));
@@ -0,0 +1,22 @@
+-- Coda lavori del processo worker (payload e risultato come testo JSON)
+
+CREATE TABLE IF NOT EXISTS job_queue (
+    id INTEGER PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    stato VARCHAR(20) DEFAULT 'in_coda',
+    payload TEXT DEFAULT '{}',
+    risultato TEXT,
+    totale INTEGER DEFAULT 0,
+    processati INTEGER DEFAULT 0,
+    inviate INTEGER DEFAULT 0,
+    fallite INTEGER DEFAULT 0,
+    tentativi INTEGER DEFAULT 0,
+    errore TEXT,
+    worker VARCHAR(100),
+    creato_il TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+    avviato_il TIMESTAMP,
+    aggiornato_il TIMESTAMP,
+    completato_il TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_stato ON job_queue(stato, id);
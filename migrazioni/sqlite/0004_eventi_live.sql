@@ -0,0 +1,34 @@
+-- Eventi per la dashboard in tempo reale: SQLite non ha NOTIFY, i trigger scrivono
+-- in eventi_live e LiveEventHub legge le righe nuove a intervalli (vedi live_events.py)
+
+CREATE TABLE IF NOT EXISTS eventi_live (
+    id INTEGER PRIMARY KEY,
+    tabella VARCHAR(50),
+    operazione VARCHAR(10),
+    descrizione TEXT,
+    creato_il TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_prospect_notifica_insert AFTER INSERT ON prospect
+BEGIN
+    INSERT INTO eventi_live (tabella, operazione, descrizione)
+    VALUES ('prospect', 'INSERT', substr(NEW.ragione_sociale, 1, 200));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_prospect_notifica_update AFTER UPDATE ON prospect
+BEGIN
+    INSERT INTO eventi_live (tabella, operazione, descrizione)
+    VALUES ('prospect', 'UPDATE', substr(NEW.ragione_sociale, 1, 200));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_attivita_notifica_insert AFTER INSERT ON attivita
+BEGIN
+    INSERT INTO eventi_live (tabella, operazione, descrizione)
+    VALUES ('attivita', 'INSERT', substr(NEW.oggetto, 1, 200));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_attivita_notifica_update AFTER UPDATE ON attivita
+BEGIN
+    INSERT INTO eventi_live (tabella, operazione, descrizione)
+    VALUES ('attivita', 'UPDATE', substr(NEW.oggetto, 1, 200));
+END;
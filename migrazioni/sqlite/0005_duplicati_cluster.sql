@@ -0,0 +1,10 @@
+-- Cluster di possibili duplicati da rivedere (job cluster_duplicati)
+
+CREATE TABLE IF NOT EXISTS duplicati_cluster (
+    cluster INTEGER NOT NULL,
+    id_prospect INTEGER NOT NULL REFERENCES prospect(id) ON DELETE CASCADE,
+    punteggio REAL,
+    motivo VARCHAR(20),
+    creato_il TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+    PRIMARY KEY (cluster, id_prospect)
+);
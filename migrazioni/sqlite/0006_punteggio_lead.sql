@@ -0,0 +1,20 @@
+-- Punteggio lead con ricalcolo incrementale (scoring.py); colonne di prospect in 0001
+
+CREATE TABLE IF NOT EXISTS punteggio_esecuzioni (
+    id INTEGER PRIMARY KEY,
+    completo BOOLEAN,
+    avviato_il TIMESTAMP,
+    valutati INTEGER,
+    aggiornati INTEGER,
+    durata REAL
+);
+
+-- aggiornato_il cambia solo quando cambia un dato usato dal punteggio
+CREATE TRIGGER IF NOT EXISTS trg_prospect_aggiornato
+AFTER UPDATE OF settore, fatturato, dipendenti, provincia, stato ON prospect
+FOR EACH ROW
+WHEN (OLD.settore, OLD.fatturato, OLD.dipendenti, OLD.provincia, OLD.stato)
+     IS NOT (NEW.settore, NEW.fatturato, NEW.dipendenti, NEW.provincia, NEW.stato)
+BEGIN
+    UPDATE prospect SET aggiornato_il = datetime('now', 'localtime') WHERE id = NEW.id;
+END;
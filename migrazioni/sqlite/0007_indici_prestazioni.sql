@@ -0,0 +1,12 @@
+-- Indici di 0007 su PostgreSQL (qui senza CONCURRENTLY: SQLite ha un solo scrittore)
+
+-- Chiave esterna attivita -> prospect e ricerche per tipo/data (solleciti): indice coprente
+CREATE INDEX IF NOT EXISTS idx_attivita_prospect_tipo_data ON attivita(id_prospect, tipo, data);
+
+-- Attività recenti per il ricalcolo incrementale del punteggio
+CREATE INDEX IF NOT EXISTS idx_attivita_data ON attivita(data);
+CREATE INDEX IF NOT EXISTS idx_prospect_aggiornato ON prospect(aggiornato_il);
+
+-- Chiavi esterne verso prospect: unione e cancellazione dei duplicati
+CREATE INDEX IF NOT EXISTS idx_email_outbox_prospect ON email_outbox(id_prospect);
+CREATE INDEX IF NOT EXISTS idx_duplicati_cluster_prospect ON duplicati_cluster(id_prospect);
@@ -0,0 +1,56 @@
+-- Ricerca full-text di 0008 con FTS5: tabelle a contenuto esterno mantenute da trigger
+-- (tokenizer unicode61 senza accenti; il rango è bm25 con gli stessi pesi relativi di PostgreSQL)
+
+CREATE VIRTUAL TABLE IF NOT EXISTS prospect_ricerca USING fts5(
+    ragione_sociale, indirizzo, note,
+    content='prospect', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS attivita_ricerca USING fts5(
+    oggetto, descrizione,
+    content='attivita', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_prospect_ricerca_insert AFTER INSERT ON prospect
+BEGIN
+    INSERT INTO prospect_ricerca (rowid, ragione_sociale, indirizzo, note)
+    VALUES (NEW.id, NEW.ragione_sociale, NEW.indirizzo, NEW.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_prospect_ricerca_update AFTER UPDATE OF ragione_sociale, indirizzo, note ON prospect
+BEGIN
+    INSERT INTO prospect_ricerca (prospect_ricerca, rowid, ragione_sociale, indirizzo, note)
+    VALUES ('delete', OLD.id, OLD.ragione_sociale, OLD.indirizzo, OLD.note);
+    INSERT INTO prospect_ricerca (rowid, ragione_sociale, indirizzo, note)
+    VALUES (NEW.id, NEW.ragione_sociale, NEW.indirizzo, NEW.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_prospect_ricerca_delete AFTER DELETE ON prospect
+BEGIN
+    INSERT INTO prospect_ricerca (prospect_ricerca, rowid, ragione_sociale, indirizzo, note)
+    VALUES ('delete', OLD.id, OLD.ragione_sociale, OLD.indirizzo, OLD.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_attivita_ricerca_insert AFTER INSERT ON attivita
+BEGIN
+    INSERT INTO attivita_ricerca (rowid, oggetto, descrizione)
+    VALUES (NEW.id, NEW.oggetto, NEW.descrizione);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_attivita_ricerca_update AFTER UPDATE OF oggetto, descrizione ON attivita
+BEGIN
+    INSERT INTO attivita_ricerca (attivita_ricerca, rowid, oggetto, descrizione)
+    VALUES ('delete', OLD.id, OLD.oggetto, OLD.descrizione);
+    INSERT INTO attivita_ricerca (rowid, oggetto, descrizione)
+    VALUES (NEW.id, NEW.oggetto, NEW.descrizione);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_attivita_ricerca_delete AFTER DELETE ON attivita
+BEGIN
+    INSERT INTO attivita_ricerca (attivita_ricerca, rowid, oggetto, descrizione)
+    VALUES ('delete', OLD.id, OLD.oggetto, OLD.descrizione);
+END;
+
+-- Righe esistenti
+INSERT INTO prospect_ricerca (prospect_ricerca) VALUES ('rebuild');
+INSERT INTO attivita_ricerca (attivita_ricerca) VALUES ('rebuild');
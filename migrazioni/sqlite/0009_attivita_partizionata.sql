@@ -0,0 +1,5 @@
+-- Su SQLite attivita resta una tabella unica (nessun partizionamento): activity_log.py archivia
+-- i mesi vecchi esportandoli e cancellandoli, la timeline usa l'indice sul prospect
+
+-- Timeline del prospect dalla più recente (paginazione su data, id)
+CREATE INDEX IF NOT EXISTS idx_attivita_prospect_data ON attivita(id_prospect, data, id);
@@ -0,0 +1,15 @@
+-- Aperture (pixel) e click (link di reindirizzamento) delle email, scritti a blocchi da tracking.py
+
+CREATE TABLE IF NOT EXISTS email_eventi (
+    id INTEGER PRIMARY KEY,
+    id_prospect INTEGER,
+    -- email_outbox.id; NULL per gli invii diretti di send_email
+    id_messaggio INTEGER,
+    tipo VARCHAR(20) NOT NULL,
+    url TEXT,
+    user_agent VARCHAR(255),
+    registrato_il TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_eventi_messaggio ON email_eventi(id_messaggio, tipo);
+CREATE INDEX IF NOT EXISTS idx_email_eventi_prospect ON email_eventi(id_prospect);
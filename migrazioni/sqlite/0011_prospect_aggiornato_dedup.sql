@@ -0,0 +1,14 @@
+-- aggiornato_il cambia anche con i dati dell'indice duplicati (dedup.py): nome, sito ed email
+
+DROP TRIGGER IF EXISTS trg_prospect_aggiornato;
+CREATE TRIGGER trg_prospect_aggiornato
+AFTER UPDATE OF settore, fatturato, dipendenti, provincia, stato,
+                ragione_sociale, sito_web, email, email_hr ON prospect
+FOR EACH ROW
+WHEN (OLD.settore, OLD.fatturato, OLD.dipendenti, OLD.provincia, OLD.stato,
+      OLD.ragione_sociale, OLD.sito_web, OLD.email, OLD.email_hr)
+     IS NOT (NEW.settore, NEW.fatturato, NEW.dipendenti, NEW.provincia, NEW.stato,
+             NEW.ragione_sociale, NEW.sito_web, NEW.email, NEW.email_hr)
+BEGIN
+    UPDATE prospect SET aggiornato_il = datetime('now', 'localtime') WHERE id = NEW.id;
+END;
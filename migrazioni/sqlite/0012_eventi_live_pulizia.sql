@@ -0,0 +1,15 @@
+-- eventi_live ripulita dai trigger stessi e non dal thread di ascolto di live_events.py, che parte
+-- solo con il primo client collegato: senza dashboard aperte la tabella cresceva a ogni modifica
+
+DELETE FROM eventi_live WHERE creato_il < datetime('now', 'localtime', '-5 minutes');
+
+-- Cancellazione per intervallo di creato_il: costa quanto le righe tolte, non quanto la tabella
+CREATE INDEX IF NOT EXISTS idx_eventi_live_creato ON eventi_live(creato_il);
+
+-- Ogni 1000 eventi le righe più vecchie di 5 minuti (gli stream le leggono entro pochi secondi)
+CREATE TRIGGER IF NOT EXISTS trg_eventi_live_pulizia AFTER INSERT ON eventi_live
+FOR EACH ROW
+WHEN NEW.id % 1000 = 0
+BEGIN
+    DELETE FROM eventi_live WHERE creato_il < datetime('now', 'localtime', '-5 minutes');
+END;
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+ETJCA Query Log - Profilo delle istruzioni SQL eseguite dai cursori del database
+Durata e righe per impronta dell'istruzione, log delle query lente con piano EXPLAIN opzionale
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from metrics import RETENTION, process_alive
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'false').lower() in ('1', 'true', 'yes')
+# Al massimo un piano ogni N secondi per impronta: con ANALYZE la query viene eseguita di nuovo
+EXPLAIN_INTERVAL = float(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', 300))
+MAX_FINGERPRINTS = 500
+
+COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+PARAMS = re.compile(r'%s|%L|\?')
+LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACES = re.compile(r'\s+')
+
+EXPLAINABLE = re.compile(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+# Istruzioni che ANALYZE eseguirebbe con effetti: per queste solo il piano stimato
+SIDE_EFFECTS = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|nextval|setval|pg_\w*advisory\w*|pg_notify|set_config)\b|\bFOR\s+UPDATE\b', re.IGNORECASE
+)
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql) -> str:
+    """Istruzione normalizzata: costanti e parametri diventano ?, liste (...), spazi compattati"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = COMMENTS.sub(' ', sql)
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    sql = PARAMS.sub('?', sql)
+    sql = LISTS.sub('(...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+def explain_statement(sql: str, dialect: str) -> Optional[str]:
+    """EXPLAIN da eseguire per il piano di sql, None se l'istruzione non ne ha uno"""
+    if not isinstance(sql, str) or not EXPLAINABLE.match(sql):
+        return None
+    if dialect == 'sqlite':
+        return f'EXPLAIN QUERY PLAN {sql}'
+    if SIDE_EFFECTS.search(sql):
+        return f'EXPLAIN {sql}'
+    return f'EXPLAIN (ANALYZE, BUFFERS) {sql}'
+
+class QueryLog:
+    """Statistiche per impronta delle istruzioni del processo, salvabili e unibili tra processi"""
+    
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, explain: bool = SLOW_QUERY_EXPLAIN):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self._stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def measure(self, sql, cursor, plan: Optional[Callable[[], Optional[str]]] = None):
+        """Misura l'istruzione eseguita nel blocco; le istruzioni fallite non vengono registrate"""
+        start = time.perf_counter()
+        yield
+        self.record(sql, time.perf_counter() - start, getattr(cursor, 'rowcount', -1), plan)
+    
+    def record(self, sql, duration: float, rows: int = -1, plan: Optional[Callable[[], Optional[str]]] = None):
+        key = fingerprint(sql)
+        slow = duration >= self.threshold
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                if len(self._stats) >= MAX_FINGERPRINTS:
+                    # Impronte generate al volo: si scarta quella con meno tempo totale
+                    del self._stats[min(self._stats, key=lambda k: self._stats[k]['totale'])]
+                entry = self._stats[key] = {
+                    'chiamate': 0, 'totale': 0.0, 'massimo': 0.0, 'righe': 0,
+                    'lente': 0, 'piano': None, 'piano_il': 0.0
+                }
+            entry['chiamate'] += 1
+            entry['totale'] += duration
+            entry['massimo'] = max(entry['massimo'], duration)
+            if rows > 0:
+                entry['righe'] += rows
+            if not slow:
+                return
+            entry['lente'] += 1
+            capture = self.explain and plan is not None and time.time() - entry['piano_il'] >= EXPLAIN_INTERVAL
+            if capture:
+                entry['piano_il'] = time.time()
+        
+        logging.warning(f"🐢 Query lenta ({duration * 1000:.0f} ms, {rows} righe): {key[:500]}")
+        if capture:
+            try:
+                piano = plan()
+            except Exception as e:
+                logging.warning(f"EXPLAIN della query lenta non riuscito: {e}")
+                return
+            if piano:
+                with self._lock:
+                    entry['piano'] = piano
+                logging.warning(f"🐢 Piano:\n{piano}")
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._stats.items()}
+    
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+    
+    def save(self, directory: str):
+        """File del processo accanto a quelli delle metriche (scrittura atomica)"""
+        path = os.path.join(directory, f'query_log_{os.getpid()}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(path + '.tmp', path)
+    
+    @staticmethod
+    def clear_saved(directory: str) -> int:
+        """Elimina i file salvati da un avvio precedente (un PID riusato li farebbe sembrare vivi)"""
+        removed = 0
+        for filename in os.listdir(directory) if os.path.isdir(directory) else []:
+            if filename.startswith('query_log_') and filename.endswith(('.json', '.tmp')):
+                try:
+                    os.remove(os.path.join(directory, filename))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+    
+    def collect(self, directory: Optional[str] = None) -> Dict[str, Dict]:
+        """Statistiche del processo sommate a quelle salvate dagli altri processi"""
+        snapshots = [self.snapshot()]
+        for filename in os.listdir(directory) if directory and os.path.isdir(directory) else []:
+            if not (filename.startswith('query_log_') and filename.endswith('.json')):
+                continue
+            pid = int(filename[len('query_log_'):-len('.json')])
+            if pid == os.getpid():
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                if not process_alive(pid) and time.time() - os.path.getmtime(path) > RETENTION:
+                    os.remove(path)
+                    continue
+                with open(path, encoding='utf-8') as handle:
+                    snapshots.append(json.load(handle))
+            except (OSError, ValueError):
+                continue
+        
+        merged: Dict[str, Dict] = {}
+        for snapshot in snapshots:
+            for key, entry in snapshot.items():
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = dict(entry)
+                    continue
+                for field in ('chiamate', 'totale', 'righe', 'lente'):
+                    current[field] += entry[field]
+                current['massimo'] = max(current['massimo'], entry['massimo'])
+                if entry['piano'] and entry['piano_il'] > current['piano_il']:
+                    current['piano'], current['piano_il'] = entry['piano'], entry['piano_il']
+        return merged
+    
+    def top(self, limit: int = 20, order: str = 'totale', directory: Optional[str] = None) -> List[Dict]:
+        """Impronte più lente per tempo totale, massimo, medio o numero di esecuzioni lente"""
+        rows = [
+            {
+                'impronta': key,
+                'chiamate': entry['chiamate'],
+                'totale_ms': round(entry['totale'] * 1000, 1),
+                'media_ms': round(entry['totale'] * 1000 / entry['chiamate'], 2),
+                'massimo_ms': round(entry['massimo'] * 1000, 1),
+                'righe': entry['righe'],
+                'lente': entry['lente'],
+                'piano': entry['piano'],
+            }
+            for key, entry in self.collect(directory).items()
+        ]
+        field = {'totale': 'totale_ms', 'massimo': 'massimo_ms', 'media': 'media_ms', 'lente': 'lente'}.get(order)
+        if field is None:
+            raise ValueError(f"Ordinamento non valido: {order} (totale, massimo, media, lente)")
+        rows.sort(key=lambda row: row[field], reverse=True)
+        return rows[:limit]
+
+query_log = QueryLog()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+ETJCA Reports - Report Excel/CSV a memoria costante
+Lettura con cursori server-side a blocchi e scrittura openpyxl write-only; solo il CSV è in streaming
+dalla prima riga, l'Excel viene prima scritto completo su disco
+"""
+
+import io
+import os
+import csv
+import logging
+import tempfile
+from datetime import datetime
+from importlib.util import find_spec
+from typing import Iterator, List, Optional, Tuple
+
+CHUNK_SIZE = 5000
+
+REPORTS = {
+    'prospect': (
+        ['ID', 'Ragione Sociale', 'Settore', 'Provincia', 'Fatturato', 'Dipendenti', 'Stato',
+         'Priorità', 'Fonte', 'Email', 'Telefono', 'Sito Web', 'Nome HR', 'Cognome HR',
+         'Email HR', 'Data Inserimento', 'Email Inviate', 'Ultima Attività'],
+        '''
+            SELECT p.id, p.ragione_sociale, p.settore, p.provincia, p.fatturato, p.dipendenti,
+                   p.stato, p.priorita, p.fonte, p.email, p.telefono, p.sito_web,
+                   p.nome_hr, p.cognome_hr, p.email_hr, p.data_inserimento,
+                   COALESCE(a.email_inviate, 0), a.ultima_attivita
+            FROM prospect p
+            LEFT JOIN (
+                SELECT id_prospect,
+                       COUNT(*) FILTER (WHERE tipo = 'email') AS email_inviate,
+                       MAX(data) AS ultima_attivita
+                FROM attivita
+                GROUP BY id_prospect
+            ) a ON a.id_prospect = p.id
+            ORDER BY p.id
+        '''
+    ),
+    'attivita': (
+        ['ID', 'Data', 'ID Prospect', 'Ragione Sociale', 'Tipo', 'Oggetto', 'Esito', 'Descrizione'],
+        '''
+            SELECT a.id, a.data, a.id_prospect, p.ragione_sociale, a.tipo, a.oggetto,
+                   a.esito, a.descrizione
+            FROM attivita a
+            LEFT JOIN prospect p ON p.id = a.id_prospect
+            ORDER BY a.id
+        '''
+    ),
+}
+
+SUMMARY_QUERIES = [
+    ('Prospect per stato', 'SELECT stato, COUNT(*) FROM prospect GROUP BY stato ORDER BY 2 DESC'),
+    ('Prospect per provincia', 'SELECT provincia, COUNT(*) FROM prospect GROUP BY provincia ORDER BY 2 DESC'),
+    ('Prospect per settore', 'SELECT settore, COUNT(*) FROM prospect GROUP BY settore ORDER BY 2 DESC'),
+    ('Attività per tipo', 'SELECT tipo, COUNT(*) FROM attivita GROUP BY tipo ORDER BY 2 DESC'),
+]
+
+# openpyxl importato solo quando si genera un Excel
+HAS_OPENPYXL = find_spec('openpyxl') is not None
+if not HAS_OPENPYXL:
+    logging.warning("openpyxl non disponibile - report solo in CSV")
+
+class ReportGenerator:
+    """Genera report su prospect e attività senza caricare le tabelle in memoria"""
+    
+    def __init__(self, db_manager, chunk_size: int = CHUNK_SIZE):
+        self.db_manager = db_manager
+        self.chunk_size = chunk_size
+    
+    def iter_rows(self, conn, query: str, name: str) -> Iterator[tuple]:
+        """Scorre il risultato con un cursore server-side (itersize righe per round trip)"""
+        cursor = conn.cursor(name=f'report_{name}')
+        cursor.itersize = self.chunk_size
+        try:
+            cursor.execute(query)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+    
+    def summary_rows(self, conn) -> List[tuple]:
+        cursor = conn.cursor()
+        rows = [('Report ETJCA', datetime.now().strftime('%d/%m/%Y %H:%M')), ()]
+        for title, query in SUMMARY_QUERIES:
+            cursor.execute(query)
+            rows.append((title,))
+            rows.extend((value or 'n.d.', count) for value, count in cursor.fetchall())
+            rows.append(())
+        return rows
+    
+    def stream_csv(self, tipo: str = 'prospect') -> Iterator[bytes]:
+        """CSV in streaming: il download inizia con il primo blocco di righe"""
+        if tipo not in REPORTS:
+            raise ValueError(f"Report non disponibile: {tipo}")
+        headers, query = REPORTS[tipo]
+        
+        buffer = io.StringIO()
+        # Separatore ';' e BOM: apertura diretta in Excel con locale italiano
+        writer = csv.writer(buffer, delimiter=';')
+        buffer.write('\ufeff')
+        writer.writerow(headers)
+        
+        with self.db_manager.connection() as conn:
+            for count, row in enumerate(self.iter_rows(conn, query, tipo), start=1):
+                writer.writerow(row)
+                if count % self.chunk_size == 0:
+                    yield buffer.getvalue().encode('utf-8')
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+    
+    def write_xlsx(self, path: str) -> str:
+        """Scrive il report Excel completo in modalità write-only"""
+        if not HAS_OPENPYXL:
+            raise Exception("openpyxl non installato")
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+        
+        workbook = Workbook(write_only=True)
+        bold = Font(bold=True)
+        
+        with self.db_manager.connection() as conn:
+            summary = workbook.create_sheet('Riepilogo')
+            for row in self.summary_rows(conn):
+                summary.append(row)
+            
+            for tipo, (headers, query) in REPORTS.items():
+                sheet = workbook.create_sheet(tipo.capitalize())
+                header_cells = []
+                for header in headers:
+                    cell = WriteOnlyCell(sheet, value=header)
+                    cell.font = bold
+                    header_cells.append(cell)
+                sheet.append(header_cells)
+                for row in self.iter_rows(conn, query, tipo):
+                    sheet.append(row)
+        
+        workbook.save(path)
+        logging.info(f"📊 Report salvato: {path}")
+        return path
+    
+    def stream_xlsx(self) -> Iterator[bytes]:
+        """Genera l'Excel su file temporaneo e lo invia a blocchi, poi lo elimina: lo zip .xlsx ha l'indice
+        in fondo, quindi il download parte a file finito (per le esportazioni grandi stream_csv)"""
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            self.write_xlsx(path)
+            with open(path, 'rb') as handle:
+                while True:
+                    chunk = handle.read(64 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            os.remove(path)
+    
+    def download(self, formato: str = 'xlsx', tipo: str = 'prospect') -> Tuple[Iterator[bytes], str, str]:
+        """Stream, nome file e mimetype del report richiesto (fallback CSV senza openpyxl)"""
+        if tipo not in REPORTS:
+            raise ValueError(f"Report non disponibile: {tipo}")
+        data = datetime.now().strftime('%Y%m%d')
+        if formato == 'xlsx' and HAS_OPENPYXL:
+            return (
+                self.stream_xlsx(),
+                f'report_etjca_{data}.xlsx',
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
+        return self.stream_csv(tipo), f'report_etjca_{tipo}_{data}.csv', 'text/csv; charset=utf-8'
+    
+    def save_report(self, directory: Optional[str] = None) -> Optional[str]:
+        """Report periodico su disco (usato dallo scheduler)"""
+        if not self.db_manager.connected:
+            logging.warning("Report non generato: database non connesso")
+            return None
+        
+        directory = directory or os.getenv('REPORT_DIR', 'report_salvati')
+        os.makedirs(directory, exist_ok=True)
+        data = datetime.now().strftime('%Y%m%d')
+        
+        if HAS_OPENPYXL:
+            return self.write_xlsx(os.path.join(directory, f'report_etjca_{data}.xlsx'))
+        
+        path = os.path.join(directory, f'report_etjca_prospect_{data}.csv')
+        with open(path, 'wb') as handle:
+            for chunk in self.stream_csv('prospect'):
+                handle.write(chunk)
+        logging.info(f"📊 Report salvato: {path}")
+        return path
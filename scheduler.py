@@ -7,16 +7,30 @@ import schedule
 import time
 from datetime import datetime
 import logging
-from etjca_cloud_agent import CloudLeadAgent
+from etjca_cloud_agent import CloudLeadAgent, job_queue, email_manager, report_generator
+from job_queue import JobWorker
+from email_outbox import OutboxDispatcher
 
 logging.basicConfig(level=logging.INFO)
 
 def main():
     agent = CloudLeadAgent()
     
+    # Campagne email accodate dalla dashboard
+    JobWorker(job_queue).start()
+    
+    # Svuotamento outbox in parallelo con gli altri worker
+    if email_manager.enabled:
+        OutboxDispatcher(email_manager.outbox, email_manager).start()
+    
     schedule.every().day.at("08:00").do(agent.run_full_cycle)
     schedule.every().day.at("14:00").do(agent.email_manager.schedule_follow_ups)
-    schedule.every().monday.at("09:00").do(agent.generate_report_only)
+    schedule.every().monday.at("09:00").do(report_generator.save_report)
+    schedule.every().sunday.at("03:00").do(job_queue.enqueue, 'cluster_duplicati', {})
+    # Ricalcolo completo: la recenza delle attività decade anche senza modifiche
+    schedule.every().sunday.at("04:00").do(job_queue.enqueue, 'punteggio_lead', {'completo': True})
+    # Partizioni dei prossimi mesi e archiviazione dei mesi vecchi (ATTIVITA_ARCHIVIO_MESI)
+    schedule.every().day.at("02:30").do(job_queue.enqueue, 'manutenzione_attivita', {})
     
     logging.info("🕐 Scheduler ETJCA avviato")
     
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+ETJCA Lead Scoring - Punteggio dei prospect calcolato a colonne con pandas
+Lettura a blocchi con cursore server-side, un solo UPDATE per le righe cambiate
+"""
+
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from importlib.util import find_spec
+from typing import Dict, List, Optional, Tuple
+
+# numpy e pandas importati al primo ricalcolo: chi importa solo le costanti non li carica
+HAS_PANDAS = find_spec('numpy') is not None and find_spec('pandas') is not None
+if not HAS_PANDAS:
+    logging.warning("pandas non disponibile - punteggio lead disattivato")
+
+# Target ETJCA: settori e dimensione aziendale
+TARGET_SETTORI = ('manifatturiero', 'metalmeccanico', 'edilizia', 'logistica')
+SOGLIA_FATTURATO = 2_000_000
+SOGLIA_DIPENDENTI = 50
+PROVINCE = [p.strip().lower() for p in os.getenv(
+    'SCORING_PROVINCE', 'udine,pordenone,gorizia,trieste,ud,pn,go,ts'
+).split(',') if p.strip()]
+
+# Punti massimi per componente (totale 100)
+PESI = {'dimensione': 35, 'settore': 25, 'territorio': 10, 'recenza': 15, 'risposta': 15}
+
+# Stato commerciale: da -1 (penalità piena) a 1 (punti pieni)
+STATO_RISPOSTA = {
+    'contattato': 0.3,
+    'interessato': 0.8,
+    'appuntamento_fissato': 1.0,
+    'cliente_acquisito': 1.0,
+    'non_interessato': -1.0,
+}
+
+SOGLIA_ALTA = 50
+SOGLIA_MEDIA = 25
+EMIVITA_GIORNI = float(os.getenv('SCORING_EMIVITA_GIORNI', 30))
+SOLLECITI_SENZA_RISPOSTA = 3
+CHUNK_SIZE = 10000
+
+# Margine sul punto di ripresa: copre le transazioni ancora aperte all'esecuzione precedente
+SOVRAPPOSIZIONE = timedelta(minutes=10)
+
+COLUMNS = ['id', 'settore', 'provincia', 'fatturato', 'dipendenti', 'stato',
+           'punteggio', 'priorita', 'ultima', 'email', 'fallite']
+
+def score_frame(frame: 'pd.DataFrame', now: datetime) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Punteggio 0-100 e priorità per ogni riga, senza cicli Python"""
+    import numpy as np
+    import pandas as pd
+    
+    fatturato = pd.to_numeric(frame['fatturato'], errors='coerce').fillna(0).to_numpy(float)
+    dipendenti = pd.to_numeric(frame['dipendenti'], errors='coerce').fillna(0).to_numpy(float)
+    dimensione = np.maximum(
+        np.clip(fatturato / (2 * SOGLIA_FATTURATO), 0, 1),
+        np.clip(dipendenti / (2 * SOGLIA_DIPENDENTI), 0, 1)
+    )
+    
+    settore = frame['settore'].fillna('').str.lower()
+    in_target = settore.str.contains('|'.join(TARGET_SETTORI), regex=True).to_numpy()
+    territorio = frame['provincia'].fillna('').str.strip().str.lower().isin(PROVINCE).to_numpy()
+    
+    # Interazioni recenti: metà dei punti ogni EMIVITA_GIORNI, nessuna attività = 0
+    giorni = (now - pd.to_datetime(frame['ultima'])).dt.total_seconds().to_numpy() / 86400
+    recenza = np.nan_to_num(np.exp2(-np.clip(giorni, 0, None) / EMIVITA_GIORNI))
+    
+    stato = frame['stato'].fillna('nuovo')
+    email = frame['email'].fillna(0).to_numpy(float)
+    fallite = frame['fallite'].fillna(0).to_numpy(float)
+    # Solleciti senza risposta e indirizzi che rimbalzano abbassano il punteggio
+    risposta = (
+        stato.map(STATO_RISPOSTA).fillna(0).to_numpy(float)
+        - 0.5 * ((email >= SOLLECITI_SENZA_RISPOSTA) & stato.isin(['nuovo', 'contattato']).to_numpy())
+        - 0.5 * ((fallite > 0) & (email == 0))
+    )
+    
+    punteggio = (
+        PESI['dimensione'] * dimensione
+        + PESI['settore'] * in_target
+        + PESI['territorio'] * territorio
+        + PESI['recenza'] * recenza
+        + PESI['risposta'] * np.clip(risposta, -1, 1)
+    )
+    punteggio = np.clip(np.rint(punteggio), 0, 100).astype(np.int16)
+    priorita = np.select([punteggio >= SOGLIA_ALTA, punteggio >= SOGLIA_MEDIA], ['alta', 'media'], 'bassa')
+    return punteggio, priorita
+
+class LeadScorer:
+    """Ricalcolo del punteggio sulla tabella prospect, completo o solo sulle righe cambiate"""
+    
+    def __init__(self, db_manager, chunk_size: int = CHUNK_SIZE):
+        self.db_manager = db_manager
+        self.chunk_size = int(os.getenv('SCORING_CHUNK_SIZE', chunk_size))
+    
+    def last_run(self) -> Optional[datetime]:
+        """Inizio dell'ultima esecuzione riuscita"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(avviato_il) FROM punteggio_esecuzioni')
+            return cursor.fetchone()[0]
+    
+    def _query(self, da: Optional[datetime]) -> Tuple[str, List]:
+        """Prospect da valutare con il riepilogo delle attività (solo quelli cambiati se c'è un punto di ripresa)"""
+        if da is None:
+            return '''
+                SELECT p.id, p.settore, p.provincia, p.fatturato, p.dipendenti, p.stato,
+                       p.punteggio, p.priorita, a.ultima, a.email, a.fallite
+                FROM prospect p
+                LEFT JOIN (
+                    SELECT id_prospect, MAX(data) AS ultima,
+                           COUNT(*) FILTER (WHERE esito = 'inviata') AS email,
+                           COUNT(*) FILTER (WHERE esito = 'fallita') AS fallite
+                    FROM attivita
+                    GROUP BY id_prospect
+                ) a ON a.id_prospect = p.id
+            ''', []
+        return '''
+            WITH candidati AS (
+                SELECT id FROM prospect WHERE aggiornato_il > %s
+                UNION
+                SELECT id_prospect FROM attivita WHERE data > %s
+            )
+            SELECT p.id, p.settore, p.provincia, p.fatturato, p.dipendenti, p.stato,
+                   p.punteggio, p.priorita, a.ultima, a.email, a.fallite
+            FROM prospect p
+            JOIN candidati c ON c.id = p.id
+            LEFT JOIN (
+                SELECT id_prospect, MAX(data) AS ultima,
+                       COUNT(*) FILTER (WHERE esito = 'inviata') AS email,
+                       COUNT(*) FILTER (WHERE esito = 'fallita') AS fallite
+                FROM attivita
+                WHERE id_prospect IN (SELECT id FROM candidati)
+                GROUP BY id_prospect
+            ) a ON a.id_prospect = p.id
+        ''', [da, da]
+    
+    def run(self, completo: bool = False, progress=None) -> Dict:
+        """Valuta i prospect a blocchi e scrive solo i punteggi cambiati"""
+        if not HAS_PANDAS:
+            raise Exception("pandas non disponibile")
+        if not self.db_manager.connected:
+            raise Exception("Database non connesso")
+        import numpy as np
+        import pandas as pd
+        
+        start = time.monotonic()
+        ultimo = None if completo else self.last_run()
+        da = ultimo - SOVRAPPOSIZIONE if ultimo else None
+        
+        ids, punteggi, priorita = [], [], []
+        valutati = 0
+        with self.db_manager.connection() as conn:
+            meta = conn.cursor()
+            meta.execute('SELECT LOCALTIMESTAMP')
+            avviato_il = meta.fetchone()[0]
+            
+            query, params = self._query(da)
+            cursor = conn.cursor(name='punteggio_lead')
+            cursor.itersize = self.chunk_size
+            cursor.execute(query, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    frame = pd.DataFrame.from_records(rows, columns=COLUMNS)
+                    punteggio, nuova = score_frame(frame, avviato_il)
+                    # La priorità 'urgente' è una scelta manuale e resta invariata
+                    nuova = np.where(frame['priorita'].to_numpy() == 'urgente', 'urgente', nuova)
+                    cambiati = (
+                        (frame['punteggio'].fillna(-1).to_numpy() != punteggio)
+                        | (frame['priorita'].to_numpy() != nuova)
+                    )
+                    ids.append(frame['id'].to_numpy()[cambiati])
+                    punteggi.append(punteggio[cambiati])
+                    priorita.append(nuova[cambiati])
+                    valutati += len(rows)
+                    if progress:
+                        progress(valutati)
+            finally:
+                cursor.close()
+        
+        aggiornati = self._write(
+            np.concatenate(ids) if ids else np.array([], dtype=int),
+            np.concatenate(punteggi) if punteggi else np.array([], dtype=np.int16),
+            np.concatenate(priorita) if priorita else np.array([], dtype=str),
+        )
+        durata = time.monotonic() - start
+        
+        with self.db_manager.connection() as conn:
+            conn.cursor().execute('''
+                INSERT INTO punteggio_esecuzioni (completo, avviato_il, valutati, aggiornati, durata)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', (da is None, avviato_il, valutati, aggiornati, round(durata, 3)))
+        
+        risultato = {
+            'completo': da is None,
+            'valutati': valutati,
+            'aggiornati': aggiornati,
+            'durata': round(durata, 2),
+        }
+        logging.info(f"🎯 Punteggio lead: {risultato}")
+        return risultato
+    
+    def _write(self, ids: 'np.ndarray', punteggi: 'np.ndarray', priorita: 'np.ndarray') -> int:
+        """Un solo UPDATE con gli array dei valori nuovi"""
+        if not len(ids):
+            return 0
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            if self.db_manager.dialect == 'sqlite':
+                # Niente array su SQLite: UPDATE preparato una volta, righe in un'unica transazione
+                cursor.executemany(
+                    'UPDATE prospect SET punteggio = %s, priorita = %s WHERE id = %s',
+                    zip(punteggi.tolist(), priorita.tolist(), ids.tolist())
+                )
+            else:
+                cursor.execute('''
+                    UPDATE prospect p SET punteggio = v.punteggio, priorita = v.priorita
+                    FROM unnest(%s::int[], %s::smallint[], %s::text[]) AS v(id, punteggio, priorita)
+                    WHERE p.id = v.id
+                ''', (ids.tolist(), punteggi.tolist(), priorita.tolist()))
+            aggiornati = cursor.rowcount
+        self.db_manager.invalidate_stats()
+        return aggiornati
+    
+    def run_job(self, job: Dict, queue) -> Dict:
+        """Handler job 'punteggio_lead': payload {"completo": true} per ricalcolare tutta la tabella"""
+        return self.run(
+            completo=bool(job['payload'].get('completo')),
+            progress=lambda n: queue.set_progress(job['id'], job['worker'], n, 0)
+        )
+    
+    def get_runs(self, limit: int = 10) -> List[Dict]:
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, completo, avviato_il, valutati, aggiornati, durata
+                FROM punteggio_esecuzioni ORDER BY id DESC LIMIT %s
+            ''', (limit,))
+            return [
+                {
+                    'id': row[0],
+                    'completo': bool(row[1]),
+                    'avviato_il': row[2].isoformat() if row[2] else None,
+                    'valutati': row[3],
+                    'aggiornati': row[4],
+                    'durata': row[5],
+                }
+                for row in cursor.fetchall()
+            ]
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+ETJCA Scraper - Sorgenti web per il ciclo lead (Camera di Commercio, LinkedIn)
+Sessione HTTP con connessioni riusate, limiti per host e cache su disco con ETag/Last-Modified
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bulk_import import normalize_header
+
+USER_AGENT = 'ETJCA-LeadAgent/1.0 (+https://www.etjca.it)'
+
+class HttpCache:
+    """Cache su disco: un file JSON di metadati e uno per il contenuto per ogni URL"""
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    def _paths(self, url: str) -> Tuple[str, str]:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return base + '.json', base + '.body'
+    
+    def get(self, url: str) -> Optional[Dict]:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as handle:
+                meta = json.load(handle)
+            with open(body_path, 'rb') as handle:
+                meta['body'] = handle.read()
+            return meta
+        except (OSError, ValueError):
+            return None
+    
+    def put(self, url: str, response: requests.Response):
+        meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_type': response.headers.get('Content-Type', ''),
+            'encoding': response.encoding,
+            'scaricato_il': time.time()
+        }
+        # Scrittura atomica: un processo concorrente non legge mai file a metà
+        for path, data, mode in ((body_path, response.content, 'wb'),
+                                 (meta_path, json.dumps(meta), 'w')):
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, mode) as handle:
+                handle.write(data)
+            os.replace(tmp, path)
+    
+    def touch(self, url: str):
+        meta_path, _ = self._paths(url)
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+
+class HostLimiter:
+    """Richieste contemporanee e intervallo minimo tra richieste per ciascun host"""
+    
+    def __init__(self, concurrency: int, rate: float):
+        self.concurrency = concurrency
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._hosts: Dict[str, Tuple[threading.BoundedSemaphore, List[float]]] = {}
+        self._lock = threading.Lock()
+    
+    def _host(self, host: str):
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (threading.BoundedSemaphore(self.concurrency), [0.0])
+            return self._hosts[host]
+    
+    def acquire(self, host: str):
+        semaphore, next_slot = self._host(host)
+        semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, next_slot[0])
+            next_slot[0] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+    
+    def release(self, host: str):
+        self._host(host)[0].release()
+
+class Fetcher:
+    """GET con connessioni riusate, richieste condizionali e retry su 429/5xx"""
+    
+    def __init__(self, cache: Optional[HttpCache] = None, concurrency: int = 2, rate: float = 1.0,
+                 timeout: float = 20, retries: int = 3):
+        self.cache = cache
+        self.limiter = HostLimiter(concurrency, rate)
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=max(10, concurrency * 4))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats = {'richieste': 0, 'non_modificate': 0, 'scaricate': 0, 'errori': 0}
+        self._stats_lock = threading.Lock()
+        self._robots_cache: Dict[str, List[str]] = {}
+    
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+    
+    def get(self, url: str) -> Optional[Tuple[str, bool]]:
+        """(testo, modificato) della pagina; None se non raggiungibile"""
+        cached = self.cache.get(url) if self.cache else None
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        host = urlparse(url).netloc
+        error = None
+        for tentativo in range(self.retries + 1):
+            self.limiter.acquire(host)
+            try:
+                self._count('richieste')
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                response, error = None, e
+            finally:
+                self.limiter.release(host)
+            
+            if response is not None and response.status_code == 304 and cached:
+                self._count('non_modificate')
+                self.cache.touch(url)
+                return cached['body'].decode(cached.get('encoding') or 'utf-8', errors='replace'), False
+            if response is not None and response.status_code == 200:
+                self._count('scaricate')
+                if self.cache:
+                    self.cache.put(url, response)
+                return response.text, True
+            if response is not None and response.status_code not in (429, 500, 502, 503, 504):
+                logging.warning(f"Scraper {url}: HTTP {response.status_code}")
+                break
+            
+            if tentativo < self.retries:
+                attesa = 2 ** tentativo
+                if response is not None and str(response.headers.get('Retry-After', '')).isdigit():
+                    attesa = int(response.headers['Retry-After'])
+                time.sleep(min(attesa, 60))
+            else:
+                logging.warning(f"Scraper {url}: {error if response is None else f'HTTP {response.status_code}'}")
+        
+        self._count('errori')
+        return None
+    
+    def allowed(self, url: str) -> bool:
+        """Rispetta robots.txt (regole Disallow per tutti gli user agent)"""
+        parsed = urlparse(url)
+        rules = self._robots(f"{parsed.scheme}://{parsed.netloc}")
+        return not any(parsed.path.startswith(rule) for rule in rules)
+    
+    def _robots(self, origin: str) -> List[str]:
+        with self._stats_lock:
+            if origin in self._robots_cache:
+                return self._robots_cache[origin]
+        rules = []
+        try:
+            response = self.session.get(f"{origin}/robots.txt", timeout=self.timeout)
+            if response.status_code == 200:
+                applies = False
+                for line in response.text.splitlines():
+                    field, _, value = line.partition(':')
+                    field, value = field.strip().lower(), value.split('#')[0].strip()
+                    if field == 'user-agent':
+                        applies = value == '*'
+                    elif field == 'disallow' and applies and value:
+                        rules.append(value)
+        except requests.RequestException:
+            pass
+        with self._stats_lock:
+            self._robots_cache[origin] = rules
+        return rules
+
+class PageParser(HTMLParser):
+    """Estrae tabelle, link e blocchi JSON-LD senza dipendenze esterne"""
+    
+    def __init__(self):
+        super().__init__()
+        self.tables: List[List[List[str]]] = []
+        self.links: List[Tuple[str, str, str]] = []
+        self.json_ld: List[str] = []
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+        self._link: Optional[Tuple[str, str, List[str]]] = None
+        self._script: Optional[List[str]] = None
+    
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'table':
+            self.tables.append([])
+        elif tag == 'tr' and self.tables:
+            self._row = []
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = []
+        elif tag == 'a' and attrs.get('href'):
+            rel = ' '.join(filter(None, [attrs.get('rel'), attrs.get('class')]))
+            self._link = (attrs['href'], rel, [])
+        elif tag == 'script' and attrs.get('type') == 'application/ld+json':
+            self._script = []
+    
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self._cell is not None:
+            self._row.append(' '.join(''.join(self._cell).split()))
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            if self._row:
+                self.tables[-1].append(self._row)
+            self._row = None
+        elif tag == 'a' and self._link is not None:
+            href, rel, text = self._link
+            self.links.append((href, rel, ' '.join(''.join(text).split())))
+            self._link = None
+        elif tag == 'script' and self._script is not None:
+            self.json_ld.append(''.join(self._script))
+            self._script = None
+    
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+        if self._link is not None:
+            self._link[2].append(data)
+        if self._script is not None:
+            self._script.append(data)
+
+def parse_page(html: str) -> PageParser:
+    parser = PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+class WebSource(ABC):
+    """Sorgente web: pagine iniziali e parsing in (lead, link da seguire)"""
+    
+    name = 'web'
+    
+    def __init__(self, seeds: List[str], max_pages: int = 200):
+        self.seeds = seeds
+        self.max_pages = max_pages
+    
+    @abstractmethod
+    def parse(self, url: str, html: str) -> Tuple[List[Dict], List[str]]:
+        """Lead trovati nella pagina e URL assoluti delle pagine da visitare dopo"""
+
+class RegistroImpreseSource(WebSource):
+    """Elenchi imprese in tabella HTML (visure/elenchi Camera di Commercio), con paginazione"""
+    
+    name = 'camera_commercio'
+    
+    def parse(self, url: str, html: str) -> Tuple[List[Dict], List[str]]:
+        page = parse_page(html)
+        leads = []
+        for table in page.tables:
+            if len(table) < 2:
+                continue
+            # Stesse intestazioni e alias dell'import massivo (Denominazione, Addetti, PEC...)
+            headers = [normalize_header(h) for h in table[0]]
+            if 'ragione_sociale' not in headers:
+                continue
+            for values in table[1:]:
+                row = dict(zip(headers, values))
+                row['fonte'] = self.name
+                leads.append(row)
+        
+        next_pages = [
+            urljoin(url, href) for href, rel, text in page.links
+            if 'next' in rel.lower() or text.lower() in ('successiva', 'avanti', '»', 'next')
+        ]
+        return leads, next_pages
+
+class OrganizationSource(WebSource):
+    """Pagine aziendali con dati strutturati schema.org Organization (JSON-LD)"""
+    
+    name = 'linkedin'
+    
+    def parse(self, url: str, html: str) -> Tuple[List[Dict], List[str]]:
+        leads = []
+        for block in parse_page(html).json_ld:
+            try:
+                data = json.loads(block)
+            except ValueError:
+                continue
+            for item in (data if isinstance(data, list) else data.get('@graph', [data])):
+                if isinstance(item, dict) and item.get('@type') in ('Organization', 'Corporation', 'LocalBusiness'):
+                    leads.append(self._lead(item, url))
+        return leads, []
+    
+    def _lead(self, item: Dict, url: str) -> Dict:
+        address = item.get('address') or {}
+        if isinstance(address, list):
+            address = address[0] if address else {}
+        employees = item.get('numberOfEmployees')
+        if isinstance(employees, dict):
+            employees = employees.get('value') or employees.get('maxValue')
+        return {
+            'ragione_sociale': item.get('legalName') or item.get('name'),
+            'settore': item.get('industry') or '',
+            'dipendenti': employees,
+            'indirizzo': address.get('streetAddress', '') if isinstance(address, dict) else str(address),
+            'provincia': address.get('addressRegion', '') if isinstance(address, dict) else '',
+            'telefono': item.get('telephone', ''),
+            'email': item.get('email', ''),
+            'sito_web': item.get('url') or url,
+            'fonte': self.name
+        }
+
+class ScraperEngine:
+    """Visita le pagine delle sorgenti in parallelo e restituisce i lead in streaming"""
+    
+    def __init__(self, fetcher: Fetcher, workers: int = 8, respect_robots: bool = True):
+        self.fetcher = fetcher
+        self.workers = workers
+        self.respect_robots = respect_robots
+    
+    def run(self, source: WebSource) -> Iterator[Dict]:
+        visited = set()
+        frontier = list(dict.fromkeys(source.seeds))
+        pagine = 0
+        
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"scraper-{source.name}") as pool:
+            pending = {}
+            while frontier or pending:
+                while frontier and pagine < source.max_pages:
+                    url = frontier.pop(0)
+                    if url in visited:
+                        continue
+                    visited.add(url)
+                    if self.respect_robots and not self.fetcher.allowed(url):
+                        logging.info(f"Scraper {url}: escluso da robots.txt")
+                        continue
+                    pagine += 1
+                    pending[pool.submit(self._visit, source, url)] = url
+                frontier = [] if pagine >= source.max_pages else frontier
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    try:
+                        leads, links = future.result()
+                    except Exception as e:
+                        logging.error(f"Scraper {url}: {e}")
+                        continue
+                    frontier.extend(link for link in links if link not in visited)
+                    for lead in leads:
+                        yield lead
+        
+        logging.info(f"🕷️ Scraper {source.name}: {pagine} pagine, {self.fetcher.stats}")
+    
+    def _visit(self, source: WebSource, url: str) -> Tuple[List[Dict], List[str]]:
+        result = self.fetcher.get(url)
+        if result is None:
+            return [], []
+        # Le pagine non modificate (304) vengono rilette dalla cache senza traffico
+        html, _ = result
+        return source.parse(url, html)
+
+def _urls(variable: str) -> List[str]:
+    return [url.strip() for url in os.getenv(variable, '').split(',') if url.strip()]
+
+def build_sources() -> Dict[str, Callable[[], Iterator[Dict]]]:
+    """Sorgenti configurate da ambiente, pronte per CloudLeadAgent.register_source"""
+    sources = []
+    max_pages = int(os.getenv('SCRAPER_MAX_PAGES', 200))
+    if _urls('SCRAPER_CAMERA_URLS'):
+        sources.append(RegistroImpreseSource(_urls('SCRAPER_CAMERA_URLS'), max_pages))
+    if _urls('SCRAPER_LINKEDIN_URLS'):
+        sources.append(OrganizationSource(_urls('SCRAPER_LINKEDIN_URLS'), max_pages))
+    if not sources:
+        return {}
+    
+    fetcher = Fetcher(
+        cache=HttpCache(os.getenv('SCRAPER_CACHE_DIR', 'cache_http')),
+        concurrency=int(os.getenv('SCRAPER_HOST_CONCURRENCY', 2)),
+        rate=float(os.getenv('SCRAPER_HOST_RATE', 1))
+    )
+    engine = ScraperEngine(
+        fetcher,
+        workers=int(os.getenv('SCRAPER_WORKERS', 8)),
+        respect_robots=os.getenv('SCRAPER_ROBOTS', 'true').lower() != 'false'
+    )
+    return {source.name: (lambda source=source: engine.run(source)) for source in sources}
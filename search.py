@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+ETJCA Search - Ricerca full-text su prospect e note delle attività
+PostgreSQL: colonna tsvector (configurazione italiana) con indice GIN mantenuto da trigger;
+SQLite: tabelle FTS5. Risultati ordinati per rilevanza, con evidenziazione e prefisso sull'ultima parola
+"""
+
+import os
+import re
+import html
+from typing import Dict, List, Optional, Tuple
+
+MAX_LIMIT = 50
+MAX_TERMS = 8
+# Un prefisso di una sola lettera corrisponde a quasi tutta la tabella: serve almeno la seconda
+MIN_PREFIX = 2
+# Per le parole comuni (decine di migliaia di righe) il rango è calcolato solo sulle prime
+# corrispondenze trovate dall'indice (su SQLite le più recenti): ordinarle tutte costerebbe 100+ ms
+RANK_CANDIDATES = int(os.getenv('SEARCH_RANK_CANDIDATES', 1000))
+
+# Delimitatori dell'evidenziazione: caratteri di controllo che non compaiono nel testo,
+# sostituiti con <mark> dopo l'escape HTML
+START_SEL, STOP_SEL = '\x02', '\x03'
+
+TIPI = ('prospect', 'attivita')
+
+def terms(text: str) -> List[str]:
+    """Parole della ricerca, senza la sintassi di tsquery/FTS5 (operatori, virgolette, parentesi)"""
+    return re.findall(r'\w+', (text or '').lower())[:MAX_TERMS]
+
+def pg_query(words: List[str], prefix: bool = True) -> Tuple[str, List[str]]:
+    """'mario rossi' -> 'mario' & 'rossi':* (tutte le parole, l'ultima anche incompleta), ognuna
+    come radice italiana o parola intera ('simple'): espressione SQL e parametri"""
+    parts = [f"'{word}'" for word in words]
+    if prefix and len(words[-1]) >= MIN_PREFIX:
+        parts[-1] += ':*'
+    expression = ' && '.join(["(to_tsquery('italian', %s) || to_tsquery('simple', %s))"] * len(parts))
+    return expression, [part for part in parts for _ in range(2)]
+
+def fts5_query(words: List[str], prefix: bool = True) -> str:
+    """'mario rossi' -> "mario" AND ("rossi" OR "rossi"*) (la parola intera pesa di più in bm25)"""
+    parts = [f'"{word}"' for word in words]
+    if prefix and len(words[-1]) >= MIN_PREFIX:
+        parts[-1] = f'({parts[-1]} OR {parts[-1]}*)'
+    return ' AND '.join(parts)
+
+def highlight(text: Optional[str]) -> Optional[str]:
+    """Escape HTML del testo del database, poi i delimitatori diventano <mark>"""
+    if text is None:
+        return None
+    return html.escape(text).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
+
+class ProspectSearch:
+    """Ricerca per il dashboard (type-ahead) e l'API: prima le righe più rilevanti, poi l'evidenziazione"""
+    
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+    
+    def search(self, text: str, tipo: str = 'tutti', limit: int = 10, prefix: bool = True) -> Dict:
+        if tipo not in TIPI + ('tutti',):
+            raise ValueError(f"Tipo non valido: {tipo}")
+        words = terms(text)
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        result = {'query': text, 'prospect': [], 'attivita': []}
+        if not words:
+            return result
+        
+        sqlite = self.db_manager.dialect == 'sqlite'
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            if sqlite:
+                params = (fts5_query(words, prefix),)
+            else:
+                params = self._pg_queries(cursor, words, prefix)
+            for nome in TIPI:
+                if tipo in (nome, 'tutti'):
+                    method = getattr(self, f"_{nome}_{'sqlite' if sqlite else 'pg'}")
+                    result[nome] = method(cursor, *params, limit)
+        return result
+    
+    @staticmethod
+    def _pg_queries(cursor, words: List[str], prefix: bool) -> Tuple[str, str]:
+        """tsquery calcolata una volta e poi passata come costante: il planner stima quante righe
+        corrispondono; la seconda, senza prefisso, fa salire nel rango chi contiene la parola intera"""
+        query, params = pg_query(words, prefix)
+        exact, exact_params = pg_query(words, prefix=False)
+        cursor.execute(f'SELECT ({query})::text, ({exact})::text', params + exact_params)
+        return cursor.fetchone()
+    
+    def _prospect_pg(self, cursor, query: str, exact: str, limit: int) -> List[Dict]:
+        # Candidati dall'indice GIN senza ordinamento (un ORDER BY id porterebbe il planner sulla chiave
+        # primaria, lentissima se la stima sbaglia), ts_rank_cd sui candidati, ts_headline solo sulle prime N
+        cursor.execute('''
+            WITH q AS (SELECT %s::tsquery AS q, %s::tsquery AS esatta)
+            SELECT p.id, p.ragione_sociale, p.provincia, p.settore, p.stato, p.rango,
+                   ts_headline('simple', p.ragione_sociale, q.q, %s),
+                   CASE WHEN p.note <> '' THEN ts_headline('simple', p.note, q.q, %s) END
+            FROM (
+                SELECT c.*, ts_rank_cd(c.ricerca, q.q) + ts_rank_cd(c.ricerca, q.esatta) AS rango
+                FROM (
+                    SELECT id, ragione_sociale, provincia, settore, stato, note, ricerca
+                    FROM prospect
+                    WHERE ricerca @@ %s::tsquery
+                    LIMIT %s
+                ) c, q
+                ORDER BY rango DESC, c.id DESC
+                LIMIT %s
+            ) p, q
+            ORDER BY p.rango DESC, p.id DESC
+        ''', (query, exact, self._headline_options(all_words=True), self._headline_options(),
+              query, RANK_CANDIDATES, limit))
+        return [self._prospect_row(row) for row in cursor.fetchall()]
+    
+    def _attivita_pg(self, cursor, query: str, exact: str, limit: int) -> List[Dict]:
+        # Solo per questa istruzione: i testi ripetitivi (oggetti delle email) lasciano poche parole
+        # nelle statistiche, un prefisso fuori da queste è stimato al 2-4% di ogni partizione e il planner
+        # le leggerebbe tutte (90+ ms anche senza risultati). Su prospect la stima regge: nessun vincolo
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('''
+            WITH q AS (SELECT %s::tsquery AS q, %s::tsquery AS esatta)
+            SELECT a.id, a.id_prospect, p.ragione_sociale, a.tipo, a.data, a.esito, a.rango,
+                   ts_headline('simple', COALESCE(a.oggetto, ''), q.q, %s),
+                   CASE WHEN a.descrizione <> '' THEN ts_headline('simple', a.descrizione, q.q, %s) END
+            FROM (
+                SELECT c.*, ts_rank_cd(c.ricerca, q.q) + ts_rank_cd(c.ricerca, q.esatta) AS rango
+                FROM (
+                    SELECT id, id_prospect, tipo, data, esito, oggetto, descrizione, ricerca
+                    FROM attivita
+                    WHERE ricerca @@ %s::tsquery
+                    LIMIT %s
+                ) c, q
+                ORDER BY rango DESC, c.id DESC
+                LIMIT %s
+            ) a
+            CROSS JOIN q
+            LEFT JOIN prospect p ON p.id = a.id_prospect
+            ORDER BY a.rango DESC, a.id DESC
+        ''', (query, exact, self._headline_options(all_words=True), self._headline_options(),
+              query, RANK_CANDIDATES, limit))
+        rows = cursor.fetchall()
+        # Se l'istruzione fallisce il rollback annulla comunque il SET LOCAL
+        cursor.execute('RESET enable_seqscan')
+        return [self._attivita_row(row) for row in rows]
+    
+    def _prospect_sqlite(self, cursor, query: str, limit: int) -> List[Dict]:
+        # bm25 è negativo (più basso = più rilevante), pesi come A/C/D di PostgreSQL. highlight() e
+        # snippet() nella stessa lettura dei candidati: una seconda MATCH per rowid rilegge l'indice ogni volta
+        cursor.execute('''
+            SELECT p.id, p.ragione_sociale, p.provincia, p.settore, p.stato, -f.rango, f.titolo, f.estratto
+            FROM (
+                SELECT * FROM (
+                    SELECT rowid AS id, bm25(prospect_ricerca, 10.0, 2.0, 1.0) AS rango,
+                           highlight(prospect_ricerca, 0, char(2), char(3)) AS titolo,
+                           CASE WHEN note <> ''
+                                THEN snippet(prospect_ricerca, 2, char(2), char(3), '…', 16) END AS estratto
+                    FROM prospect_ricerca
+                    WHERE prospect_ricerca MATCH %s
+                    ORDER BY rowid DESC
+                    LIMIT %s
+                )
+                ORDER BY rango, id DESC
+                LIMIT %s
+            ) f
+            JOIN prospect p ON p.id = f.id
+            ORDER BY f.rango, f.id DESC
+        ''', (query, RANK_CANDIDATES, limit))
+        return [self._prospect_row(row) for row in cursor.fetchall()]
+    
+    def _attivita_sqlite(self, cursor, query: str, limit: int) -> List[Dict]:
+        cursor.execute('''
+            SELECT a.id, a.id_prospect, p.ragione_sociale, a.tipo, a.data, a.esito, -f.rango, f.titolo, f.estratto
+            FROM (
+                SELECT * FROM (
+                    SELECT rowid AS id, bm25(attivita_ricerca, 4.0, 1.0) AS rango,
+                           highlight(attivita_ricerca, 0, char(2), char(3)) AS titolo,
+                           CASE WHEN descrizione <> ''
+                                THEN snippet(attivita_ricerca, 1, char(2), char(3), '…', 16) END AS estratto
+                    FROM attivita_ricerca
+                    WHERE attivita_ricerca MATCH %s
+                    ORDER BY rowid DESC
+                    LIMIT %s
+                )
+                ORDER BY rango, id DESC
+                LIMIT %s
+            ) f
+            JOIN attivita a ON a.id = f.id
+            LEFT JOIN prospect p ON p.id = a.id_prospect
+            ORDER BY f.rango, f.id DESC
+        ''', (query, RANK_CANDIDATES, limit))
+        return [self._attivita_row(row) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def _headline_options(all_words: bool = False) -> str:
+        """Per ts_headline con 'simple': le parole del testo non sono ridotte a radice, così viene
+        evidenziato anche il prefisso digitato ("preventiv" in "Preventivo")"""
+        options = f'StartSel={START_SEL}, StopSel={STOP_SEL}'
+        if all_words:
+            # Ragione sociale e oggetto sono brevi: mostrati interi
+            return options + ', HighlightAll=true'
+        return options + ', MaxFragments=2, MaxWords=16, MinWords=6, FragmentDelimiter=" … "'
+    
+    @staticmethod
+    def _prospect_row(row) -> Dict:
+        return {
+            'id': row[0],
+            'ragione_sociale': row[1],
+            'provincia': row[2],
+            'settore': row[3],
+            'stato': row[4],
+            'rilevanza': round(float(row[5]), 4),
+            'titolo_html': highlight(row[6]),
+            'estratto_html': highlight(row[7]),
+        }
+    
+    @staticmethod
+    def _attivita_row(row) -> Dict:
+        data = row[4]
+        return {
+            'id': row[0],
+            'id_prospect': row[1],
+            'ragione_sociale': row[2],
+            'tipo': row[3],
+            'data': data.isoformat() if hasattr(data, 'isoformat') else data,
+            'esito': row[5],
+            'rilevanza': round(float(row[6]), 4),
+            'titolo_html': highlight(row[7]),
+            'estratto_html': highlight(row[8]),
+        }
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+ETJCA Startup Benchmark - Tempo di import dell'applicazione web e latenza delle prime richieste
+Ogni misura in un processo nuovo, come un worker gunicorn appena avviato
+Uso: python startup_benchmark.py [--runs 5] [--route /health --route /api/stats]
+"""
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+PROBE = '''
+import sys, json, time
+start = time.perf_counter()
+import etjca_cloud_agent
+result = {'import': time.perf_counter() - start, 'richieste': []}
+client = etjca_cloud_agent.app.test_client()
+for route in sys.argv[1:]:
+    start = time.perf_counter()
+    status = client.get(route).status_code
+    result['richieste'].append([route, status, time.perf_counter() - start])
+result['moduli_pesanti'] = [m for m in ('pandas', 'numpy', 'openpyxl', 'requests') if m in sys.modules]
+print(json.dumps(result))
+'''
+
+def run_probe(routes: List[str]) -> Dict:
+    """Import e richieste in un interprete nuovo; l'ultima riga dell'output è il risultato"""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE] + routes, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def summary(label: str, values: List[float]) -> str:
+    ms = [value * 1000 for value in values]
+    return f"{label:<28} mediana {statistics.median(ms):8.1f} ms   min {min(ms):8.1f}   max {max(ms):8.1f}"
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--route', action='append', dest='routes')
+    args = parser.parse_args(argv)
+    routes = args.routes or ['/health', '/api/stats']
+    
+    results = [run_probe(routes) for _ in range(args.runs)]
+    print(summary('import etjca_cloud_agent', [r['import'] for r in results]))
+    for index, route in enumerate(routes):
+        status = results[-1]['richieste'][index][1]
+        label = f"prima GET {route} ({status})" if index == 0 else f"GET {route} ({status})"
+        print(summary(label, [r['richieste'][index][2] for r in results]))
+    print(f"Moduli pesanti caricati: {', '.join(results[-1]['moduli_pesanti']) or 'nessuno'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+ETJCA Storage - Backend del database dietro un'unica interfaccia
+PostgreSQL (pool psycopg2) in produzione, SQLite in modalità WAL per sviluppo, test e benchmark
+Le query dell'applicazione sono scritte per PostgreSQL e tradotte al volo per SQLite
+"""
+
+import os
+import re
+import csv
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import psycopg2
+    import psycopg2.pool
+    import psycopg2.extensions
+    HAS_PSYCOPG2 = True
+except ImportError:
+    HAS_PSYCOPG2 = False
+
+from query_log import query_log, explain_statement
+
+# Timestamp salvati come testo ISO, riletti come datetime (come le colonne TIMESTAMP di PostgreSQL)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{1,6})?')
+
+class ConnectionPool:
+    """Pool thread-safe di connessioni PostgreSQL con health check e metriche"""
+    
+    def __init__(self, dsn: str, minconn: int = 1, maxconn: int = 10,
+                 timeout: float = 30.0, check_after: float = 30.0, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._max_wait = 0.0
+    
+    def getconn(self):
+        """Preleva una connessione sana dal pool, attendendo se saturo"""
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._timeouts += 1
+                raise Exception(f"Pool database saturo ({self.maxconn} connessioni in uso)")
+        
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                self._discard(conn)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._checkouts += 1
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+    
+    def putconn(self, conn, close: bool = False):
+        """Restituisce la connessione al pool"""
+        try:
+            if not close and not conn.closed:
+                status = conn.info.transaction_status
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            self._last_used[id(conn)] = time.monotonic()
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._pool.putconn(conn)
+        except Exception as e:
+            logging.warning(f"Connessione scartata dal pool: {e}")
+            self._discard(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+    
+    def _is_healthy(self, conn) -> bool:
+        """Verifica la connessione se inattiva da più di check_after secondi"""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+    
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        with self._lock:
+            self._discarded += 1
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception:
+            pass
+    
+    def closeall(self):
+        self._pool.closeall()
+    
+    def stats(self) -> Dict:
+        """Metriche di utilizzo e saturazione del pool"""
+        with self._lock:
+            return {
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'in_use': self._in_use,
+                'peak_in_use': self._peak_in_use,
+                'utilization': round(self._in_use / self.maxconn, 2),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'max_wait_ms': round(self._max_wait * 1000, 1)
+            }
+
+if HAS_PSYCOPG2:
+    class ProfiledCursor(psycopg2.extensions.cursor):
+        """Cursore psycopg2 che registra durata e righe di ogni istruzione in query_log"""
+        
+        def execute(self, query, vars=None):
+            with query_log.measure(query, self, lambda: self.plan(query, vars)):
+                return super().execute(query, vars)
+        
+        def executemany(self, query, vars_list):
+            with query_log.measure(query, self):
+                return super().executemany(query, vars_list)
+        
+        def copy_expert(self, sql, file, size=8192):
+            with query_log.measure(sql, self):
+                return super().copy_expert(sql, file, size)
+        
+        def plan(self, query, vars) -> Optional[str]:
+            """Piano della query sulla stessa connessione (tabelle temporanee e snapshot del chiamante)"""
+            explain = explain_statement(query, 'postgresql')
+            if explain is None:
+                return None
+            cursor = self.connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+            # Savepoint: un EXPLAIN fallito non interrompe la transazione del chiamante
+            savepoint = not self.connection.autocommit
+            try:
+                if savepoint:
+                    cursor.execute('SAVEPOINT query_log')
+                try:
+                    cursor.execute(explain, vars)
+                    return '\n'.join(row[0] for row in cursor.fetchall())
+                finally:
+                    if savepoint:
+                        cursor.execute('ROLLBACK TO SAVEPOINT query_log')
+            finally:
+                cursor.close()
+
+class PostgresBackend:
+    """PostgreSQL con pool di connessioni creato alla prima richiesta"""
+    
+    dialect = 'postgresql'
+    
+    def __init__(self, dsn: str):
+        if not HAS_PSYCOPG2:
+            raise Exception("psycopg2 non disponibile")
+        self.dsn = dsn
+        self.name = 'PostgreSQL'
+        self.sslmode = os.getenv('DB_SSLMODE', 'require')
+        self.pool = None
+        self._pool_lock = threading.Lock()
+    
+    def _get_pool(self) -> ConnectionPool:
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    self.pool = ConnectionPool(
+                        self.dsn,
+                        minconn=int(os.getenv('DB_POOL_MIN', 1)),
+                        maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+                        timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+                        check_after=float(os.getenv('DB_POOL_CHECK_AFTER', 30)),
+                        sslmode=self.sslmode,
+                        cursor_factory=ProfiledCursor
+                    )
+        return self.pool
+    
+    def getconn(self):
+        return self._get_pool().getconn()
+    
+    def putconn(self, conn, close: bool = False):
+        if self.pool is not None:
+            self.pool.putconn(conn, close=close)
+    
+    def dedicated(self):
+        """Connessione fuori dal pool per usi a lunga durata (LISTEN, migrazioni)"""
+        return psycopg2.connect(self.dsn, sslmode=self.sslmode, cursor_factory=ProfiledCursor)
+    
+    def stats(self) -> Dict:
+        return self.pool.stats() if self.pool is not None else {}
+    
+    def close(self):
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+
+# Traduzioni dall'SQL PostgreSQL usato dall'applicazione al dialetto SQLite (in ordine)
+REWRITES = [
+    (r'\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED)?', ''),
+    (r'\s+ON\s+COMMIT\s+DELETE\s+ROWS', ''),
+    (r'DEFAULT\s+CURRENT_TIMESTAMP', "DEFAULT (datetime('now', 'localtime'))"),
+    (r'CURRENT_TIMESTAMP\s*([+-])\s*make_interval\(\s*secs\s*=>\s*%s\s*\)',
+     r"datetime('now', 'localtime', '\1' || %s || ' seconds')"),
+    (r"CURRENT_TIMESTAMP\s*([+-])\s*%s\s*\*\s*INTERVAL\s*'1\s+(\w+?)s?'",
+     r"datetime('now', 'localtime', '\1' || %s || ' \2s')"),
+    (r"CURRENT_TIMESTAMP\s*([+-])\s*INTERVAL\s*'(\d+)\s+(\w+)'", r"datetime('now', 'localtime', '\1\2 \3')"),
+    (r'\b(CURRENT_TIMESTAMP|LOCALTIMESTAMP)\b', "datetime('now', 'localtime')"),
+    (r'=\s*ANY\(\s*ARRAY\[([^\]]*)\]\s*\)', r'IN (\1)'),
+    (r'=\s*ANY\(\s*%s\s*\)', 'IN (%L)'),
+    (r'::\w+(\[\])?', ''),
+    (r'\bUPDATE\s+(\w+)\s+(?!SET\b)(\w+)\s+SET\b', r'UPDATE \1 AS \2 SET'),
+]
+REWRITES = [(re.compile(pattern, re.IGNORECASE), replacement) for pattern, replacement in REWRITES]
+
+ADVISORY_LOCK = re.compile(r'\s*SELECT\s+pg_advisory_xact_lock\(', re.IGNORECASE)
+WRITE_KEYWORDS = re.compile(r'\b(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+FOR_UPDATE = re.compile(r'\bFOR\s+UPDATE\b', re.IGNORECASE)
+TEMP_ON_COMMIT = re.compile(
+    r'CREATE\s+TEMP(?:ORARY)?\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+).*ON\s+COMMIT\s+DELETE\s+ROWS',
+    re.IGNORECASE | re.DOTALL
+)
+
+class Statement:
+    """Istruzione tradotta per SQLite; bind() espande le liste passate a = ANY(%s)"""
+    
+    def __init__(self, sql: str):
+        match = re.match(r'\s*(\w+)', sql)
+        first = match.group(1).upper() if match else ''
+        if ADVISORY_LOCK.match(sql):
+            # Lock applicativo di transazione: su SQLite basta il lock di scrittura del database
+            self.kind = 'lock'
+        elif first in ('BEGIN', 'COMMIT', 'ROLLBACK', 'END', 'SAVEPOINT', 'RELEASE'):
+            self.kind = 'control'
+        elif FOR_UPDATE.search(sql):
+            self.kind = 'write'
+        elif first in ('SELECT', 'EXPLAIN', 'PRAGMA', 'VALUES') or (first == 'WITH' and not WRITE_KEYWORDS.search(sql)):
+            self.kind = 'read'
+        else:
+            self.kind = 'write'
+        
+        match = TEMP_ON_COMMIT.search(sql)
+        self.on_commit_delete = match.group(1) if match else None
+        
+        for pattern, replacement in REWRITES:
+            sql = pattern.sub(replacement, sql)
+        tokens = re.split(r'(%s|%L|%%)', sql)
+        self.parts, self.markers = [tokens[0]], []
+        for marker, text in zip(tokens[1::2], tokens[2::2]):
+            if marker == '%%':
+                self.parts[-1] += '%' + text
+            else:
+                self.markers.append(marker)
+                self.parts.append(text)
+        self.sql = '?'.join(self.parts)
+    
+    def bind(self, params) -> Tuple[str, tuple]:
+        params = tuple(params or ())
+        if '%L' not in self.markers:
+            return self.sql, params
+        sql, values = [self.parts[0]], []
+        for marker, value, text in zip(self.markers, params, self.parts[1:]):
+            if marker == '%L':
+                value = list(value)
+                sql.append(', '.join(['?'] * len(value)))
+                values.extend(value)
+            else:
+                sql.append('?')
+                values.append(value)
+            sql.append(text)
+        return ''.join(sql), tuple(values)
+
+@lru_cache(maxsize=512)
+def translate(sql: str) -> Statement:
+    return Statement(sql)
+
+def _convert(row: tuple) -> tuple:
+    return tuple(
+        datetime.fromisoformat(value) if isinstance(value, str) and TIMESTAMP.fullmatch(value) else value
+        for value in row
+    )
+
+class SQLiteCursor:
+    """Cursore con l'interfaccia psycopg2 usata dall'applicazione"""
+    
+    def __init__(self, connection: 'SQLiteConnection'):
+        self.connection = connection
+        self.itersize = 2000
+        self.rowcount = -1
+        self._cursor = None
+    
+    def execute(self, sql: str, params=None):
+        with query_log.measure(sql, self, lambda: self.plan(sql, params)):
+            self._execute(sql, params)
+    
+    def _execute(self, sql: str, params=None):
+        statement = translate(sql)
+        if statement.kind == 'lock':
+            self.connection.begin()
+            self._cursor, self.rowcount = None, -1
+            return
+        if statement.kind == 'write':
+            self.connection.begin()
+        if statement.on_commit_delete:
+            self.connection.on_commit_delete.add(statement.on_commit_delete)
+        self._cursor = self.connection.raw.execute(*statement.bind(params))
+        self.rowcount = self._cursor.rowcount
+    
+    def executemany(self, sql: str, seq_params):
+        statement = translate(sql)
+        with query_log.measure(sql, self):
+            self.connection.begin()
+            self._cursor = self.connection.raw.executemany(statement.sql, (tuple(p) for p in seq_params))
+            self.rowcount = self._cursor.rowcount
+    
+    def copy_expert(self, sql: str, file):
+        """COPY tabella (colonne) FROM STDIN in CSV: i campi vuoti diventano NULL come in PostgreSQL"""
+        match = re.match(r'\s*COPY\s+(\w+)\s*\(([^)]*)\)\s+FROM\s+STDIN', sql, re.IGNORECASE)
+        if not match:
+            raise Exception(f"COPY non supportato su SQLite: {sql}")
+        columns = [column.strip() for column in match.group(2).split(',')]
+        with query_log.measure(sql, self):
+            self.connection.begin()
+            self._cursor = self.connection.raw.executemany(
+                f"INSERT INTO {match.group(1)} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                ([value if value != '' else None for value in row] for row in csv.reader(file))
+            )
+            self.rowcount = self._cursor.rowcount
+    
+    def plan(self, sql: str, params=None) -> Optional[str]:
+        """EXPLAIN QUERY PLAN dell'istruzione tradotta (non la esegue)"""
+        statement = translate(sql)
+        if statement.kind not in ('read', 'write') or explain_statement(statement.sql, 'sqlite') is None:
+            return None
+        query, values = statement.bind(params)
+        rows = self.connection.raw.execute(explain_statement(query, 'sqlite'), values).fetchall()
+        return '\n'.join(row[-1] for row in rows)
+    
+    def fetchone(self):
+        row = self._cursor.fetchone() if self._cursor else None
+        return _convert(row) if row is not None else None
+    
+    def fetchmany(self, size: Optional[int] = None) -> List[tuple]:
+        if not self._cursor:
+            return []
+        return [_convert(row) for row in self._cursor.fetchmany(size or self.itersize)]
+    
+    def fetchall(self) -> List[tuple]:
+        return [_convert(row) for row in self._cursor.fetchall()] if self._cursor else []
+    
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield from rows
+    
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+class SQLiteConnection:
+    """Connessione SQLite con la semantica transazionale di psycopg2: commit/rollback espliciti"""
+    
+    def __init__(self, raw: sqlite3.Connection):
+        self.raw = raw
+        self.autocommit = False
+        self.closed = False
+        self.on_commit_delete = set()
+    
+    def cursor(self, name: Optional[str] = None) -> SQLiteCursor:
+        # Il cursore server-side di psycopg2 (name) qui non serve: sqlite3 legge già a blocchi
+        return SQLiteCursor(self)
+    
+    def begin(self):
+        """Transazione IMMEDIATE alla prima scrittura: le letture restano fuori transazione,
+        e una scrittura non fallisce con SQLITE_BUSY dopo aver letto uno snapshot vecchio"""
+        if not self.autocommit and not self.raw.in_transaction:
+            self.raw.execute('BEGIN IMMEDIATE')
+    
+    def commit(self):
+        if self.raw.in_transaction:
+            for table in self.on_commit_delete:
+                self.raw.execute(f'DELETE FROM {table}')
+            self.raw.execute('COMMIT')
+    
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute('ROLLBACK')
+    
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+            self.closed = True
+
+class SQLiteBackend:
+    """File SQLite in modalità WAL: letture concorrenti e una scrittura alla volta"""
+    
+    dialect = 'sqlite'
+    
+    def __init__(self, path: str, maxconn: int = 10, timeout: float = 30.0):
+        self.path = path
+        self.name = f'SQLite ({path})'
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._idle: List[SQLiteConnection] = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._max_wait = 0.0
+    
+    def dedicated(self) -> SQLiteConnection:
+        raw = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        raw.execute('PRAGMA journal_mode = WAL')
+        raw.execute('PRAGMA synchronous = NORMAL')
+        raw.execute('PRAGMA foreign_keys = ON')
+        return SQLiteConnection(raw)
+    
+    def getconn(self) -> SQLiteConnection:
+        """Connessione inattiva o nuova, attendendo se sono tutte in uso"""
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._timeouts += 1
+                raise Exception(f"Pool database saturo ({self.maxconn} connessioni in uso)")
+        
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            conn = conn or self.dedicated()
+        except Exception:
+            self._slots.release()
+            raise
+        
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._checkouts += 1
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+    
+    def putconn(self, conn: SQLiteConnection, close: bool = False):
+        try:
+            conn.rollback()
+            conn.autocommit = False
+            if close or conn.closed:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        except Exception as e:
+            logging.warning(f"Connessione scartata dal pool: {e}")
+            conn.close()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'min_size': 0,
+                'max_size': self.maxconn,
+                'in_use': self._in_use,
+                'peak_in_use': self._peak_in_use,
+                'utilization': round(self._in_use / self.maxconn, 2),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'discarded': 0,
+                'max_wait_ms': round(self._max_wait * 1000, 1)
+            }
+    
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+def create_backend(url: Optional[str]):
+    """sqlite:///percorso per SQLite, altrimenti PostgreSQL; senza DATABASE_URL SQLite solo se
+    SQLITE_PATH è impostato, altrimenti None (database non configurato)"""
+    if not url:
+        path = os.getenv('SQLITE_PATH')
+        if not path:
+            return None
+        logging.warning(f"DATABASE_URL non configurato: database SQLite locale {path}")
+    elif url.startswith('sqlite:'):
+        path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else ''
+        if not path:
+            raise ValueError(f"URL SQLite non valido (atteso sqlite:///percorso): {url}")
+    else:
+        return PostgresBackend(url)
+    return SQLiteBackend(
+        path,
+        maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 30))
+    )
@@ -0,0 +1,49 @@
+import os
+import sys
+
+# I moduli dell'agente stanno nella radice del repository, non in un pacchetto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contextlib import contextmanager
+
+import pytest
+
+from migrations import Migrator
+from storage import create_backend
+
+class SQLiteDatabase:
+    """DatabaseManager ridotto su un file SQLite temporaneo, con tutte le migrazioni applicate"""
+    
+    connected = True
+    dialect = 'sqlite'
+    
+    def __init__(self, path: str):
+        self.backend = create_backend(f'sqlite:///{path}')
+        Migrator(self).migrate()
+    
+    def open_dedicated_connection(self):
+        return self.backend.dedicated()
+    
+    @contextmanager
+    def connection(self):
+        conn = self.backend.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.backend.putconn(conn)
+    
+    def invalidate_stats(self):
+        pass
+    
+    def close(self):
+        self.backend.close()
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'etjca_test.db'))
+    yield db
+    db.close()
@@ -0,0 +1,89 @@
+"""Mesi delle partizioni di attivita, archiviazione e timeline su SQLite"""
+
+import gzip
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from activity_log import PARTITION, ActivityLog, month_start, partition_name
+
+@pytest.mark.parametrize('day, offset, atteso', [
+    (date(2026, 10, 17), 0, datetime(2026, 10, 1)),
+    (datetime(2026, 10, 31, 23, 59), 1, datetime(2026, 11, 1)),
+    (date(2026, 11, 30), 2, datetime(2027, 1, 1)),
+    (date(2026, 12, 1), 1, datetime(2027, 1, 1)),
+    (date(2026, 1, 15), -1, datetime(2025, 12, 1)),
+    (date(2026, 3, 31), -15, datetime(2024, 12, 1)),
+])
+def test_inizio_mese(day, offset, atteso):
+    assert month_start(day, offset) == atteso
+
+def test_nome_partizione():
+    assert partition_name(datetime(2026, 3, 1)) == 'attivita_2026_03'
+    assert PARTITION.match('attivita_2026_03').groups() == ('2026', '03')
+    # La partizione di default e le tabelle di supporto non sono mesi
+    for nome in ('attivita_default', 'attivita_ricerca', 'attivita_2026_03_old'):
+        assert PARTITION.match(nome) is None
+
+@pytest.fixture
+def registro(sqlite_db, tmp_path):
+    """Attività del prospect 1: due nel mese corrente, una cinque e una quattro mesi fa"""
+    oggi = month_start(date.today())
+    date_attivita = [
+        month_start(oggi, -5) + timedelta(days=3),
+        month_start(oggi, -4) + timedelta(days=10),
+        oggi + timedelta(hours=9),
+        oggi + timedelta(hours=11),
+    ]
+    with sqlite_db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO prospect (ragione_sociale) VALUES ('Meccanica Rossi')")
+        for n, data in enumerate(date_attivita, 1):
+            cursor.execute('''
+                INSERT INTO attivita (id_prospect, tipo, data, oggetto, descrizione)
+                VALUES (1, 'email', %s, %s, %s)
+            ''', (data, f'Contatto {n}', 'Riga con, virgole' if n == 1 else None))
+    return ActivityLog(sqlite_db, directory=str(tmp_path / 'archivio'))
+
+def conta(db) -> int:
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM attivita')
+        return cursor.fetchone()[0]
+
+def test_archiviazione_e_ripristino(registro):
+    with pytest.raises(ValueError):
+        registro.archive(0)
+    archiviati = registro.archive(3)
+    # Solo i mesi con attività diventano file; gli altri mesi vecchi sono saltati
+    assert [(a['mese'], a['righe']) for a in archiviati] == [
+        (month_start(date.today(), -5).strftime('%Y-%m'), 1),
+        (month_start(date.today(), -4).strftime('%Y-%m'), 1),
+    ]
+    assert conta(registro.db_manager) == 2
+    assert registro.archive(3) == []
+    
+    with gzip.open(archiviati[0]['file'], 'rt', encoding='utf-8') as handle:
+        assert handle.readline().strip() == 'id,id_prospect,tipo,data,oggetto,descrizione,esito'
+    assert registro.restore(archiviati[0]['file']) == 1
+    righe = registro.timeline(1, dal=month_start(date.today(), -6))
+    assert [r['id'] for r in righe] == [4, 3, 1]
+    # Stesso id, campi vuoti di nuovo NULL
+    assert righe[-1]['descrizione'] == 'Riga con, virgole' and righe[-1]['esito'] is None
+
+def test_archivio_non_valido(registro, tmp_path):
+    path = tmp_path / 'altro.csv.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as handle:
+        handle.write('id,oggetto\n1,x\n')
+    with pytest.raises(ValueError):
+        registro.restore(str(path))
+
+def test_timeline_paginata(registro):
+    prima = registro.timeline(1, limit=2)
+    assert [r['oggetto'] for r in prima] == ['Contatto 4', 'Contatto 3']
+    ultima = prima[-1]
+    seconda = registro.timeline(1, limit=2, after=(datetime.fromisoformat(ultima['data']), ultima['id']))
+    assert [r['oggetto'] for r in seconda] == ['Contatto 2', 'Contatto 1']
+    # Il periodo limita le righe lette
+    assert len(registro.timeline(1, dal=month_start(date.today()))) == 2
+    assert registro.timeline(1, al=month_start(date.today(), -12)) == []
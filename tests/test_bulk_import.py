@@ -0,0 +1,100 @@
+"""Lettura dei file, validazione delle righe e upsert dell'import massivo"""
+
+import io
+import json
+
+import pytest
+
+from bulk_import import IMPORT_COLUMNS, BulkImporter, detect_format, read_rows, validate_row
+
+def valid(**campi):
+    values, errore = validate_row(dict({'ragione_sociale': 'Meccanica Rossi S.r.l.'}, **campi))
+    assert errore is None
+    return dict(zip(IMPORT_COLUMNS, values))
+
+def test_riga_minima():
+    values = valid()
+    assert values['ragione_sociale'] == 'Meccanica Rossi S.r.l.'
+    # Celle vuote: NULL in staging, i default li mette l'upsert
+    assert values['settore'] is None and values['fatturato'] is None and values['priorita'] is None
+
+@pytest.mark.parametrize('valore, atteso', [
+    ('1.250.000,50 €', 1250000),
+    ('2.500', 2500),
+    ('1.5', 1),
+    ('1.000.000', 1000000),
+    (' 45 ', 45),
+    (120.7, 120),
+    ('', None),
+])
+def test_numeri_in_formato_italiano(valore, atteso):
+    assert valid(fatturato=valore)['fatturato'] == atteso
+
+def test_testo_ripulito_e_priorita_minuscola():
+    values = valid(settore='  Metalmeccanico ', priorita='ALTA', email_hr='hr@rossi.it')
+    assert values['settore'] == 'Metalmeccanico'
+    assert values['priorita'] == 'alta'
+    assert values['email_hr'] == 'hr@rossi.it'
+
+@pytest.mark.parametrize('campi, errore', [
+    ({'ragione_sociale': '  '}, 'Ragione sociale obbligatoria'),
+    ({'dipendenti': 'molti'}, 'Valore non numerico per dipendenti: molti'),
+    ({'fatturato': '-10'}, 'Valore negativo per fatturato'),
+    ({'email': 'rossi@'}, 'Indirizzo email non valido: rossi@'),
+    ({'email_hr': 'hr rossi@x.it'}, 'Indirizzo email_hr non valido: hr rossi@x.it'),
+    ({'priorita': 'massima'}, 'Priorità non valida: massima'),
+    ({'provincia': 'x' * 51}, 'provincia supera 50 caratteri'),
+])
+def test_righe_scartate(campi, errore):
+    row = dict({'ragione_sociale': 'Meccanica Rossi S.r.l.'}, **campi)
+    assert validate_row(row) == (None, errore)
+
+def test_riga_non_leggibile():
+    assert validate_row(None) == (None, 'Riga non leggibile')
+
+def test_detect_format():
+    assert detect_format('elenco.XLSX') == 'xlsx'
+    assert detect_format('lead.jsonl') == 'ndjson'
+    assert detect_format('', 'text/csv') == 'csv'
+    assert detect_format('elenco.pdf') is None
+
+def test_csv_con_punto_e_virgola_e_alias():
+    data = 'Denominazione;Addetti;PEC\r\nMeccanica Rossi;45;rossi@pec.it\r\n;;\r\nLogistica Bianchi;120;\r\n'
+    rows = list(read_rows(io.BytesIO(('\ufeff' + data).encode('utf-8')), 'csv'))
+    assert rows == [
+        (2, {'ragione_sociale': 'Meccanica Rossi', 'dipendenti': '45', 'email': 'rossi@pec.it'}),
+        (4, {'ragione_sociale': 'Logistica Bianchi', 'dipendenti': '120', 'email': ''}),
+    ]
+
+def test_csv_senza_ragione_sociale():
+    with pytest.raises(ValueError):
+        list(read_rows(io.BytesIO(b'nome,citta\nRossi,Torino\n'), 'csv'))
+
+def test_ndjson_righe_non_valide():
+    data = '\n'.join([json.dumps({'Ragione Sociale': 'Meccanica Rossi'}), '{rotto', '[1, 2]', ''])
+    assert list(read_rows(io.BytesIO(data.encode('utf-8')), 'ndjson')) == [
+        (1, {'ragione_sociale': 'Meccanica Rossi'}), (2, None), (3, None)
+    ]
+
+def test_upsert_su_sqlite(sqlite_db):
+    importer = BulkImporter(sqlite_db, chunk_size=2)
+    report = importer.run(iter([
+        (2, {'ragione_sociale': 'Meccanica Rossi', 'provincia': 'TO', 'dipendenti': '45'}),
+        (3, {'ragione_sociale': 'Logistica Bianchi', 'provincia': 'MI'}),
+        (4, {'ragione_sociale': '', 'provincia': 'MI'}),
+        # Stessa chiave della riga 2: vince l'ultima
+        (5, {'ragione_sociale': 'MECCANICA ROSSI', 'provincia': 'TO', 'dipendenti': '50'}),
+    ]))
+    assert report['righe_lette'] == 4
+    assert report['inserite'] == 2
+    assert report['scartate'] == 1
+    assert report['errori'][0]['riga'] == 4
+    
+    report = importer.run(iter([
+        (2, {'ragione_sociale': 'Meccanica Rossi', 'provincia': 'TO', 'sito_web': 'www.rossi.it'}),
+    ]))
+    assert (report['inserite'], report['aggiornate']) == (0, 1)
+    with sqlite_db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT dipendenti, sito_web FROM prospect WHERE provincia = 'TO'")
+        assert cursor.fetchall() == [(50, 'www.rossi.it')]
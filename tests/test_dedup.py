@@ -0,0 +1,126 @@
+"""Normalizzazione dei nomi, indice di trigrammi e aggiornamento incrementale dell'indice duplicati"""
+
+import pytest
+
+from dedup import (DuplicateDetector, DuplicateIndex, domains_of, email_domain, normalize_name,
+                   site_domain, trigrams)
+
+@pytest.mark.parametrize('nome, atteso', [
+    ('ACME S.p.A. - Udine', 'acme'),
+    ('Meccanica Rossi S.R.L.', 'meccanica rossi'),
+    ('Rossi & Figli snc', 'rossi e figli'),
+    ('Società Cooperativa Agricola Friulana Soc. Coop. a r.l.', 'agricola friulana'),
+    ('Caffè Città S.r.l.s.', 'caffe citta'),
+    ('S.p.A.', 's p a'),
+    (None, ''),
+])
+def test_normalize_name(nome, atteso):
+    assert normalize_name(nome) == atteso
+
+def test_domini():
+    assert site_domain('https://www.Etjca.it/contatti') == 'etjca.it'
+    assert site_domain('etjca') is None
+    assert email_domain('hr@etjca.it') == 'etjca.it'
+    # Webmail e PEC non identificano l'azienda
+    assert email_domain('mario.rossi@gmail.com') is None
+    assert email_domain('azienda@pec.it') is None
+    assert domains_of('www.etjca.it', ['info@etjca.it', 'x@libero.it', None]) == {'etjca.it'}
+
+def test_trigrammi_come_pg_trgm():
+    assert trigrams('ab') == {'  a', ' ab', 'ab '}
+
+@pytest.fixture
+def index():
+    index = DuplicateIndex(threshold=0.6)
+    index.add(1, 'Meccanica Rossi S.r.l.', info={'id': 1})
+    index.add(2, 'Logistica Bianchi S.p.A.', sito_web='https://www.bianchilog.it', info={'id': 2})
+    index.add(3, 'Fonderia 2000 S.r.l.', info={'id': 3})
+    index.add(4, 'Fonderia 3000 S.r.l.', info={'id': 4})
+    return index
+
+def test_match_per_nome(index):
+    assert index.match('MECCANICA ROSSI SPA - Torino') == [(1, 1.0, 'nome')]
+    key, score, motivo = index.match('Meccanica Rosi')[0]
+    assert key == 1 and 0.6 <= score < 1 and motivo == 'nome'
+    assert index.match('Tessile Neri') == []
+
+def test_match_per_dominio(index):
+    assert index.match('Nome diverso', emails=['hr@bianchilog.it']) == [(2, 1.0, 'dominio')]
+
+def test_numeri_nel_nome_distinguono_le_aziende(index):
+    assert [key for key, _, _ in index.match('Fonderia 2000')] == [3]
+    assert [key for key, _, _ in index.match('Fonderia 3000 Srl')] == [4]
+
+def test_add_sostituisce_e_remove_toglie(index):
+    index.add(1, 'Tessile Neri', info={'id': 1})
+    assert index.match('Meccanica Rossi') == []
+    assert [key for key, _, _ in index.match('Tessile Neri')] == [1]
+    
+    index.remove(2)
+    index.remove(99)
+    assert len(index) == 3
+    assert index.match('Nome diverso', sito_web='bianchilog.it') == []
+    assert all(2 not in keys for keys in index.postings.values())
+
+def test_match_entry_esclude_se_stesso(index):
+    index.add(5, 'Meccanica Rossi Srl', info={'id': 5})
+    assert [key for key, _, _ in index.match_entry(1)] == [5]
+
+def insert(db, ragione_sociale, **campi):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        colonne = ['ragione_sociale'] + list(campi)
+        cursor.execute(
+            f"INSERT INTO prospect ({', '.join(colonne)}) VALUES ({', '.join(['%s'] * len(colonne))}) RETURNING id",
+            [ragione_sociale] + list(campi.values())
+        )
+        return cursor.fetchone()[0]
+
+def update(db, prospect_id, **campi):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE prospect SET {', '.join(f'{campo} = %s' for campo in campi)} WHERE id = %s",
+            list(campi.values()) + [prospect_id]
+        )
+
+def test_refresh_nuovi_e_modificati(sqlite_db):
+    rossi = insert(sqlite_db, 'Meccanica Rossi S.r.l.', provincia='TO')
+    detector = DuplicateDetector(sqlite_db, refresh_interval=0)
+    detector.refresh()
+    assert detector.last_id == rossi
+    
+    # Nuovo prospect (id) e prospect esistente con nome e sito cambiati (aggiornato_il)
+    insert(sqlite_db, 'Logistica Bianchi S.p.A.')
+    update(sqlite_db, rossi, ragione_sociale='Tessile Neri S.r.l.', sito_web='www.tessileneri.it')
+    
+    assert [c['id'] for c in detector.find('Tessile Neri')] == [rossi]
+    assert detector.find('Meccanica Rossi') == []
+    assert [c['id'] for c in detector.find('Altro nome', sito_web='https://tessileneri.it')] == [rossi]
+    assert len(detector.find('Logistica Bianchi')) == 1
+
+def test_refresh_modifiche_a_intervalli(sqlite_db):
+    rossi = insert(sqlite_db, 'Meccanica Rossi S.r.l.')
+    detector = DuplicateDetector(sqlite_db, refresh_interval=3600)
+    detector.refresh()
+    
+    update(sqlite_db, rossi, ragione_sociale='Tessile Neri S.r.l.')
+    nuovo = insert(sqlite_db, 'Logistica Bianchi S.p.A.')
+    # I nuovi id a ogni controllo, le modifiche solo alla scadenza dell'intervallo
+    assert [c['id'] for c in detector.find('Logistica Bianchi')] == [nuovo]
+    assert detector.find('Tessile Neri') == []
+    
+    detector._next_scan = 0.0
+    assert [c['id'] for c in detector.find('Tessile Neri')] == [rossi]
+
+def test_merge_toglie_i_duplicati_dall_indice(sqlite_db):
+    principale = insert(sqlite_db, 'Meccanica Rossi S.r.l.', provincia='TO')
+    duplicato = insert(sqlite_db, 'Meccanica Rossi', provincia='TO', sito_web='www.meccanicarossi.it')
+    detector = DuplicateDetector(sqlite_db, refresh_interval=3600)
+    assert {c['id'] for c in detector.find('Meccanica Rossi')} == {principale, duplicato}
+    
+    risultato = detector.merge(principale, [duplicato])
+    
+    assert risultato['uniti'] == [duplicato]
+    # Il sito del duplicato passa al principale, reindicizzato senza attendere l'intervallo
+    assert [c['id'] for c in detector.find('Altro', sito_web='meccanicarossi.it')] == [principale]
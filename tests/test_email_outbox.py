@@ -0,0 +1,144 @@
+"""Classificazione degli errori SMTP e interruzione del blocco su errori di sessione"""
+
+import socket
+import smtplib
+import contextlib
+
+import pytest
+
+from email_outbox import OutboxDispatcher, SessionBackoff, is_session_error, is_transient
+
+@pytest.mark.parametrize('error, atteso', [
+    (smtplib.SMTPResponseException(451, b'Riprovare piu tardi'), True),
+    (smtplib.SMTPResponseException(554, b'Messaggio rifiutato'), False),
+    (smtplib.SMTPSenderRefused(421, b'Troppe connessioni', 'etjca@etjca.it'), True),
+    (smtplib.SMTPDataError(552, b'Messaggio troppo grande'), False),
+    (smtplib.SMTPRecipientsRefused({'a@x.it': (450, b'Casella occupata'), 'b@x.it': (451, b'Riprovare')}), True),
+    (smtplib.SMTPRecipientsRefused({'a@x.it': (450, b'Casella occupata'), 'b@x.it': (550, b'Inesistente')}), False),
+    (smtplib.SMTPAuthenticationError(535, b'Credenziali errate'), False),
+    (smtplib.SMTPServerDisconnected('Connessione chiusa'), True),
+    (ConnectionResetError(), True),
+    (TimeoutError(), True),
+    (ValueError('Indirizzo non valido'), False),
+])
+def test_is_transient(error, atteso):
+    assert is_transient(error) is atteso
+
+@pytest.mark.parametrize('error, atteso', [
+    (smtplib.SMTPAuthenticationError(535, b'Credenziali errate'), True),
+    (smtplib.SMTPConnectError(421, b'Servizio non disponibile'), True),
+    (smtplib.SMTPServerDisconnected('Connessione chiusa'), True),
+    (ConnectionRefusedError(), True),
+    (TimeoutError(), True),
+    (socket.gaierror(-2, 'Name or service not known'), True),
+    (smtplib.SMTPResponseException(451, b'Riprovare piu tardi'), False),
+    (smtplib.SMTPRecipientsRefused({'a@x.it': (550, b'Inesistente')}), False),
+    (ValueError('Indirizzo non valido'), False),
+])
+def test_is_session_error(error, atteso):
+    assert is_session_error(error) is atteso
+
+class FakeOutbox:
+    def __init__(self, count):
+        self.messages = [
+            {'id': i, 'id_prospect': None, 'destinatario': f'hr{i}@x.it', 'oggetto': 'Oggetto',
+             'corpo': 'Corpo', 'tipo': 'email', 'tentativi': 0}
+            for i in range(1, count + 1)
+        ]
+        self.inviati, self.falliti, self.rilasciati = [], [], []
+        self.session_backoff = SessionBackoff(60, 3600)
+        self.claims = 0
+    
+    def claim(self, worker, limit):
+        self.claims += 1
+        return self.messages[:limit]
+    
+    def mark_sent(self, message, worker):
+        self.inviati.append(message['id'])
+    
+    def mark_failed(self, message, worker, error):
+        self.falliti.append(message['id'])
+    
+    def release(self, messages, worker, error=None):
+        self.rilasciati.append(([m['id'] for m in messages], error))
+
+class FakeEmailManager:
+    """Sessione SMTP finta: errors[n] viene sollevato all'n-esimo invio"""
+    
+    def __init__(self, errors):
+        self.errors = errors
+        self.invii = 0
+        self.rate_limiter = type('RateLimiter', (), {'acquire': lambda self: None})()
+    
+    @contextlib.contextmanager
+    def smtp_session(self):
+        yield self
+    
+    def send(self, msg):
+        self.invii += 1
+        if self.invii in self.errors:
+            raise self.errors[self.invii]
+    
+    def build_mime(self, *args, **kwargs):
+        return object()
+
+def test_errori_del_messaggio_consumano_un_tentativo():
+    outbox = FakeOutbox(3)
+    dispatcher = OutboxDispatcher(outbox, FakeEmailManager({2: smtplib.SMTPDataError(552, b'Troppo grande')}))
+    
+    assert dispatcher.dispatch_batch() == 3
+    assert outbox.inviati == [1, 3]
+    assert outbox.falliti == [2]
+    assert outbox.rilasciati == [([], None)]
+
+def test_errore_di_autenticazione_interrompe_il_blocco():
+    outbox = FakeOutbox(4)
+    errore = smtplib.SMTPAuthenticationError(535, b'Credenziali errate')
+    dispatcher = OutboxDispatcher(outbox, FakeEmailManager({2: errore}))
+    
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        dispatcher.dispatch_batch()
+    # Il messaggio interrotto e i successivi tornano in coda senza tentativi consumati
+    assert outbox.inviati == [1]
+    assert outbox.falliti == []
+    assert outbox.rilasciati == [([2, 3, 4], errore)]
+
+def test_connessione_fallita_rilascia_tutto():
+    outbox = FakeOutbox(2)
+    dispatcher = OutboxDispatcher(outbox, FakeEmailManager({1: ConnectionRefusedError()}))
+    
+    with pytest.raises(ConnectionRefusedError):
+        dispatcher.dispatch_batch()
+    assert outbox.inviati == [] and outbox.falliti == []
+    assert outbox.rilasciati[0][0] == [1, 2]
+
+def test_errore_di_sessione_sospende_gli_invii(monkeypatch):
+    adesso = [1000.0]
+    monkeypatch.setattr('email_outbox.time.monotonic', lambda: adesso[0])
+    outbox = FakeOutbox(2)
+    email_manager = FakeEmailManager({1: smtplib.SMTPAuthenticationError(535, b'Credenziali errate')})
+    dispatcher = OutboxDispatcher(outbox, email_manager)
+    altro = OutboxDispatcher(outbox, email_manager)
+    
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        dispatcher.dispatch_batch()
+    # Nessun dispatcher del processo riprova il login durante la pausa
+    assert outbox.session_backoff.remaining() == 60
+    assert dispatcher.dispatch_batch() == 0 and altro.dispatch_batch() == 0
+    assert outbox.claims == 1 and email_manager.invii == 1
+    
+    adesso[0] += 60
+    email_manager.errors = {2: smtplib.SMTPAuthenticationError(535, b'Credenziali errate')}
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        dispatcher.dispatch_batch()
+    assert outbox.session_backoff.remaining() == 120
+    
+    # Il primo invio riuscito azzera la pausa
+    adesso[0] += 120
+    email_manager.errors = {}
+    assert dispatcher.dispatch_batch() == 2
+    assert outbox.session_backoff.remaining() == 0 and outbox.session_backoff.errori == 0
+
+def test_pausa_massima():
+    backoff = SessionBackoff(60, 300)
+    assert [backoff.failed() for _ in range(5)] == [60, 120, 240, 300, 300]
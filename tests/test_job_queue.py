@@ -0,0 +1,87 @@
+"""Claim, fallimenti e ripresa dei job su SQLite"""
+
+import pytest
+
+from job_queue import JobLostError, JobQueue, JobWorker
+
+@pytest.fixture
+def coda(sqlite_db):
+    return JobQueue(sqlite_db, max_tentativi=2)
+
+def scaduto(db, job_id: int):
+    """Ultimo heartbeat di dieci minuti fa"""
+    with db.connection() as conn:
+        conn.cursor().execute('''
+            UPDATE job_queue SET aggiornato_il = CURRENT_TIMESTAMP - INTERVAL '600 seconds' WHERE id = %s
+        ''', (job_id,))
+
+def test_claim_e_completamento(coda):
+    job_id = coda.enqueue('punteggio_lead', {'completo': True}, totale=10)
+    job = coda.claim('a')
+    assert (job['id'], job['stato'], job['worker'], job['tentativi']) == (job_id, 'in_esecuzione', 'a', 1)
+    assert job['payload'] == {'completo': True}
+    assert coda.claim('b') is None
+    
+    coda.set_progress(job_id, 'a', 4, 1)
+    assert coda.get_status(job_id)['processati'] == 5
+    # Un altro worker non può chiudere il job né aggiornarne l'avanzamento
+    assert not coda.complete(job_id, 'b', {'esito': 'b'})
+    with pytest.raises(JobLostError):
+        coda.set_progress(job_id, 'b', 9, 0)
+    assert coda.complete(job_id, 'a', {'esito': 'a'})
+    status = coda.get_status(job_id)
+    assert (status['stato'], status['risultato']) == ('completato', {'esito': 'a'})
+
+def test_fallimento_dopo_max_tentativi(coda):
+    job_id = coda.enqueue('cluster_duplicati', {})
+    coda.fail(coda.claim('a')['id'], 'a', 'primo errore')
+    assert coda.get_status(job_id)['stato'] == 'in_coda'
+    coda.fail(coda.claim('a')['id'], 'a', 'secondo errore')
+    status = coda.get_status(job_id)
+    assert (status['stato'], status['errore']) == ('fallito', 'secondo errore')
+    assert status['completato_il'] is not None
+    assert coda.claim('a') is None
+
+def test_job_scaduto_ripreso_e_poi_fallito(coda, sqlite_db):
+    job_id = coda.enqueue('manutenzione_attivita', {})
+    coda.claim('a')
+    assert coda.requeue_stale(300) == 0
+    scaduto(sqlite_db, job_id)
+    assert coda.requeue_stale(300) == 1
+    assert coda.get_status(job_id)['stato'] == 'in_coda'
+    
+    coda.claim('b')
+    # La prima esecuzione è ancora viva: si ferma al primo heartbeat e non sovrascrive il risultato
+    with pytest.raises(JobLostError):
+        coda.heartbeat(job_id, 'a')
+    assert not coda.complete(job_id, 'a', {'esito': 'a'})
+    coda.fail(job_id, 'a', 'errore della prima esecuzione')
+    assert coda.get_status(job_id)['stato'] == 'in_esecuzione'
+    
+    # Secondo timeout: tentativi esauriti, il job non viene ripreso all'infinito
+    scaduto(sqlite_db, job_id)
+    assert coda.requeue_stale(300) == 1
+    status = coda.get_status(job_id)
+    assert status['stato'] == 'fallito' and 'senza heartbeat' in status['errore']
+    assert coda.claim('c') is None
+
+def test_worker(coda):
+    esecuzioni = []
+    
+    def handler(job, queue):
+        esecuzioni.append(job['id'])
+        if len(esecuzioni) == 1:
+            raise RuntimeError('errore temporaneo')
+        queue.set_progress(job['id'], job['worker'], 1, 0, totale=1)
+        return {'ok': True}
+    
+    coda.register('punteggio_lead', handler)
+    job_id = coda.enqueue('punteggio_lead', {})
+    altro = coda.enqueue('sconosciuto', {})
+    worker = JobWorker(coda, poll_interval=0.01)
+    while worker.run_once():
+        pass
+    assert esecuzioni == [job_id, job_id]
+    assert coda.get_status(job_id)['risultato'] == {'ok': True}
+    assert coda.get_status(altro)['errore'] == 'Nessun handler per il tipo sconosciuto'
+    assert coda.stats() == {'completato': 1, 'fallito': 1}
@@ -0,0 +1,53 @@
+"""Ciclo della pipeline sui file della cartella di arrivo (SQLite)"""
+
+import os
+
+import pytest
+
+from dedup import DuplicateDetector
+from lead_pipeline import LeadPipeline
+
+class PipelineConGuasto(LeadPipeline):
+    """Salvataggio che fallisce per i lead del file guasto.csv"""
+    
+    def persist(self, leads):
+        if any(lead['fonte'] == 'guasto' for lead in leads):
+            raise ConnectionError('connessione al database persa')
+        yield from super().persist(leads)
+
+def scrivi(path, *aziende):
+    with open(path, 'w', encoding='utf-8') as handle:
+        handle.write('ragione_sociale,provincia,settore\n')
+        for nome, provincia in aziende:
+            handle.write(f'{nome},{provincia},Metalmeccanico\n')
+
+@pytest.fixture
+def inbox(sqlite_db, tmp_path, monkeypatch):
+    sqlite_db.duplicates = DuplicateDetector(sqlite_db)
+    monkeypatch.setenv('LEAD_INBOX_DIR', str(tmp_path / 'arrivo'))
+    os.makedirs(tmp_path / 'arrivo')
+    scrivi(tmp_path / 'arrivo' / 'buono.csv', ('Meccanica Rossi', 'Udine'), ('Fonderia Bianchi', 'Brescia'))
+    scrivi(tmp_path / 'arrivo' / 'guasto.csv', ('Carpenteria Verdi', 'Torino'))
+    return tmp_path / 'arrivo'
+
+def prospect(db):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT ragione_sociale FROM prospect ORDER BY ragione_sociale')
+        return [row[0] for row in cursor.fetchall()]
+
+def test_salvataggio_fallito_lascia_il_file_in_arrivo(sqlite_db, inbox):
+    report = PipelineConGuasto(sqlite_db).run()
+    assert report['inserite'] == 2
+    assert report['sorgenti_fallite'] == [str(inbox / 'guasto.csv')]
+    assert prospect(sqlite_db) == ['Fonderia Bianchi', 'Meccanica Rossi']
+    salvataggio = next(stage for stage in report['stadi'] if stage['stadio'] == 'salvataggio')
+    assert salvataggio['errori'] == 1
+    # Solo il file salvato va negli elaborati; l'altro viene riletto al ciclo successivo
+    assert sorted(os.listdir(inbox)) == ['elaborati', 'guasto.csv']
+    assert [nome.split('_', 2)[2] for nome in os.listdir(inbox / 'elaborati')] == ['buono.csv']
+    
+    report = LeadPipeline(sqlite_db).run()
+    assert report['inserite'] == 1 and report['sorgenti_fallite'] == []
+    assert os.listdir(inbox) == ['elaborati']
+    assert prospect(sqlite_db) == ['Carpenteria Verdi', 'Fonderia Bianchi', 'Meccanica Rossi']
@@ -0,0 +1,72 @@
+"""Listener degli eventi live su SQLite: notifiche ai client e chiusura dopo l'ultimo"""
+
+import time
+
+import pytest
+
+import live_events
+from live_events import LiveEventHub
+
+class Database:
+    """sqlite_db con le statistiche della dashboard e le connessioni dedicate aperte"""
+    
+    def __init__(self, db):
+        self.db = db
+        self.dialect = db.dialect
+        self.aperte = []
+    
+    def open_dedicated_connection(self):
+        conn = self.db.open_dedicated_connection()
+        self.aperte.append(conn)
+        return conn
+    
+    def invalidate_stats(self):
+        pass
+    
+    def get_stats(self):
+        return {'totale_prospect': 1}
+
+@pytest.fixture
+def hub(sqlite_db, monkeypatch):
+    monkeypatch.setattr(live_events, 'POLL_INTERVAL', 0.02)
+    hub = LiveEventHub(Database(sqlite_db), debounce=0.02, max_subscribers=2)
+    yield hub
+    thread = hub._thread
+    for client in list(hub._subscribers):
+        hub.unsubscribe(client)
+    if thread is not None:
+        thread.join(timeout=5)
+
+def aspetta(condizione, timeout=5.0):
+    fine = time.monotonic() + timeout
+    while not condizione():
+        assert time.monotonic() < fine, 'timeout'
+        time.sleep(0.01)
+
+def test_eventi_e_arresto_dopo_ultimo_client(hub, sqlite_db):
+    client = hub.subscribe()
+    thread = hub._thread
+    aspetta(lambda: hub.db_manager.aperte)
+    # Il listener parte dall'ultimo evento già registrato
+    time.sleep(0.1)
+    with sqlite_db.connection() as conn:
+        conn.cursor().execute("INSERT INTO prospect (ragione_sociale) VALUES ('Meccanica Rossi')")
+    
+    frames = [client.get(timeout=5), client.get(timeout=5)]
+    assert frames[0].startswith('event: stats\n')
+    assert frames[1] == 'event: log\ndata: {"message": "Nuovo prospect: Meccanica Rossi"}\n\n'
+    
+    hub.unsubscribe(client)
+    thread.join(timeout=5)
+    assert not thread.is_alive() and hub._thread is None
+    assert all(conn.closed for conn in hub.db_manager.aperte)
+    
+    # Un nuovo client riapre il listener
+    hub.subscribe()
+    aspetta(lambda: len(hub.db_manager.aperte) == 2)
+    assert hub._thread is not thread and hub._thread.is_alive()
+
+def test_limite_client(hub):
+    assert hub.subscribe() is not None and hub.subscribe() is not None
+    assert hub.subscribe() is None
+    assert hub.subscribers == 2
@@ -0,0 +1,23 @@
+"""Riga di comando delle migrazioni su un database SQLite nuovo"""
+
+from migrations import main
+
+def test_stato_senza_applicare(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'nuovo.db'}")
+    assert main(['--stato']) == 0
+    righe = capsys.readouterr().out.splitlines()
+    assert righe and all(riga.endswith('da applicare') for riga in righe)
+    # --stato non ha applicato nulla: le versioni restano tutte da applicare
+    assert main(['--stato']) == 0
+    assert capsys.readouterr().out.splitlines() == righe
+    
+    assert main([]) == 0
+    assert 'Migrazioni applicate: [1, 2' in capsys.readouterr().out
+    assert main(['--stato']) == 0
+    assert not any(riga.endswith('da applicare') for riga in capsys.readouterr().out.splitlines())
+
+def test_database_non_configurato(monkeypatch, capsys):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.delenv('SQLITE_PATH', raising=False)
+    assert main(['--stato']) == 1
+    assert 'DATABASE_URL mancante' in capsys.readouterr().out
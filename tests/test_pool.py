@@ -0,0 +1,104 @@
+"""Pool PostgreSQL: saturazione, connessioni non più valide e rollback alla restituzione"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+import psycopg2.extensions
+import psycopg2.pool
+
+from storage import ConnectionPool
+
+class Connessione:
+    """Connessione finta: guasta se il server l'ha chiusa senza che il client se ne accorga"""
+    
+    def __init__(self, n):
+        self.n = n
+        self.closed = 0
+        self.guasta = False
+        self.rollback_eseguiti = 0
+        self.info = SimpleNamespace(transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+    
+    def cursor(self):
+        conn = self
+        
+        class Cursore:
+            def execute(self, sql):
+                if conn.guasta:
+                    raise psycopg2.OperationalError('server closed the connection unexpectedly')
+            
+            def close(self):
+                pass
+        return Cursore()
+    
+    def rollback(self):
+        self.rollback_eseguiti += 1
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+class PoolFinto:
+    """ThreadedConnectionPool senza server: connessioni numerate, riusate dalla più recente"""
+    
+    def __init__(self, minconn, maxconn, dsn, **kwargs):
+        self.libere, self.aperte = [], 0
+    
+    def getconn(self):
+        if self.libere:
+            return self.libere.pop()
+        self.aperte += 1
+        return Connessione(self.aperte)
+    
+    def putconn(self, conn, close=False):
+        if close:
+            conn.closed = 1
+        else:
+            self.libere.append(conn)
+    
+    def closeall(self):
+        pass
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(psycopg2.pool, 'ThreadedConnectionPool', PoolFinto)
+    return ConnectionPool('dbname=etjca', maxconn=2, timeout=0.05, check_after=30)
+
+def test_pool_saturo(pool):
+    a, b = pool.getconn(), pool.getconn()
+    with pytest.raises(Exception, match='Pool database saturo'):
+        pool.getconn()
+    stats = pool.stats()
+    assert (stats['in_use'], stats['utilization'], stats['waits'], stats['timeouts']) == (2, 1.0, 1, 1)
+    
+    # Un thread in attesa riceve la connessione appena restituita
+    ricevuta = []
+    pool.timeout = 5
+    attesa = threading.Thread(target=lambda: ricevuta.append(pool.getconn()))
+    attesa.start()
+    pool.putconn(a)
+    attesa.join(timeout=5)
+    assert ricevuta == [a]
+    assert pool.stats()['peak_in_use'] == 2 and pool.stats()['checkouts'] == 3
+
+def test_transazione_aperta_annullata(pool):
+    conn = pool.getconn()
+    prima = conn.rollback_eseguiti
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+    pool.putconn(conn)
+    assert conn.rollback_eseguiti == prima + 1
+    assert pool.getconn() is conn
+
+def test_connessioni_non_valide_sostituite(pool):
+    conn = pool.getconn()
+    pool.putconn(conn)
+    # Usata da poco: nessun controllo, anche se nel frattempo è caduta
+    conn.guasta = True
+    assert pool.getconn() is conn
+    pool.putconn(conn)
+    
+    # Inattiva da più di check_after secondi: SELECT 1 fallisce e la connessione viene scartata
+    pool.check_after = 0
+    nuova = pool.getconn()
+    assert nuova is not conn and conn.closed
+    pool.putconn(nuova, close=True)
+    assert nuova.closed and pool.stats()['discarded'] == 2 and pool.stats()['in_use'] == 0
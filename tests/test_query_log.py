@@ -0,0 +1,88 @@
+"""Impronte delle istruzioni, query lente e unione dei profili salvati dai processi"""
+
+import json
+import os
+
+import pytest
+
+import query_log
+from query_log import QueryLog, explain_statement, fingerprint
+
+@pytest.mark.parametrize('sql, atteso', [
+    ("SELECT * FROM prospect WHERE id = 42 AND stato = 'nuovo'", 'SELECT * FROM prospect WHERE id = ? AND stato = ?'),
+    ('SELECT *\n  FROM prospect -- commento\n WHERE id = %s', 'SELECT * FROM prospect WHERE id = ?'),
+    ('SELECT /* lista */ * FROM p WHERE id IN (?, ?, ?)', 'SELECT * FROM p WHERE id IN (...)'),
+    ("UPDATE p SET note = 'l''uno' WHERE id = ANY(%L)", 'UPDATE p SET note = ? WHERE id = ANY(?)'),
+    (b'SELECT 1', 'SELECT ?'),
+])
+def test_impronta(sql, atteso):
+    assert fingerprint(sql) == atteso
+
+@pytest.mark.parametrize('sql, dialect, atteso', [
+    ('SELECT 1', 'postgresql', 'EXPLAIN (ANALYZE, BUFFERS) SELECT 1'),
+    # Istruzioni con effetti: piano senza eseguirle di nuovo
+    ('DELETE FROM p', 'postgresql', 'EXPLAIN DELETE FROM p'),
+    ('SELECT id FROM job_queue FOR UPDATE SKIP LOCKED', 'postgresql',
+     'EXPLAIN SELECT id FROM job_queue FOR UPDATE SKIP LOCKED'),
+    ("SELECT pg_advisory_xact_lock(1)", 'postgresql', 'EXPLAIN SELECT pg_advisory_xact_lock(1)'),
+    ('DELETE FROM p', 'sqlite', 'EXPLAIN QUERY PLAN DELETE FROM p'),
+    ('BEGIN', 'postgresql', None),
+    ('CREATE INDEX i ON p(id)', 'sqlite', None),
+])
+def test_explain(sql, dialect, atteso):
+    assert explain_statement(sql, dialect) == atteso
+
+def test_query_lente_e_piano():
+    log = QueryLog(threshold_ms=100, explain=True)
+    piani = []
+    
+    def piano():
+        piani.append(1)
+        return 'Seq Scan on prospect'
+    
+    log.record('SELECT * FROM prospect WHERE id = 1', 0.01, rows=1, plan=piano)
+    log.record('SELECT * FROM prospect WHERE id = 2', 0.3, rows=1, plan=piano)
+    # Un solo EXPLAIN per impronta ogni EXPLAIN_INTERVAL secondi
+    log.record('SELECT * FROM prospect WHERE id = 3', 0.2, rows=0, plan=piano)
+    entry = log.snapshot()['SELECT * FROM prospect WHERE id = ?']
+    assert (entry['chiamate'], entry['lente'], entry['righe']) == (3, 2, 2)
+    assert entry['massimo'] == 0.3 and entry['totale'] == pytest.approx(0.51)
+    assert entry['piano'] == 'Seq Scan on prospect' and len(piani) == 1
+
+def test_istruzione_fallita_non_registrata():
+    log = QueryLog()
+    with pytest.raises(RuntimeError):
+        with log.measure('SELECT 1', None):
+            raise RuntimeError('errore di sintassi')
+    assert log.snapshot() == {}
+
+def test_impronte_massime(monkeypatch):
+    monkeypatch.setattr(query_log, 'MAX_FINGERPRINTS', 2)
+    log = QueryLog()
+    log.record('SELECT a FROM t', 0.5)
+    log.record('SELECT b FROM t', 0.1)
+    log.record('SELECT c FROM t', 0.2)
+    # Scartata l'impronta con meno tempo totale
+    assert sorted(log.snapshot()) == ['SELECT a FROM t', 'SELECT c FROM t']
+
+def test_profili_salvati_dagli_altri_processi(tmp_path):
+    log = QueryLog()
+    log.record('SELECT * FROM prospect', 0.2, rows=10)
+    altro = {'SELECT * FROM prospect': {'chiamate': 3, 'totale': 0.9, 'massimo': 0.6, 'righe': 5,
+                                        'lente': 1, 'piano': 'Index Scan', 'piano_il': 100.0}}
+    # Un processo ancora vivo (il padre di pytest) con il suo file
+    with open(tmp_path / f'query_log_{os.getppid()}.json', 'w', encoding='utf-8') as handle:
+        json.dump(altro, handle)
+    # Il file del processo corrente non si somma due volte
+    log.save(str(tmp_path))
+    
+    top = log.top(directory=str(tmp_path))
+    assert len(top) == 1
+    assert (top[0]['chiamate'], top[0]['totale_ms'], top[0]['massimo_ms'], top[0]['righe']) == (4, 1100.0, 600.0, 15)
+    assert top[0]['piano'] == 'Index Scan'
+    with pytest.raises(ValueError):
+        log.top(order='righe')
+    
+    (tmp_path / 'metriche_1.json').write_text('{}')
+    assert QueryLog.clear_saved(str(tmp_path)) == 2
+    assert os.listdir(tmp_path) == ['metriche_1.json']
@@ -0,0 +1,87 @@
+"""Punteggio dei prospect calcolato a colonne (score_frame)"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+from scoring import COLUMNS, score_frame
+
+NOW = datetime(2026, 10, 1, 12, 0)
+
+def score(*rows):
+    frame = pd.DataFrame.from_records(
+        [dict({column: None for column in COLUMNS}, id=n, **row) for n, row in enumerate(rows, start=1)],
+        columns=COLUMNS
+    )
+    punteggio, priorita = score_frame(frame, NOW)
+    return [(int(p), str(q)) for p, q in zip(punteggio, priorita)]
+
+def test_prospect_ideale():
+    assert score({
+        'fatturato': 4_000_000, 'settore': 'Metalmeccanico', 'provincia': 'Udine',
+        'ultima': NOW, 'stato': 'cliente_acquisito', 'email': 2, 'fallite': 0
+    }) == [(100, 'alta')]
+
+def test_prospect_senza_dati():
+    assert score({}) == [(0, 'bassa')]
+
+def test_dimensione_da_fatturato_o_dipendenti():
+    # Vale la maggiore delle due, piena al doppio della soglia (4 milioni o 100 dipendenti)
+    assert score({'fatturato': 1_000_000}, {'dipendenti': 60}, {'fatturato': 'n.d.', 'dipendenti': 200}) == [
+        (9, 'bassa'), (21, 'bassa'), (35, 'media')
+    ]
+
+def test_settore_e_territorio():
+    assert score(
+        {'settore': 'Edilizia e costruzioni'},
+        {'provincia': ' UD '},
+        {'settore': 'Commercio', 'provincia': 'Milano'},
+    ) == [(25, 'media'), (10, 'bassa'), (0, 'bassa')]
+
+def test_recenza_con_emivita():
+    assert score(
+        {'ultima': NOW - timedelta(days=60)},
+        {'ultima': NOW - timedelta(days=30)},
+        # Date future (orologi diversi) valgono come adesso
+        {'ultima': NOW + timedelta(days=1)},
+    ) == [(4, 'bassa'), (8, 'bassa'), (15, 'bassa')]
+
+def test_risposta_e_penalita():
+    assert score(
+        {'dipendenti': 60, 'stato': 'interessato'},
+        # Tre solleciti senza risposta
+        {'dipendenti': 60, 'stato': 'contattato', 'email': 3},
+        # Indirizzo che rimbalza senza nessun invio riuscito
+        {'dipendenti': 90, 'fallite': 1, 'email': 0},
+        {'stato': 'non_interessato'},
+    ) == [(33, 'media'), (18, 'bassa'), (24, 'bassa'), (0, 'bassa')]
+
+def test_soglie_di_priorita():
+    assert score(
+        {'settore': 'logistica', 'provincia': 'pn', 'dipendenti': 43},
+        {'settore': 'logistica', 'provincia': 'pn', 'dipendenti': 40},
+    ) == [(50, 'alta'), (49, 'media')]
+
+def test_ricalcolo_su_sqlite(sqlite_db):
+    from scoring import LeadScorer
+    with sqlite_db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO prospect (ragione_sociale, settore, provincia, dipendenti, stato, priorita)
+            VALUES ('Meccanica Rossi', 'Metalmeccanico', 'Udine', 100, 'nuovo', 'media'),
+                   ('Bar Sport', 'Ristorazione', 'Roma', 3, 'nuovo', 'urgente')
+        ''')
+    scorer = LeadScorer(sqlite_db)
+    
+    assert scorer.run(completo=True)['aggiornati'] == 2
+    with sqlite_db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT ragione_sociale, punteggio, priorita FROM prospect ORDER BY id')
+        # La priorità 'urgente' è manuale e non viene sovrascritta
+        assert cursor.fetchall() == [('Meccanica Rossi', 70, 'alta'), ('Bar Sport', 1, 'urgente')]
+    
+    # Esecuzione incrementale: nessun dato cambiato, nessun aggiornamento
+    risultato = scorer.run()
+    assert risultato['completo'] is False and risultato['aggiornati'] == 0
@@ -0,0 +1,174 @@
+"""Scraper contro un sito di prova servito da http.server su localhost (tests/fixtures/scraper)"""
+
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from scraper import Fetcher, HttpCache, OrganizationSource, RegistroImpreseSource, ScraperEngine, WebSource
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'scraper')
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """File statici con ETag e risposta 304 su If-None-Match; ogni richiesta resta nel log del server"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES, **kwargs)
+    
+    def do_GET(self):
+        self.server.richieste.append((self.path, time.monotonic(), self.headers.get('If-None-Match')))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as handle:
+            body = handle.read()
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path) + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    httpd.richieste = []
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def paths(server):
+    return [path for path, _, _ in server.richieste]
+
+def test_fetch_pagina(server, tmp_path):
+    fetcher = Fetcher(cache=HttpCache(str(tmp_path)), rate=0)
+    
+    html, modificata = fetcher.get(f'{server.url}/elenco.html')
+    
+    assert modificata is True
+    assert 'Meccanica Rossi' in html
+    assert fetcher.stats == {'richieste': 1, 'non_modificate': 0, 'scaricate': 1, 'errori': 0}
+
+def test_fetch_pagina_mancante(server):
+    fetcher = Fetcher(rate=0, retries=0)
+    
+    assert fetcher.get(f'{server.url}/non_esiste.html') is None
+    assert fetcher.stats['errori'] == 1
+
+def test_revalidazione_etag(server, tmp_path):
+    url = f'{server.url}/elenco.html'
+    primo = Fetcher(cache=HttpCache(str(tmp_path)), rate=0)
+    html, _ = primo.get(url)
+    
+    # Nuovo processo, stessa cache su disco: richiesta condizionale e corpo riletto dalla cache
+    secondo = Fetcher(cache=HttpCache(str(tmp_path)), rate=0)
+    cached, modificata = secondo.get(url)
+    
+    assert modificata is False
+    assert cached == html
+    assert secondo.stats['non_modificate'] == 1
+    assert server.richieste[0][2] is None
+    assert server.richieste[1][2] is not None
+
+def test_robots_txt(server):
+    fetcher = Fetcher(rate=0)
+    
+    assert fetcher.allowed(f'{server.url}/elenco.html')
+    assert not fetcher.allowed(f'{server.url}/privato/elenco_3.html')
+    # Regole lette una sola volta per host
+    fetcher.allowed(f'{server.url}/elenco_2.html')
+    assert paths(server).count('/robots.txt') == 1
+
+def test_engine_segue_paginazione_e_rispetta_robots(server):
+    engine = ScraperEngine(Fetcher(rate=0), workers=2)
+    source = RegistroImpreseSource([f'{server.url}/elenco.html'])
+    
+    leads = list(engine.run(source))
+    
+    assert sorted(lead['ragione_sociale'] for lead in leads) == [
+        'Alimentari Verdi S.r.l.', 'Logistica Bianchi S.p.A.', 'Meccanica Rossi S.r.l.'
+    ]
+    assert leads[0]['email'] == 'rossi@pec.it' and leads[0]['dipendenti'] == '45'
+    assert all(lead['fonte'] == 'camera_commercio' for lead in leads)
+    # Il link "Avanti" di pagina 2 punta a /privato/: mai richiesto
+    assert '/privato/elenco_3.html' not in paths(server)
+    assert '/privato/contatti.html' not in paths(server)
+
+def test_engine_senza_robots(server):
+    engine = ScraperEngine(Fetcher(rate=0), workers=2, respect_robots=False)
+    
+    leads = list(engine.run(RegistroImpreseSource([f'{server.url}/elenco.html'])))
+    
+    assert len(leads) == 4
+    assert '/robots.txt' not in paths(server)
+
+def test_engine_max_pages(server):
+    engine = ScraperEngine(Fetcher(rate=0), workers=2)
+    
+    leads = list(engine.run(RegistroImpreseSource([f'{server.url}/elenco.html'], max_pages=1)))
+    
+    assert len(leads) == 2
+    assert '/elenco_2.html' not in paths(server)
+
+def test_organization_json_ld(server):
+    engine = ScraperEngine(Fetcher(rate=0))
+    
+    leads = list(engine.run(OrganizationSource([f'{server.url}/organizzazione.html'])))
+    
+    assert leads == [{
+        'ragione_sociale': 'Tessile Neri S.r.l.',
+        'settore': 'Tessile',
+        'dipendenti': 80,
+        'indirizzo': 'Via Roma 1',
+        'provincia': 'PO',
+        'telefono': '0574 000000',
+        'email': '',
+        'sito_web': 'https://www.tessileneri.it',
+        'fonte': 'linkedin'
+    }]
+
+def test_limite_per_host(server):
+    # 5 richieste al secondo e una alla volta: almeno 0,2 s tra una richiesta e la successiva
+    fetcher = Fetcher(concurrency=1, rate=5)
+    url = f'{server.url}/elenco.html'
+    
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        risultati = list(pool.map(lambda _: fetcher.get(url), range(4)))
+    
+    assert all(risultato is not None for risultato in risultati)
+    istanti = sorted(istante for _, istante, _ in server.richieste)
+    intervalli = [b - a for a, b in zip(istanti, istanti[1:])]
+    assert len(intervalli) == 3
+    assert min(intervalli) >= 0.18
+
+def test_limite_indipendente_tra_host(server):
+    # Lo stesso server con due nomi: ogni host ha il proprio intervallo
+    fetcher = Fetcher(concurrency=1, rate=1)
+    porta = server.server_address[1]
+    
+    inizio = time.monotonic()
+    fetcher.get(f'http://127.0.0.1:{porta}/elenco.html')
+    fetcher.get(f'http://localhost:{porta}/elenco.html')
+    
+    assert time.monotonic() - inizio < 0.9
+
+def test_web_source_astratta():
+    with pytest.raises(TypeError):
+        WebSource(['http://127.0.0.1/'])
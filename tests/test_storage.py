@@ -0,0 +1,89 @@
+"""Traduzione dell'SQL PostgreSQL per SQLite e scelta del backend"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import PostgresBackend, SQLiteBackend, create_backend, translate
+
+@pytest.mark.parametrize('postgres, sqlite', [
+    ("SELECT id FROM email_outbox WHERE stato = 'in_attesa' FOR UPDATE SKIP LOCKED",
+     "SELECT id FROM email_outbox WHERE stato = 'in_attesa'"),
+    ('SELECT id FROM job_queue FOR UPDATE', 'SELECT id FROM job_queue'),
+    ('CREATE TEMP TABLE IF NOT EXISTS staging (id INT) ON COMMIT DELETE ROWS',
+     'CREATE TEMP TABLE IF NOT EXISTS staging (id INT)'),
+    ('CREATE TABLE t (c TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+     "CREATE TABLE t (c TIMESTAMP DEFAULT (datetime('now', 'localtime')))"),
+    ('SELECT CURRENT_TIMESTAMP - make_interval(secs => %s)',
+     "SELECT datetime('now', 'localtime', '-' || ? || ' seconds')"),
+    ("SELECT CURRENT_TIMESTAMP + %s * INTERVAL '1 day'",
+     "SELECT datetime('now', 'localtime', '+' || ? || ' days')"),
+    ("SELECT CURRENT_TIMESTAMP - %s * INTERVAL '1 hours'",
+     "SELECT datetime('now', 'localtime', '-' || ? || ' hours')"),
+    ("SELECT CURRENT_TIMESTAMP - INTERVAL '30 days'", "SELECT datetime('now', 'localtime', '-30 days')"),
+    ('SELECT CURRENT_TIMESTAMP, LOCALTIMESTAMP', "SELECT datetime('now', 'localtime'), datetime('now', 'localtime')"),
+    ("SELECT * FROM prospect WHERE stato = ANY(ARRAY['nuovo', 'contattato'])",
+     "SELECT * FROM prospect WHERE stato IN ('nuovo', 'contattato')"),
+    ('SELECT data::date, valori::int[] FROM attivita', 'SELECT data, valori FROM attivita'),
+    ("UPDATE prospect p SET stato = 'x' WHERE p.id = %s", "UPDATE prospect AS p SET stato = 'x' WHERE p.id = ?"),
+    ("UPDATE prospect SET stato = 'x'", "UPDATE prospect SET stato = 'x'"),
+    ('SELECT id %% 7 FROM prospect WHERE id > %s', 'SELECT id % 7 FROM prospect WHERE id > ?'),
+])
+def test_traduzione(postgres, sqlite):
+    assert translate(postgres).sql == sqlite
+
+def test_lista_espansa_nei_parametri():
+    statement = translate('SELECT * FROM prospect WHERE id = ANY(%s) AND stato = %s')
+    assert statement.bind(([3, 5, 8], 'nuovo')) == (
+        'SELECT * FROM prospect WHERE id IN (?, ?, ?) AND stato = ?', (3, 5, 8, 'nuovo')
+    )
+    # Senza liste i parametri passano invariati
+    assert translate('SELECT %s').bind(['a']) == ('SELECT ?', ('a',))
+
+@pytest.mark.parametrize('sql, kind', [
+    ('SELECT 1', 'read'),
+    ('  with x AS (SELECT 1) SELECT * FROM x', 'read'),
+    ('WITH x AS (DELETE FROM t RETURNING *) SELECT * FROM x', 'write'),
+    ("SELECT id FROM email_outbox FOR UPDATE SKIP LOCKED", 'write'),
+    ('INSERT INTO t VALUES (1)', 'write'),
+    ('SELECT pg_advisory_xact_lock(%s)', 'lock'),
+    ('COMMIT', 'control'),
+])
+def test_tipo_di_istruzione(sql, kind):
+    assert translate(sql).kind == kind
+
+def test_tabella_temporanea_svuotata_al_commit():
+    assert translate('CREATE TEMP TABLE s (id INT) ON COMMIT DELETE ROWS').on_commit_delete == 's'
+    assert translate('CREATE TEMP TABLE s (id INT)').on_commit_delete is None
+
+def test_intervalli_eseguiti_su_sqlite(sqlite_db):
+    with sqlite_db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT CURRENT_TIMESTAMP, CURRENT_TIMESTAMP - make_interval(secs => %s),
+                   CURRENT_TIMESTAMP + %s * INTERVAL '1 day', CURRENT_TIMESTAMP - INTERVAL '2 hours'
+        ''', (90, 3))
+        adesso, prima, dopo, ore = cursor.fetchone()
+    assert isinstance(adesso, datetime)
+    assert adesso - prima == timedelta(seconds=90)
+    assert dopo - adesso == timedelta(days=3)
+    assert adesso - ore == timedelta(hours=2)
+
+def test_backend_da_configurazione(monkeypatch, tmp_path):
+    monkeypatch.delenv('SQLITE_PATH', raising=False)
+    # Nessun ripiego silenzioso su SQLite senza configurazione
+    assert create_backend(None) is None
+    assert create_backend('') is None
+    for url in ('sqlite:', 'sqlite://', 'sqlite:///'):
+        with pytest.raises(ValueError):
+            create_backend(url)
+    
+    backend = create_backend(f"sqlite:///{tmp_path / 'esplicito.db'}")
+    assert isinstance(backend, SQLiteBackend)
+    backend.close()
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'locale.db'))
+    backend = create_backend(None)
+    assert isinstance(backend, SQLiteBackend)
+    backend.close()
+    # Il pool PostgreSQL si apre alla prima connessione, non alla creazione
+    assert isinstance(create_backend('postgresql://etjca@localhost/etjca'), PostgresBackend)
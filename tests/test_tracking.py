@@ -0,0 +1,116 @@
+"""Token firmati, link tracciati e buffer degli eventi di apertura e click"""
+
+import os
+
+import pytest
+
+import tracking
+from tracking import TrackingBuffer
+
+@pytest.fixture(autouse=True)
+def configurazione(monkeypatch):
+    monkeypatch.setattr(tracking, 'SECRET', 'segreto-di-prova')
+    monkeypatch.setattr(tracking, 'BASE_URL', 'https://agente.etjca.it')
+
+def test_token_andata_e_ritorno():
+    token = tracking.make_token(42, 7)
+    assert token.startswith('42-7-') and len(token.split('-')[2]) == 16
+    assert tracking.read_token(token) == (42, 7)
+    assert tracking.read_token(tracking.make_token(None, None)) == (None, None)
+
+@pytest.mark.parametrize('token', [
+    '43-7-' + '0' * 16,
+    'abc',
+    '',
+    None,
+])
+def test_token_non_validi(token):
+    assert tracking.read_token(token) is None
+
+def test_token_alterato_o_altro_segreto(monkeypatch):
+    token = tracking.make_token(42, 7)
+    prospect, messaggio, firma = token.split('-')
+    assert tracking.read_token(f'43-{messaggio}-{firma}') is None
+    monkeypatch.setattr(tracking, 'SECRET', 'altro-segreto')
+    assert tracking.read_token(token) is None
+    # Senza segreto nessun token è valido
+    monkeypatch.setattr(tracking, 'SECRET', '')
+    assert tracking.read_token(token) is None
+
+def test_click_firmato_sulla_destinazione():
+    token = tracking.make_token(42, 7)
+    url = tracking.click_url(token, 'https://www.etjca.it/lavora-con-noi?a=1&b=2')
+    assert url.startswith(f'https://agente.etjca.it/t/c/{token}?u=https%3A%2F%2Fwww.etjca.it%2F')
+    firma = url.rsplit('&s=', 1)[1]
+    assert tracking.verify_click(token, 'https://www.etjca.it/lavora-con-noi?a=1&b=2', firma)
+    # Nessun redirect aperto: un'altra destinazione con la stessa firma non passa
+    assert not tracking.verify_click(token, 'https://evil.example.com/', firma)
+    assert not tracking.verify_click(token, '', firma)
+
+def test_link_nel_testo():
+    token = tracking.make_token(1, 2)
+    corpo = 'Visiti www.etjca.it, oppure (https://etjca.it/servizi).\nA presto'
+    tracciato = tracking.track_text(corpo, token)
+    assert tracciato.count('/t/c/') == 2
+    # La punteggiatura che chiude la frase resta fuori dal link
+    assert '%2F%2Fwww.etjca.it&s=' in tracciato and ', oppure (' in tracciato
+    assert tracciato.endswith(').\nA presto')
+
+def test_versione_html():
+    token = tracking.make_token(1, 2)
+    html = tracking.track_html('Prezzi <bassi> & servizi: www.etjca.it\nGrazie', token)
+    assert 'Prezzi &lt;bassi&gt; &amp; servizi: <a href="https://agente.etjca.it/t/c/' in html
+    assert '>www.etjca.it</a><br>\nGrazie' in html
+    assert f'<img src="https://agente.etjca.it/t/o/{token}.gif"' in html
+
+def buffer_senza_thread(db, **kwargs) -> TrackingBuffer:
+    buffer = TrackingBuffer(db, flush_interval=3600, **kwargs)
+    # Flush solo esplicito nei test: nessun thread di sfondo né flush all'uscita
+    buffer._pid = os.getpid()
+    return buffer
+
+def test_tipo_non_valido():
+    with pytest.raises(ValueError):
+        buffer_senza_thread(None).record('inoltro', 1, 2)
+
+def test_buffer_pieno_scarta_i_piu_vecchi():
+    buffer = buffer_senza_thread(None, max_pending=3)
+    for n in range(5):
+        buffer.record('apertura', n, n)
+    assert len(buffer) == 3 and buffer.scartati == 2
+    assert [event[0] for event in buffer._events] == [2, 3, 4]
+
+class DatabaseNonDisponibile:
+    def connection(self):
+        raise ConnectionError('database non raggiungibile')
+
+def test_scrittura_fallita_rimette_gli_eventi_in_testa():
+    buffer = buffer_senza_thread(DatabaseNonDisponibile())
+    buffer.record('apertura', 1, 1)
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    buffer.record('click', 2, 2, url='https://www.etjca.it')
+    assert [event[2] for event in buffer._events] == ['apertura', 'click']
+
+def test_flush_e_statistiche_su_sqlite(sqlite_db):
+    with sqlite_db.connection() as conn:
+        cursor = conn.cursor()
+        for n in range(4):
+            cursor.execute('''
+                INSERT INTO email_outbox (chiave, job_id, destinatario, stato)
+                VALUES (%s, 1, %s, 'inviata')
+            ''', (f'job1-{n}', f'hr{n}@x.it'))
+    buffer = buffer_senza_thread(sqlite_db)
+    buffer.record('apertura', None, 1, user_agent='Mozilla/5.0')
+    buffer.record('apertura', None, 1)
+    buffer.record('apertura', None, 2)
+    buffer.record('click', None, 2, url='https://www.etjca.it')
+    buffer.record('click', None, 2, url='https://www.etjca.it/contatti')
+    
+    assert buffer.flush() == 5
+    assert len(buffer) == 0 and buffer.flush() == 0
+    assert buffer.stats(job_id=1) == {
+        'inviate': 4, 'aperte': 2, 'cliccate': 1, 'click': 2,
+        'tasso_apertura': 50.0, 'tasso_click': 25.0
+    }
+    assert buffer.stats(job_id=2)['tasso_apertura'] == 0.0
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+ETJCA Tracking - Aperture (pixel) e click (link di reindirizzamento) delle email inviate
+Gli eventi restano in memoria e vengono scritti a blocchi con INSERT multi-riga: ogni
+TRACKING_FLUSH_INTERVAL secondi, appena il buffer arriva a TRACKING_FLUSH_SIZE eventi e all'uscita del processo
+"""
+
+import os
+import re
+import hmac
+import html
+import atexit
+import base64
+import hashlib
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import metrics
+
+# Indirizzo pubblico dell'app nei link delle email; senza segreto il tracciamento è spento
+BASE_URL = os.getenv('TRACKING_BASE_URL', os.getenv('RAILWAY_STATIC_URL', '')).rstrip('/')
+SECRET = os.getenv('TRACKING_SECRET', '')
+ENABLED = bool(BASE_URL and SECRET)
+
+FLUSH_INTERVAL = float(os.getenv('TRACKING_FLUSH_INTERVAL', 5))
+FLUSH_SIZE = int(os.getenv('TRACKING_FLUSH_SIZE', 500))
+# Eventi tenuti in memoria se il database non risponde: oltre, i più vecchi vengono scartati
+MAX_PENDING = int(os.getenv('TRACKING_MAX_PENDING', 50000))
+# Righe per INSERT (6 parametri ciascuna)
+INSERT_ROWS = 500
+
+TIPI = ('apertura', 'click')
+
+# GIF trasparente 1x1
+PIXEL = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+# Link nel testo delle email, senza la punteggiatura che chiude la frase
+URL = re.compile(r'(?:https?://|www\.)[^\s<>"]*[^\s<>".,;:!?)\]]')
+
+def sign(value: str) -> str:
+    return hmac.new(SECRET.encode(), value.encode(), hashlib.sha256).hexdigest()[:16]
+
+def make_token(id_prospect: Optional[int], id_messaggio: Optional[int] = None) -> str:
+    """Token firmato con prospect e messaggio dell'outbox: gli id non si possono alterare"""
+    value = f'{id_prospect or 0}-{id_messaggio or 0}'
+    return f'{value}-{sign(value)}'
+
+def read_token(token: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """(id_prospect, id_messaggio) di un token valido, altrimenti None"""
+    match = re.fullmatch(r'(\d+)-(\d+)-([0-9a-f]{16})', token or '')
+    if not match or not SECRET or not hmac.compare_digest(match.group(3), sign(f'{match.group(1)}-{match.group(2)}')):
+        return None
+    return int(match.group(1)) or None, int(match.group(2)) or None
+
+def pixel_url(token: str) -> str:
+    return f'{BASE_URL}/t/o/{token}.gif'
+
+def click_url(token: str, url: str) -> str:
+    """Link di reindirizzamento; la firma copre anche la destinazione (nessun redirect aperto)"""
+    return f"{BASE_URL}/t/c/{token}?u={quote(url, safe='')}&s={sign(token + url)}"
+
+def verify_click(token: str, url: str, signature: str) -> bool:
+    return bool(SECRET and url) and hmac.compare_digest(signature or '', sign(token + url))
+
+def target(url: str) -> str:
+    """www.etjca.it -> https://www.etjca.it"""
+    return url if re.match(r'https?://', url) else f'https://{url}'
+
+def track_text(corpo: str, token: str) -> str:
+    """Corpo testuale con i link sostituiti dai reindirizzamenti"""
+    return URL.sub(lambda match: click_url(token, target(match.group(0))), corpo)
+
+def track_html(corpo: str, token: str) -> str:
+    """Versione HTML del corpo testuale: link tracciati e pixel delle aperture"""
+    parts, last = [], 0
+    for match in URL.finditer(corpo):
+        parts.append(html.escape(corpo[last:match.start()]))
+        href = html.escape(click_url(token, target(match.group(0))))
+        parts.append(f'<a href="{href}">{html.escape(match.group(0))}</a>')
+        last = match.end()
+    parts.append(html.escape(corpo[last:]))
+    body = ''.join(parts).replace('\n', '<br>\n')
+    pixel = html.escape(pixel_url(token))
+    return (f'<html><body style="font-family: sans-serif">{body}'
+            f'<img src="{pixel}" width="1" height="1" alt=""></body></html>')
+
+class TrackingBuffer:
+    """Eventi di tracciamento in memoria, scritti dal thread di flush in una transazione per blocco;
+    se la scrittura fallisce tornano in testa al buffer (almeno una volta, anche all'uscita)"""
+    
+    def __init__(self, db_manager, flush_interval: float = FLUSH_INTERVAL, flush_size: int = FLUSH_SIZE,
+                 max_pending: int = MAX_PENDING):
+        self.db_manager = db_manager
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.scartati = 0
+        self._events: List[tuple] = []
+        self._lock = threading.Lock()
+        # Una scrittura alla volta: il thread e il flush all'uscita non si sovrappongono
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+    
+    def __len__(self) -> int:
+        return len(self._events)
+    
+    def record(self, tipo: str, id_prospect: Optional[int], id_messaggio: Optional[int],
+               url: Optional[str] = None, user_agent: Optional[str] = None):
+        """Accoda un evento senza toccare il database; sveglia il thread se il blocco è pieno"""
+        if tipo not in TIPI:
+            raise ValueError(f"Tipo evento non valido: {tipo}")
+        self.start()
+        metrics.TRACKING_EVENTS.inc(tipo=tipo)
+        row = (id_prospect, id_messaggio, tipo, url, (user_agent or '')[:255] or None, datetime.now())
+        with self._lock:
+            self._events.append(row)
+            self._trim()
+            full = len(self._events) >= self.flush_size
+        if full:
+            self._wake.set()
+    
+    def _trim(self):
+        eccesso = len(self._events) - self.max_pending
+        if eccesso > 0:
+            del self._events[:eccesso]
+            self.scartati += eccesso
+            logging.warning(f"Tracciamento: buffer pieno, {eccesso} eventi scartati")
+    
+    def start(self):
+        """Avvia il thread di flush nel processo corrente (dopo un fork il figlio parte vuoto)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                self._events = []
+            self._pid = pid
+        threading.Thread(target=self._run, name='tracking-flush', daemon=True).start()
+        atexit.register(self.close)
+    
+    def _run(self):
+        while self._pid == os.getpid():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.warning(f"Tracciamento: scrittura rimandata ({len(self)} eventi in attesa): {e}")
+                # Database non disponibile: si riprova dopo l'intervallo, non a ogni nuovo evento
+                time.sleep(self.flush_interval)
+    
+    def flush(self) -> int:
+        """Scrive tutti gli eventi in attesa in un'unica transazione; restituisce quanti ne ha scritti"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            try:
+                self._write(events)
+            except Exception:
+                with self._lock:
+                    self._events[:0] = events
+                    self._trim()
+                raise
+        return len(events)
+    
+    def _write(self, events: List[tuple]):
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(events), INSERT_ROWS):
+                chunk = events[start:start + INSERT_ROWS]
+                values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(chunk))
+                cursor.execute(f'''
+                    INSERT INTO email_eventi (id_prospect, id_messaggio, tipo, url, user_agent, registrato_il)
+                    VALUES {values}
+                ''', [value for row in chunk for value in row])
+    
+    def close(self):
+        """Ultimo flush all'uscita del processo (atexit, worker_exit di gunicorn)"""
+        try:
+            scritti = self.flush()
+        except Exception as e:
+            logging.error(f"Tracciamento: {len(self)} eventi non salvati all'uscita: {e}")
+            return
+        if scritti:
+            logging.info(f"📬 Tracciamento: {scritti} eventi salvati all'uscita")
+    
+    def stats(self, job_id: Optional[int] = None) -> Dict:
+        """Messaggi inviati, aperti e cliccati (della campagna job_id o di tutte)"""
+        where, params = "o.stato = 'inviata'", []
+        if job_id is not None:
+            where += ' AND o.job_id = %s'
+            params.append(job_id)
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT COUNT(DISTINCT o.id),
+                       COUNT(DISTINCT e.id_messaggio) FILTER (WHERE e.tipo = 'apertura'),
+                       COUNT(DISTINCT e.id_messaggio) FILTER (WHERE e.tipo = 'click'),
+                       COUNT(e.id) FILTER (WHERE e.tipo = 'click')
+                FROM email_outbox o
+                LEFT JOIN email_eventi e ON e.id_messaggio = o.id
+                WHERE {where}
+            ''', params)
+            inviate, aperte, cliccate, click = cursor.fetchone()
+        return {
+            'inviate': inviate,
+            'aperte': aperte,
+            'cliccate': cliccate,
+            'click': click,
+            'tasso_apertura': round(aperte / inviate * 100, 1) if inviate else 0.0,
+            'tasso_click': round(cliccate / inviate * 100, 1) if inviate else 0.0,
+        }